@@ -0,0 +1,74 @@
+###############################################################################################################################
+#
+# Microbenchmark of pdf2txt.cleaned_text() against the original 25-pass implementation, in MB/s on the generated corpus.
+# That both produce the same output is tested in tests/test_cleaned_text.py.
+#
+# Usage: python -m benchmarks.bench_cleaned_text [n_docs]
+#
+###############################################################################################################################
+
+import re
+import sys
+import time
+
+import nltk
+
+from benchmarks.fixtures import synthetic_corpus
+from pipeline import pdf2txt
+
+# The word set of the original implementation
+WORDS = set(nltk.corpus.words.words())
+
+
+def reference_cleaned_text(text):
+    """ The original implementation of cleaned_text() """
+    text = re.sub(r'(?i)^(.*?Introduction)', '', text)
+    text = re.sub(r'(?i)^(.*?INTRODUCTION)', '', text)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'[\(\)\[\]\{\}]', '', text)
+    text = re.sub(r'\d+', '', text)
+    text = re.sub(r'https?://\S+', '', text)
+    text = re.sub(r'\\', '', text)
+    text = re.sub(r'-\s+', '', text)
+    text = re.sub(r'[^\x00-\x7F]+', '', text)
+    text = re.sub(r'\s+[a-zA-Z]\s+', '', text)
+    text = re.sub(r'\\[a-zA-Z0-9]+', '', text)
+    text = re.sub(r'\s+(?=[^a-zA-Z0-9])', '', text)
+    text = re.sub(r'(?<=[^a-zA-Z0-9])\s+', '', text)
+    text = re.sub(r'(?<=[^a-zA-Z0-9])\s+(?=[^a-zA-Z0-9])', '', text)
+    text = re.sub(r'([a-zA-Z0-9])\1{3,}', r'\1', text)
+    text = re.sub(r'([^\s\w]|_)\1{3,}', r'\1', text)
+    text = re.sub(r'([^\s\w]|_)+', r'\1 ', text)
+    text = re.sub(r'=', '', text)
+    text = re.sub(r'\w*\\+\w*', '', text)
+    text = re.sub(r'\s+[a-zA-Z]\s+,', '', text)
+    text = " ".join(w for w in nltk.wordpunct_tokenize(text) if w.lower() in WORDS or not w.isalpha())
+    text = text.strip()
+    return text
+
+
+def throughput(function, corpus, repeat: int = 3) -> float:
+    """ Best throughput of function over the corpus in MB/s """
+    size = sum(len(text.encode("utf-8")) for text in corpus)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            function(text)
+        best = min(best, time.perf_counter() - start)
+    return size / best / 1e6
+
+
+def main(n_docs: int = 50):
+    corpus = synthetic_corpus(n_docs)
+
+    print("{} documents.".format(len(corpus)))
+    reference = throughput(reference_cleaned_text, corpus)
+    current = throughput(pdf2txt.cleaned_text, corpus)
+    print("reference:  {:.2f} MB/s".format(reference))
+    print("current:    {:.2f} MB/s".format(current))
+    print("speedup:    {:.1f}x".format(current / reference))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,92 @@
+###############################################################################################################################
+#
+# Benchmark of the near-duplicate detection (pipeline.dedup).
+#
+# Three parts: the MinHash signatures of cleaned synthetic texts (time per document in a worker, and near-duplicates
+# made by editing words of a text are found while other texts are not), and the LSH index of the parent on n
+# documents. The index gets random signatures of distinct documents and, for every 100th document, a planted
+# near-duplicate with a similarity of 0.9. Reported are the checks per second in blocks of documents (they must not slow
+# down as the index grows), the memory of the index per document and the share of the planted duplicates found.
+#
+# Usage: python -m benchmarks.bench_dedup [n_documents]
+#
+###############################################################################################################################
+
+import random
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.fixtures import synthetic_text
+from pipeline import dedup, pdf2txt
+
+N_DOCUMENTS = 200000
+# Every DUPLICATE_EVERY-th document of the index benchmark is followed by a near-duplicate
+DUPLICATE_EVERY = 100
+DUPLICATE_SIMILARITY = 0.9
+N_TEXTS = 20
+
+
+def edited(text: str, share: float, seed: int = 0) -> str:
+    """ The text with a share of its words replaced """
+    rng = random.Random(seed)
+    words = text.split()
+    for i in rng.sample(range(len(words)), int(len(words) * share)):
+        words[i] = "edited{}".format(i)
+    return " ".join(words)
+
+
+def peak_rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        return int([line for line in f if line.startswith("VmHWM")][0].split()[1]) / 1e3
+
+
+def check_signatures():
+    texts = [pdf2txt.cleaned_text(synthetic_text(seed)) for seed in range(N_TEXTS)]
+    start = time.perf_counter()
+    signatures = [dedup.signature(text) for text in texts]
+    seconds = (time.perf_counter() - start) / len(texts)
+    print("Signatures: {:.1f} ms per text of {} words ({:.1f} MB/s).".format(
+        seconds * 1000, np.mean([len(text.split()) for text in texts]), np.mean([len(text) for text in texts]) / seconds / 1e6))
+
+    with dedup.Deduplicator() as deduplicator:
+        for i, signature in enumerate(signatures):
+            assert deduplicator.check(str(i), signature) is None, "distinct texts {} and {} are near-duplicates".format(i, deduplicator.check(str(i), signature))
+        assert deduplicator.check("copy", signatures[0]) == "0"
+        assert deduplicator.check("edited", dedup.signature(edited(texts[1], 0.01))) == "1"
+        assert deduplicator.check("rewritten", dedup.signature(edited(texts[2], 0.5))) is None
+    print("Copies and texts with 1% edited words are found, texts with half of the words edited are kept.")
+
+
+def check_index(n_documents: int):
+    rng = np.random.default_rng(0)
+    rss = peak_rss_mb()
+    planted = found = 0
+    block = max(1, n_documents // 5)
+    with dedup.Deduplicator() as deduplicator:
+        start = time.perf_counter()
+        for i in range(n_documents):
+            signature = rng.integers(0, 2**32, size=dedup.NUM_PERM, dtype=np.uint64).astype(np.uint32)
+            assert deduplicator.check(str(i), signature) is None, "random signature {} is a near-duplicate".format(i)
+            if i % DUPLICATE_EVERY == 0:
+                changed = rng.choice(dedup.NUM_PERM, int(dedup.NUM_PERM * (1 - DUPLICATE_SIMILARITY)), replace=False)
+                duplicate = signature.copy()
+                duplicate[changed] += np.uint32(1)
+                planted += 1
+                found += deduplicator.check("duplicate of " + str(i), duplicate) == str(i)
+            if (i + 1) % block == 0:
+                seconds = time.perf_counter() - start
+                print("Index: {:>8} documents, {:8.0f} checks/s".format(i + 1, block / seconds))
+                start = time.perf_counter()
+        print("Index memory: {:.0f} bytes per document. Found {} of {} planted near-duplicates ({:.1%}).".format(
+            (peak_rss_mb() - rss) * 1e6 / n_documents, found, planted, found / planted))
+
+
+def main(n_documents=N_DOCUMENTS):
+    check_signatures()
+    check_index(n_documents)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else N_DOCUMENTS)
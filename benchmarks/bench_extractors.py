@@ -0,0 +1,66 @@
+###############################################################################################################################
+#
+# Benchmark of the PDF text extractors in pipeline/extractors.py.
+#
+# Every available extractor converts the same generated PDF corpus. Reported are docs/s and the CPU time per document,
+# including the CPU time of the subprocesses for the command line extractors. Extractors whose tool or package is
+# missing are skipped.
+#
+# Usage: python -m benchmarks.bench_extractors [n_docs] [n_pages]
+#
+###############################################################################################################################
+
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import synthetic_pdf_corpus
+from pipeline import extractors
+
+
+def cpu_time() -> float:
+    """ User and system CPU time of this process and its finished children """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def run(name: str, pdffiles: list, timelimit: float = 60):
+    """
+    Convert all PDFs with one extractor.
+
+    Returns
+    -------
+    result : dict or None
+        "docs_per_second", "cpu_ms_per_doc" and "chars", None if the extractor is not available
+    """
+    extractor = extractors.EXTRACTORS[name]
+    try:
+        extractor.extract(pdffiles[0], timelimit)  # warm up (imports, page cache)
+    except Exception as e:
+        print("{:<12} skipped: {}".format(name, e))
+        return None
+
+    chars = 0
+    wall, cpu = time.perf_counter(), cpu_time()
+    for pdffile in pdffiles:
+        chars += len(extractor.extract(pdffile, timelimit))
+    wall, cpu = time.perf_counter() - wall, cpu_time() - cpu
+
+    return {"docs_per_second": len(pdffiles) / wall, "cpu_ms_per_doc": cpu / len(pdffiles) * 1000, "chars": chars}
+
+
+def main(n_docs: int = 50, n_pages: int = 5):
+    with tempfile.TemporaryDirectory() as directory:
+        pdffiles = synthetic_pdf_corpus(directory, n_docs=n_docs, n_pages=n_pages)
+        print("Corpus: {} PDFs with {} pages each.".format(n_docs, n_pages))
+
+        for name in extractors.EXTRACTORS:
+            result = run(name, pdffiles)
+            if result is not None:
+                print("{:<12} {:8.1f} docs/s  {:8.1f} ms CPU/doc  {:>9} chars".format(
+                    name, result["docs_per_second"], result["cpu_ms_per_doc"], result["chars"]))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,67 @@
+###############################################################################################################################
+#
+# Microbenchmark of fixunicode.fix_unicode() against the original implementation with one regex pass per entry of
+# unicode_mapping, in MB/s on the generated corpus with ligatures and on its pure ASCII variant. That both produce the
+# same output is tested in tests/test_fixunicode.py.
+#
+# Usage: python -m benchmarks.bench_fixunicode [n_docs]
+#
+###############################################################################################################################
+
+import random
+import re
+import sys
+import time
+import unicodedata
+
+from benchmarks.fixtures import synthetic_corpus
+from helpers import fixunicode
+
+
+def reference_fix_unicode(txt):
+    """ The original implementation of fix_unicode() """
+    for search, replace in fixunicode.unicode_mapping.items():
+        txt = re.subn(search, replace, txt)[0]
+    return unicodedata.normalize('NFKC', txt)
+
+
+def ligature_corpus(corpus, seed: int = 0):
+    """ The corpus with ligatures, quotes and sharp s sprinkled in, as they come from PDF extractors """
+    rng = random.Random(seed)
+    replacements = [("fi", "ﬁ"), ("ff", "ﬀ"), ("fl", "ﬂ"), (" '", " ‘"), ("' ", "’ "), ("ss", "ß"), ("-", "—"), (" ", "\xa0")]
+    texts = []
+    for text in corpus:
+        for plain, fancy in rng.sample(replacements, 4):
+            text = text.replace(plain, fancy, rng.randint(1, 50))
+        texts.append(text)
+    return texts
+
+
+def throughput(function, corpus, repeat: int = 3) -> float:
+    """ Best throughput of function over the corpus in MB/s """
+    size = sum(len(text.encode("utf-8")) for text in corpus)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            function(text)
+        best = min(best, time.perf_counter() - start)
+    return size / best / 1e6
+
+
+def main(n_docs: int = 50):
+    corpus = synthetic_corpus(n_docs)
+    unicode_corpus = ligature_corpus(corpus)
+    ascii_corpus = [text.encode("ascii", "ignore").decode("ascii") for text in corpus]
+
+    print("{} documents.".format(len(corpus)))
+
+    for name, texts in (("unicode", unicode_corpus), ("ascii", ascii_corpus)):
+        reference = throughput(reference_fix_unicode, texts)
+        current = throughput(fixunicode.fix_unicode, texts)
+        print("{:<8} reference: {:8.2f} MB/s   current: {:8.2f} MB/s   speedup: {:.1f}x".format(
+            name, reference, current, current / reference))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,142 @@
+###############################################################################################################################
+#
+# Benchmark of the fulltext merge: the id-keyed join of merge_fulltext() against the former dataframe merge.
+#
+# Both read the same synthetic metadata and worker records (with duplicated versions and old-style ids with a subject
+# class) and write arxiv_fulltext.json to a temporary directory. Reported are the time and, in a second run (tracing
+# slows down Python code much more than pandas), the peak memory traced by tracemalloc. The outputs are compared on
+# the papers that the former merge could match.
+#
+# Usage: python -m benchmarks.bench_merge [rows] [text_kb]
+#
+###############################################################################################################################
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+from datasources import arxiv
+
+ROWS = 20000
+TEXT_KB = 20
+
+
+def synthetic_metadata(rows: int, seed: int = 0) -> pd.DataFrame:
+    """ Kaggle-style metadata frame with 10% old-style ids, a third of them with a subject class """
+    rng = random.Random(seed)
+    ids = []
+    for i in range(rows):
+        if i % 10 == 0:
+            archive = rng.choice(["hep-th", "math", "cond-mat", "astro-ph"])
+            if i % 30 == 0:
+                archive += "." + rng.choice(["GT", "AG", "CO"])
+            ids.append("{}/{:02d}{:02d}{:03d}".format(archive, 92 + i // 100000 % 8, i // 1000 % 12 + 1, i % 1000))
+        else:
+            ids.append("{:02d}{:02d}.{:05d}".format(7 + i // 1200000, i // 100000 % 12 + 1, i % 100000))
+    return pd.DataFrame({
+        "id": ids,
+        "title": ["Title {}".format(i) for i in range(rows)],
+        "abstract": ["An  abstract of paper {} with a x single letter.".format(i) for i in range(rows)],
+    })
+
+
+def file_name(arxiv_id: str, version: int) -> str:
+    """ PDF file name of an id in the GCP Bucket layout """
+    archive, _, number = arxiv_id.rpartition("/")
+    return archive.split(".")[0] + number + "v{}.pdf".format(version)
+
+
+def synthetic_records(arxiv_metadata_df, text_kb: int, seed: int = 0) -> list:
+    """ Worker records for 90% of the papers, 5% of them in two versions, and a few failed extractions """
+    rng = random.Random(seed)
+    records = []
+    for arxiv_id in arxiv_metadata_df["id"]:
+        if rng.random() < 0.1:
+            continue
+        versions = [1, 2] if rng.random() < 0.05 else [1]
+        rng.shuffle(versions)
+        for version in versions:
+            text = None if rng.random() < 0.01 else "{} v{} ".format(arxiv_id, version) * (text_kb * 1024 // 20)
+            records.append({"path": "tmp/arxiv_pdf/" + file_name(arxiv_id, version), "text": text})
+    return records
+
+
+def former_merge(arxiv_metadata_df, records):
+    """ The former implementation of merge_fulltext() """
+    file_list = [[os.path.basename(record["path"]), record["text"]] for record in records if record["text"] is not None]
+    arxiv_fulltext_df = pd.DataFrame(file_list, columns=["id", "text"])
+    arxiv_fulltext_df["id"] = (
+        arxiv_fulltext_df["id"].str.replace(r"\.(txt|pdf)$", "", regex=True)
+        .str.replace(r"v\d+$", "", regex=True)
+        .str.replace(r"^([a-z\-]+)(\d{7})$", r"\1/\2", regex=True)
+    )
+    arxiv_fulltext_df.drop_duplicates(subset="id", inplace=True)
+    arxiv_metadata_df.drop_duplicates(subset="id", inplace=True)
+    processed_arxiv_df = pd.merge(arxiv_metadata_df, arxiv_fulltext_df, on="id")
+    processed_arxiv_df["abstract"] = arxiv.clean_abstracts(processed_arxiv_df["abstract"])
+    processed_arxiv_df.to_json("./arxiv_fulltext.json", orient="records", lines=True)
+
+
+def measure(function, arguments):
+    """ Seconds, peak traced memory in MB and the written records of function(*arguments()) """
+    args = arguments()
+    start = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start
+
+    args = arguments()
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    with open("./arxiv_fulltext.json") as f:
+        output = [json.loads(line) for line in f]
+    os.remove("./arxiv_fulltext.json")
+    return seconds, peak, output
+
+
+def main(rows: int = ROWS, text_kb: int = TEXT_KB):
+    metadata_df = synthetic_metadata(rows)
+    records = synthetic_records(metadata_df, text_kb)
+    texts_mb = sum(len(record["text"]) for record in records if record["text"] is not None) / 1e6
+    print("{} metadata rows, {} records, {:.0f} MB of text.".format(rows, len(records), texts_mb))
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            former = measure(former_merge, lambda: (metadata_df.copy(), records))
+            current = measure(arxiv.merge_fulltext, lambda: (metadata_df, iter(records)))
+        finally:
+            os.chdir(cwd)
+
+    for name, (seconds, peak, output) in (("pd.merge", former), ("id lookup", current)):
+        print("{:<10} {:8.2f} s   peak {:8.1f} MB   {} papers".format(name, seconds, peak, len(output)))
+
+    # Highest version of every paper
+    expected = {}
+    for record in records:
+        if record["text"] is not None:
+            pdf_id, version = arxiv.parse_file_name(os.path.basename(record["path"]))
+            if version > expected.get(pdf_id, (-1, None))[0]:
+                expected[pdf_id] = (version, record["text"])
+
+    current_texts = {arxiv.normalize_id(paper["id"]): paper for paper in current[2]}
+    assert set(current_texts) == set(expected), "the merge lost or invented papers"
+    for pdf_id, (version, text) in expected.items():
+        assert current_texts[pdf_id]["text"] == text, "{} is not the text of the highest version".format(pdf_id)
+    for paper in former[2]:
+        ours = current_texts[arxiv.normalize_id(paper["id"])]
+        assert {k: v for k, v in ours.items() if k != "text"} == {k: v for k, v in paper.items() if k != "text"}
+    print("Output: the same metadata as pd.merge on its {} papers, plus {} old-style ids with a subject class; "
+          "highest versions kept.".format(len(former[2]), len(current[2]) - len(former[2])))
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
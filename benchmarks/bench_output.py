@@ -0,0 +1,95 @@
+###############################################################################################################################
+#
+# Benchmark of the output formats: line-delimited JSON (plain and gzip) against Parquet (zstd) with token counts.
+#
+# Synthetic arXiv records (metadata of datasources.arxiv.METADATA_COLUMNS and a text of text_kb) are written with the
+# writers of pipeline.writer to a temporary directory. Reported are the time to write, the file size, the time to read
+# everything back and the time to read only the metadata, which Parquet readers get without touching the texts. The
+# texts read back from every file have to match (they are compared by hash, to keep the memory of the run low).
+#
+# Usage: python -m benchmarks.bench_output [rows] [text_kb]
+#
+###############################################################################################################################
+
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from benchmarks.fixtures import synthetic_text
+from datasources import arxiv
+from pipeline import writer
+
+ROWS = 20000
+TEXT_KB = 20
+# Number of distinct texts, the records cycle through them
+N_TEXTS = 50
+
+
+def synthetic_records(rows: int, text_kb: int):
+    """ Records like those of datasources.arxiv.stream_fulltext() """
+    texts = [synthetic_text(seed, n_words=text_kb * 1024 // 6)[:text_kb * 1024] for seed in range(N_TEXTS)]
+    for i in range(rows):
+        yield {
+            "id": "{:02d}{:02d}.{:05d}".format(7 + i // 1200000, i // 100000 % 12 + 1, i % 100000),
+            "submitter": "Submitter {}".format(i % 500),
+            "authors": "A. Author, B. Author and C. Author {}".format(i % 1000),
+            "title": "Title of paper {}".format(i),
+            "doi": None if i % 3 else "10.1000/{}".format(i),
+            "categories": ["cs.AI cs.LG", "cs.CL", "math.CO", "hep-th"][i % 4],
+            "abstract": "An abstract of paper {} about a topic.".format(i),
+            "versions": [{"version": "v1", "created": "Mon, 2 Apr 2007 19:18:42 GMT"}],
+            "update_date": "2008-11-{:02d}".format(i % 28 + 1),
+            "text": texts[i % N_TEXTS],
+        }
+
+
+def write(path: str, rows: int, text_kb: int, output_format: str, compression: str = None) -> tuple:
+    """ Seconds to write the records and the written file """
+    start = time.perf_counter()
+    with writer.open_output(path, output_format=output_format, compression=compression, schema=arxiv.parquet_schema(), token_counts=True) as output:
+        for record in synthetic_records(rows, text_kb):
+            output.write(record)
+    return time.perf_counter() - start, output.path
+
+
+def read(path: str, columns=None) -> tuple:
+    """ Seconds to read the columns of an output into a dataframe, and the dataframe """
+    start = time.perf_counter()
+    if writer.format_of(path) == "parquet":
+        df = pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    else:
+        df = pd.read_json(path, lines=True, dtype=False, convert_dates=False)
+        if columns is not None:
+            df = df[columns]
+    return time.perf_counter() - start, df
+
+
+def main(rows=ROWS, text_kb=TEXT_KB):
+    print("{} records with texts of {} kB.".format(rows, text_kb))
+    metadata = [column for column in arxiv.METADATA_COLUMNS if column != "versions"]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "arxiv_fulltext.json")
+        hashes = None
+        for name, output_format, compression in [("jsonl", "jsonl", None), ("jsonl gzip", "jsonl", "gzip"), ("parquet zstd", "parquet", None)]:
+            write_seconds, output = write(path, rows, text_kb, output_format, compression)
+            read_seconds, df = read(output)
+            metadata_seconds, _ = read(output, metadata)
+            print("{:<13} write {:7.2f} s   {:8.1f} MB   read {:7.2f} s   read metadata {:7.2f} s".format(
+                name, write_seconds, os.path.getsize(output) / 1e6, read_seconds, metadata_seconds))
+
+            if hashes is None:
+                hashes = [hash(text) for text in df["text"]]
+            assert [hash(text) for text in df["text"]] == hashes, name + " read back other texts"
+            if output_format == "parquet":
+                assert df["tokens"].tolist() == [len(text.split()) for text in df["text"]], "wrong token counts"
+            del df
+            os.remove(output)
+    print("All formats read back the same texts.")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,67 @@
+###############################################################################################################################
+#
+# Benchmark of the download URL construction: vectorized pdf_keys() against the former iterrows() loop.
+#
+# Usage: python -m benchmarks.bench_pdf_keys [rows]
+#
+###############################################################################################################################
+
+import random
+import sys
+import time
+
+import pandas as pd
+
+from datasources.arxiv import pdf_keys
+
+ROWS = 1000000
+# iterrows() is far too slow for the full frame, so it is timed on a sample and extrapolated
+ITERROWS_SAMPLE = 50000
+
+
+def synthetic_metadata(rows: int, seed: int = 0) -> pd.DataFrame:
+    """ Kaggle-style metadata frame with 10% old-style ids and 1-3 versions per paper """
+    rng = random.Random(seed)
+    ids = []
+    versions = []
+    for i in range(rows):
+        if i % 10 == 0:
+            ids.append("{}/{:02d}{:02d}{:03d}".format(rng.choice(["hep-th", "math", "cond-mat", "astro-ph"]), rng.randint(92, 99), rng.randint(1, 12), i % 1000))
+        else:
+            ids.append("{:02d}{:02d}.{:05d}".format(rng.randint(7, 23), rng.randint(1, 12), i % 100000))
+        versions.append([{"version": "v{}".format(v + 1), "created": ""} for v in range(rng.randint(1, 3))])
+    return pd.DataFrame({"id": ids, "versions": versions})
+
+
+def iterrows_keys(arxiv_metadata_df):
+    """ The former implementation (new-style ids only) """
+    keys = []
+    for index, row in arxiv_metadata_df.iterrows():
+        pdf_id = row['id']
+        pdf_yymm = row["id"][:4]
+        pdf_version = row["versions"][-1]["version"]
+        keys.append('arxiv/arxiv/pdf/' + pdf_yymm + "/" + pdf_id + pdf_version + '.pdf')
+    return keys
+
+
+def main(rows: int = ROWS):
+    df = synthetic_metadata(rows)
+
+    sample = df.head(ITERROWS_SAMPLE)
+    start = time.perf_counter()
+    iterrows_keys(sample)
+    iterrows_seconds = (time.perf_counter() - start) * len(df) / len(sample)
+
+    start = time.perf_counter()
+    keys = pdf_keys(df)
+    vectorized_seconds = time.perf_counter() - start
+
+    print("rows:        {}".format(len(df)))
+    print("iterrows:    {:.2f} s (extrapolated from {} rows)".format(iterrows_seconds, len(sample)))
+    print("vectorized:  {:.2f} s".format(vectorized_seconds))
+    print("speedup:     {:.1f}x".format(iterrows_seconds / vectorized_seconds))
+    print("examples:    {}, {}".format(keys.iloc[0], keys.iloc[1]))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ROWS)
@@ -0,0 +1,109 @@
+###############################################################################################################################
+#
+# Golden check and benchmark of the PubMed datasource (datasources/pubmed.py).
+#
+# The golden check runs pubmed() on the fixtures of benchmarks.fixtures.pubmed_fixtures(): revised records of the update
+# file replace the baseline ones, deleted records are dropped, the MeSH filter and the PMC full texts work. The benchmark
+# parses generated baseline files: the throughput of a single file, the peak memory of a worker for files of different
+# sizes (it has to stay flat, Linux only) and the throughput of pubmed() over several files with all workers.
+#
+# Usage: python -m benchmarks.bench_pubmed [n_articles]
+#
+###############################################################################################################################
+
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import pubmed_fixtures, synthetic_pubmed_file
+from datasources import pubmed
+from pipeline import metrics
+
+N_ARTICLES = 20000
+# Number of files of the parallel run
+N_FILES = 4
+
+PEAK_MEMORY = """
+import sys
+from datasources import pubmed
+pubmed.parse_file(sys.argv[1], sys.argv[2])
+print([line for line in open("/proc/self/status") if line.startswith("VmHWM")][0].split()[1])
+"""
+
+
+def run_pubmed(data_dir, directory, **kwargs):
+    """ The records of pubmed() on data_dir, run in directory """
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        assert pubmed.pubmed(data_dir, **kwargs)
+        with open(pubmed.OUTPUT_FILE) as f:
+            return [json.loads(line) for line in f]
+    finally:
+        os.chdir(cwd)
+
+
+def golden_check(directory):
+    data_dir = os.path.join(directory, "fixtures")
+    expected = pubmed_fixtures(data_dir)
+
+    records = run_pubmed(data_dir, directory)
+    # The revised record and the new one of the update file come after the baseline, the deleted one is gone
+    added = expected["pmids"][-1]
+    baseline = [str(pmid) for pmid in expected["pmids"] if pmid not in expected["revised"] and pmid != added]
+    assert [r["id"] for r in records if r["pmcid"] is None] == baseline + [str(pmid) for pmid in expected["revised"]] + [str(added)]
+    assert [r["id"] for r in records if r["id"].startswith("PMC")] == expected["pmcids"]
+    revised = [r for r in records if r["id"] == "2"][0]
+    assert revised["title"] == expected["revised"][2]
+    for record in records:
+        assert record["abstract"] and "  " not in record["abstract"]
+        if record["id"].startswith("PMC"):
+            assert record["text"] and "TABLECELL" not in record["text"] and "REFERENCE" not in record["text"]
+            assert record["categories"] == "Research_Article"
+
+    filtered = run_pubmed(data_dir, directory, category="D009369 AND NOT D000818")
+    assert filtered and all("D009369" in r["categories"].split() and "D000818" not in r["categories"].split() for r in filtered)
+    print("Golden check passed: {} records, {} with the MeSH filter.".format(len(records), len(filtered)))
+
+
+def main(n_articles=N_ARTICLES):
+    with tempfile.TemporaryDirectory() as directory:
+        golden_check(directory)
+
+        data_dir = os.path.join(directory, "baseline")
+        os.makedirs(data_dir)
+        path = os.path.join(data_dir, "pubmed24n0001.xml.gz")
+        synthetic_pubmed_file(path, range(1, n_articles + 1))
+        with gzip.open(path, "rb") as f:
+            xml_mb = len(f.read()) / 1e6
+
+        start = time.perf_counter()
+        summary = pubmed.parse_file(path, directory)
+        seconds = time.perf_counter() - start
+        os.remove(summary["part"])
+        print("One file: {} articles, {:.1f} MB of XML in {:.2f} s ({:.0f} docs/s, {:.1f} MB/s).".format(
+            n_articles, xml_mb, seconds, n_articles / seconds, xml_mb / seconds))
+
+        for size in (n_articles // 4, n_articles):
+            sized = os.path.join(directory, "pubmed24n{:04d}.xml.gz".format(size))
+            synthetic_pubmed_file(sized, range(1, size + 1))
+            peak = subprocess.run([sys.executable, "-c", PEAK_MEMORY, sized, directory], capture_output=True, text=True, check=True).stdout.split()[-1]
+            print("Peak memory of a worker for {:>6} articles: {:6.1f} MB".format(size, int(peak) / 1e3))
+            os.remove(sized)
+
+        for i in range(2, N_FILES + 1):
+            synthetic_pubmed_file(os.path.join(data_dir, "pubmed24n{:04d}.xml.gz".format(i)), range(i * n_articles, (i + 1) * n_articles))
+        metrics.reset()
+        start = time.perf_counter()
+        records = run_pubmed(data_dir, directory)
+        seconds = time.perf_counter() - start
+        print("{} files with all workers ({} cores): {} records in {:.2f} s ({:.0f} docs/s).".format(
+            N_FILES, os.cpu_count(), len(records), seconds, len(records) / seconds))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else N_ARTICLES)
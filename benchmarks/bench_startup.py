@@ -0,0 +1,82 @@
+###############################################################################################################################
+#
+# Startup-time budget of the command line and of the worker module.
+#
+# Every command runs in a fresh interpreter with -X importtime. Reported are the wall-clock time and the time spent in
+# imports on top of a bare interpreter. The run fails (exit code 1) when a command exceeds its budget or imports one of
+# the HEAVY modules, which are only needed once a datasource actually runs.
+#
+# Usage: python -m benchmarks.bench_startup
+#
+###############################################################################################################################
+
+import os
+import subprocess
+import sys
+import time
+
+# Import time budgets in ms on top of a bare interpreter
+CLI_BUDGET_MS = 100
+WORKER_BUDGET_MS = 300
+
+HEAVY = ("pandas", "numpy", "pyarrow", "nltk", "pdfminer", "alive_progress")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = [
+    ("help", ["main.py", "-h"], CLI_BUDGET_MS, HEAVY),
+    ("no source", ["main.py"], CLI_BUDGET_MS, HEAVY),
+    ("unknown source", ["main.py", "-s", "nope"], CLI_BUDGET_MS, HEAVY),
+    ("missing file", ["main.py", "-s", "arxiv", "-f", "missing.json"], CLI_BUDGET_MS, HEAVY),
+    ("bad category", ["main.py", "-s", "arxiv", "-f", "main.py", "-c", "cs.AI AND"], CLI_BUDGET_MS, HEAVY),
+    ("bad extractor", ["main.py", "-s", "pdfs", "-x", "nope"], CLI_BUDGET_MS, HEAVY),
+    # What a spawned worker imports: numpy for the vocabulary, but not the datasources
+    ("worker", ["-c", "import pipeline.pdf2txt"], WORKER_BUDGET_MS, ("pandas", "pyarrow", "nltk")),
+]
+
+
+def import_times(stderr: str) -> dict:
+    """ Cumulative import time in microseconds of every top-level import in the -X importtime output """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def run(args: list):
+    """ Wall-clock seconds, imported modules and their import time in ms of a command """
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime"] + args, cwd=ROOT, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    modules = set()
+    for line in process.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.split("|")[-1].strip())
+    return seconds, modules, sum(import_times(process.stderr).values()) / 1000
+
+
+def main():
+    _, baseline_modules, baseline_ms = run(["-c", "pass"])
+
+    failed = False
+    for name, args, budget, forbidden in COMMANDS:
+        seconds, modules, import_ms = run(args)
+        import_ms -= baseline_ms
+        heavy = sorted(module for module in modules - baseline_modules if module.split(".")[0] in forbidden)
+        ok = import_ms <= budget and not heavy
+        failed |= not ok
+        print("{:<16} {:7.0f} ms wall  {:7.1f} ms imports  {}{}".format(
+            name, seconds * 1000, import_ms, "ok" if ok else "OVER BUDGET",
+            "  heavy: " + ", ".join(heavy[:5]) if heavy else ""))
+
+    print("Budget: {} ms of imports for the command line, {} ms for a worker, on top of a bare interpreter.".format(
+        CLI_BUDGET_MS, WORKER_BUDGET_MS))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
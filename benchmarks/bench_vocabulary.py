@@ -0,0 +1,122 @@
+###############################################################################################################################
+#
+# Benchmark of the English vocabulary in pipeline/vocabulary.py against the former Python set of the NLTK words.
+#
+# The vocabulary has the size of the full NLTK words corpus (the installed words plus generated filler words). Reported
+# are the time and resident memory to load it in a fresh process, which every worker pays (Linux only), and the time
+# to filter the distinct words of the generated corpus: with a set, in batches without memo (cold) and with the memo
+# of a warm worker. The filters have to agree on every document.
+#
+# Usage: python -m benchmarks.bench_vocabulary [n_docs]
+#
+###############################################################################################################################
+
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.fixtures import VOCABULARY, synthetic_corpus
+from pipeline import pdf2txt, vocabulary
+
+# Number of entries of the NLTK words corpus
+CORPUS_SIZE = 236736
+
+LOAD_SET = """
+import resource, sys, time
+start = time.perf_counter()
+words = set(open(sys.argv[1]).read().split())
+print(time.perf_counter() - start, int(open('/proc/self/statm').read().split()[1]) * resource.getpagesize())
+"""
+
+LOAD_VOCABULARY = """
+import resource, sys, time
+from pipeline import vocabulary
+start = time.perf_counter()
+vocabulary.load(sys.argv[1])
+vocabulary.contains(["the"])
+print(time.perf_counter() - start, int(open('/proc/self/statm').read().split()[1]) * resource.getpagesize())
+"""
+
+# The same imports without loading, for the memory baseline
+BASELINE_SET = """
+import resource, sys, time
+print(0, int(open('/proc/self/statm').read().split()[1]) * resource.getpagesize())
+"""
+
+BASELINE_VOCABULARY = """
+import resource, sys, time
+from pipeline import vocabulary
+print(0, int(open('/proc/self/statm').read().split()[1]) * resource.getpagesize())
+"""
+
+
+def word_list(seed: int = 0) -> list:
+    """ The installed NLTK words and the benchmark vocabulary, filled up with random words to the size of the corpus """
+    import nltk
+
+    rng = random.Random(seed)
+    words = set(nltk.corpus.words.words()) | set(VOCABULARY)
+    while len(words) < CORPUS_SIZE:
+        words.add("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(3, 14))))
+    return sorted(words)
+
+
+def in_fresh_process(script: str, path: str):
+    """ Seconds and resident memory in MB reported by a script in a new interpreter """
+    output = subprocess.run([sys.executable, "-c", script, path], capture_output=True, text=True, check=True).stdout.split()
+    return float(output[0]), int(output[1]) / 1e6
+
+
+def main(n_docs: int = 50):
+    with tempfile.TemporaryDirectory() as directory:
+        words = word_list()
+        words_file = directory + "/words.txt"
+        with open(words_file, "w") as f:
+            f.write("\n".join(words))
+        vocabulary.build(directory, words=words)
+        print("Vocabulary: {} words.".format(len(words)))
+
+        for name, script, baseline, path in (("set", LOAD_SET, BASELINE_SET, words_file),
+                                             ("mmap", LOAD_VOCABULARY, BASELINE_VOCABULARY, directory)):
+            seconds, rss = in_fresh_process(script, path)
+            print("load {:<6} {:8.1f} ms   +{:6.1f} MB RSS".format(name, seconds * 1000, rss - in_fresh_process(baseline, path)[1]))
+
+        documents = []
+        for text in synthetic_corpus(n_docs):
+            tokens = pdf2txt.RE_WORDPUNCT.findall(text)
+            # Some words in every case, as they come from the extractors
+            documents.append([w.capitalize() if i % 7 == 0 else w for i, w in enumerate(set(tokens)) if w.isalpha()])
+
+        word_set = set(words)
+        vocabulary._vocabulary = None
+        vocabulary.load(directory)
+
+        start = time.perf_counter()
+        expected = [{w for w in document if w.lower() not in word_set} for document in documents]
+        set_seconds = time.perf_counter() - start
+
+        cold_seconds = 0.0
+        for document, rejected in zip(documents, expected):
+            vocabulary._memo.clear()
+            start = time.perf_counter()
+            assert vocabulary.unknown(document) == rejected
+            cold_seconds += time.perf_counter() - start
+
+        for document in documents:
+            vocabulary.unknown(document)
+        start = time.perf_counter()
+        for document, rejected in zip(documents, expected):
+            assert vocabulary.unknown(document) == rejected
+        warm_seconds = time.perf_counter() - start
+
+        n_words = sum(map(len, documents))
+        for name, seconds in (("set", set_seconds), ("cold", cold_seconds), ("warm", warm_seconds)):
+            print("filter {:<4} {:8.3f} us per distinct word".format(name, seconds / n_words * 1e6))
+        print("Filters agree on {} documents ({} distinct words).".format(len(documents), n_words))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
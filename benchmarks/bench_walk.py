@@ -0,0 +1,83 @@
+###############################################################################################################################
+#
+# Benchmark of the discovery of local PDFs: pipeline.files.walk() against the former recursive glob with its numeric
+# sort and largest-first sort.
+#
+# A temporary tree of small files in nested directories is walked. Reported are the time until the first file is known
+# (when the conversion can start) and the time for all files, for the former discovery, the walk in every order of
+# pipeline.files.ORDERS. All of them have to find the same files.
+#
+# Usage: python -m benchmarks.bench_walk [n_files]
+#
+###############################################################################################################################
+
+import glob
+import os
+import re
+import sys
+import tempfile
+import time
+
+from pipeline import files
+
+N_FILES = 100000
+FILES_PER_DIRECTORY = 500
+
+
+def former_discovery(pdf_dir):
+    """ The former pdf2txt.sorted_files() followed by scheduler.largest_first() """
+    found = glob.glob(os.path.join(pdf_dir, '**/*.pdf'), recursive=True)
+    found.sort()
+    allfiles = []
+    for fn in found:
+        nums = re.findall(r'\d+', fn)
+        allfiles.append([str(int(n)) for n in nums] + [fn])
+    allfiles = sorted(allfiles)
+    return sorted([f[-1] for f in allfiles], key=os.path.getsize, reverse=True)
+
+
+def make_tree(directory, n_files):
+    """ n_files small PDFs (and a few other files) in directories of FILES_PER_DIRECTORY, two levels deep """
+    for i in range(n_files):
+        subdirectory = os.path.join(directory, "{:03d}".format(i // (FILES_PER_DIRECTORY * 20)), "{:03d}".format(i // FILES_PER_DIRECTORY % 20))
+        if i % FILES_PER_DIRECTORY == 0:
+            os.makedirs(subdirectory, exist_ok=True)
+            with open(os.path.join(subdirectory, "notes.txt"), "w") as f:
+                f.write("not a pdf")
+        with open(os.path.join(subdirectory, "{}v{}.pdf".format(i, i % 3 + 1)), "wb") as f:
+            f.write(b"%PDF" * (i % 97))
+
+
+def measure(discover):
+    """ Seconds until the first file, seconds for all files and the files """
+    start = time.perf_counter()
+    found = discover()
+    iterator = iter(found)
+    first = next(iterator)
+    first_seconds = time.perf_counter() - start
+    paths = [first] + list(iterator)
+    return first_seconds, time.perf_counter() - start, paths
+
+
+def main(n_files=N_FILES):
+    with tempfile.TemporaryDirectory() as directory:
+        make_tree(directory, n_files)
+        print("{} PDFs in {} directories.".format(n_files, -(-n_files // FILES_PER_DIRECTORY)))
+
+        results = [("glob + sorts", measure(lambda: former_discovery(directory)))]
+        for order in files.ORDERS:
+            results.append(("walk " + order, measure(lambda: files.ordered(files.walk(directory), order))))
+
+        for name, (first_seconds, seconds, _) in results:
+            print("{:<14} first file {:8.3f} s   all files {:8.3f} s".format(name, first_seconds, seconds))
+
+        expected = sorted(results[0][1][2])
+        for name, (_, _, paths) in results[1:]:
+            assert sorted(paths) == expected, name + " found other files"
+        sizes = [[os.path.getsize(path) for path in result[2]] for _, result in results[:2]]
+        assert sizes[0] == sizes[1], "walk largest is not ordered by size like the former discovery"
+        print("All discoveries found the same {} files.".format(len(expected)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else N_FILES)
@@ -0,0 +1,305 @@
+###############################################################################################################################
+#
+# Generated fixtures for the benchmarks. Everything is derived from a seed, so runs are reproducible and offline.
+#
+###############################################################################################################################
+
+import gzip
+import io
+import json
+import os
+import random
+import tarfile
+
+VOCABULARY = (
+    "the of and a to in is that for on with as by this are we an be from at it or which our model data paper results "
+    "method learning show use using can these two based network neural models approach propose problem training task "
+    "performance time set new information system function analysis theory graph language text image structure large"
+).split()
+
+NOISE = [
+    "http://example.org/paper?id=42", "https://arxiv.org/abs/0704.0001v2", "(cid:12)(cid:13)", "x_{i}^{2}", "\\alpha",
+    "\\frac{a}{b}", "E = mc^2", "[12]", "{3, 4}", "(see Fig. 3)", "co-", "e.g.,", "i.e.", "....", "*****", "lllll",
+    "ﬁnd", "efﬁcient", "‘quoted’", "“double”", "naïve", " ", "—", "·",
+    "٣٤", "½", "été", "--", "a", "B", "___", "===", "x=y", "AAAAAA", "!!!!", "?", ";", ":",
+    "\t", "\n", "\n\n", "\r\n", " ", "1.5", "2023", "3rd", "ht1tp://digit.example", "-é x", "\\\\",
+]
+
+
+def synthetic_text(seed: int = 0, n_words: int = 5000, noise: float = 0.15) -> str:
+    """
+    Raw text that looks like the output of a PDF extractor: a title block, an introduction, words mixed with numbers,
+    references, equations, ligatures, hyperlinks, hyphenation and whitespace noise.
+
+    Parameters
+    ----------
+    seed : int
+        Random seed
+
+    n_words : int
+        Approximate number of words
+
+    noise : float
+        Fraction of tokens that are taken from the noise list instead of the vocabulary
+    """
+    rng = random.Random(seed)
+    words = ["Title", "of", "Paper", str(seed), "Author", "Name", "Abstract"]
+    words += [rng.choice(VOCABULARY) for _ in range(rng.randint(0, 60))]
+    words.append(rng.choice(["1 Introduction", "\n1. INTRODUCTION\n", "Introduction", "introduction"]))
+
+    for _ in range(n_words):
+        if rng.random() < noise:
+            words.append(rng.choice(NOISE))
+        else:
+            word = rng.choice(VOCABULARY)
+            if rng.random() < 0.05:
+                word = word.capitalize()
+            words.append(word)
+        if rng.random() < 0.08:
+            words.append(rng.choice([".", ",", "\n", ".\n"]))
+
+    separators = [" "] * 20 + ["  ", "\n", " \n "]
+    return "".join(word + rng.choice(separators) for word in words)
+
+
+def synthetic_corpus(n_docs: int = 50, n_words: int = 5000, seed: int = 0):
+    """ A list of n_docs texts from :func:`synthetic_text` """
+    return [synthetic_text(seed + i, n_words=n_words) for i in range(n_docs)]
+
+
+def _pdf_string(text: str) -> str:
+    """ Escape text for a PDF string literal, dropping what the standard font cannot show """
+    text = text.encode("latin-1", errors="ignore").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def synthetic_pdf(path: str, seed: int = 0, n_pages: int = 3, lines_per_page: int = 45):
+    """
+    Write a minimal, valid PDF with n_pages of text from :func:`synthetic_text` (Helvetica, one text object per page).
+
+    Parameters
+    ----------
+    path : str
+        Output file
+
+    seed : int
+        Random seed
+
+    n_pages : int
+        Number of pages
+
+    lines_per_page : int
+        Number of text lines per page
+    """
+    rng = random.Random(seed)
+    words = synthetic_text(seed, n_words=n_pages * lines_per_page * 10, noise=0.05).split()
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(n_pages):
+        lines = []
+        for _ in range(lines_per_page):
+            n_words = rng.randint(6, 12)
+            lines.append(" ".join(words[:n_words]))
+            words = words[n_words:]
+        stream = "BT /F1 10 Tf 13 TL 50 780 Td " + " ".join("({}) '".format(_pdf_string(line)) for line in lines) + " ET"
+        kids.append(len(objects) + 1)
+        objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {} 0 R "
+                       "/Resources << /Font << /F1 3 0 R >> >> >>".format(len(objects) + 2))
+        objects.append("<< /Length {} >>\nstream\n{}\nendstream".format(len(stream.encode("latin-1")), stream))
+    objects[1] = "<< /Type /Pages /Kids [{}] /Count {} >>".format(" ".join("{} 0 R".format(k) for k in kids), len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += "{} 0 obj\n{}\nendobj\n".format(number, obj).encode("latin-1")
+    xref = len(out)
+    out += "xref\n0 {}\n0000000000 65535 f \n".format(len(objects) + 1).encode()
+    out += "".join("{:010d} 00000 n \n".format(offset) for offset in offsets).encode()
+    out += "trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n".format(len(objects) + 1, xref).encode()
+
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def synthetic_pdf_corpus(directory: str, n_docs: int = 20, n_pages: int = 3, seed: int = 0):
+    """
+    Write n_docs PDFs from :func:`synthetic_pdf` named like new-style arXiv ids (0704.0001v1.pdf, ...) to directory.
+
+    Returns
+    -------
+    paths : list of str
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(n_docs):
+        path = os.path.join(directory, "0704.{:04d}v1.pdf".format(i + 1))
+        synthetic_pdf(path, seed=seed + i, n_pages=n_pages)
+        paths.append(path)
+    return paths
+
+
+# arXiv categories of the metadata fixtures, the first of a paper is its primary category
+CATEGORIES = ["cs.AI", "cs.LG", "cs.CL", "cs.CV", "stat.ML", "math.CO", "math.AG", "hep-th", "hep-ph", "quant-ph",
+              "cond-mat.str-el", "astro-ph.GA", "physics.optics", "q-bio.NC", "econ.EM", "eess.SP"]
+LICENSES = [None, "http://arxiv.org/licenses/nonexclusive-distrib/1.0/", "http://creativecommons.org/licenses/by/4.0/"]
+
+
+def metadata_id(row: int) -> str:
+    """ New-style arXiv id of a metadata row: 0704.0001 for row 0, 9999 papers per month from April 2007 on """
+    month = 3 + row // 9999
+    return "{:02d}{:02d}.{:04d}".format(7 + month // 12, month % 12 + 1, row % 9999 + 1)
+
+
+def metadata_record(row: int, rng: random.Random) -> dict:
+    """ One paper of the Kaggle arXiv metadata snapshot with all of its fields """
+    authors = [(rng.choice(VOCABULARY).capitalize(), rng.choice("ABCDEFGHJKLMNPRST") + ".") for _ in range(rng.randint(1, 6))]
+    abstract = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(60, 250)))
+    versions = [{"version": "v{}".format(v + 1), "created": "Mon, {} Apr 2007 {:02d}:00:00 GMT".format(v + 2, v + 10)}
+                for v in range(rng.choice([1, 1, 1, 2, 2, 3]))]
+    return {
+        "id": metadata_id(row),
+        "submitter": " ".join(authors[0][::-1]),
+        "authors": ", ".join(first + " " + last for last, first in authors),
+        "title": " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(4, 14))).capitalize(),
+        "comments": rng.choice([None, "{} pages, {} figures".format(rng.randint(4, 40), rng.randint(0, 12))]),
+        "journal-ref": None,
+        "doi": rng.choice([None, "10.1000/example.{}".format(row)]),
+        "report-no": None,
+        "categories": " ".join(rng.sample(CATEGORIES, rng.randint(1, 3))),
+        "license": rng.choice(LICENSES),
+        # Abstracts start with whitespace and are wrapped like in the snapshot
+        "abstract": "  " + "\n".join(abstract[i:i + 80] for i in range(0, len(abstract), 80)) + "\n",
+        "versions": versions,
+        "update_date": "20{:02d}-{:02d}-{:02d}".format(rng.randint(8, 23), rng.randint(1, 12), rng.randint(1, 28)),
+        "authors_parsed": [[last, first, ""] for last, first in authors],
+    }
+
+
+def synthetic_metadata_file(path: str, rows: int, seed: int = 0):
+    """
+    Write a Kaggle-style arXiv metadata snapshot (one JSON object per line) with rows papers. The ids of the first rows
+    match the file names of :func:`synthetic_pdf_corpus`. The file is written to a temporary name and renamed, so an
+    interrupted run does not leave a truncated fixture.
+    """
+    rng = random.Random(seed)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        for row in range(rows):
+            f.write(json.dumps(metadata_record(row, rng)) + "\n")
+    os.replace(tmp_path, path)
+
+
+def synthetic_vocabulary(n_words: int = 200000, seed: int = 0) -> list:
+    """ The fixture words and made-up lowercase words, about as many as the NLTK words corpus has """
+    rng = random.Random(seed)
+    words = set(VOCABULARY)
+    while len(words) < n_words:
+        words.add("".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 14))))
+    return sorted(words)
+
+
+# MeSH descriptors (id, name) of the PubMed fixtures
+MESH = [("D009369", "Neoplasms"), ("D006801", "Humans"), ("D000818", "Animals"), ("D003920", "Diabetes Mellitus"),
+        ("D001943", "Breast Neoplasms"), ("D016428", "Journal Article")]
+
+PUBMED_DOCTYPE = ('<?xml version="1.0" ?>\n<!DOCTYPE PubmedArticleSet PUBLIC "-//NLM//DTD PubMedArticle, 1st January 2024//EN" '
+                  '"https://dtd.nlm.nih.gov/ncbi/pubmed/out/pubmed_240101.dtd">\n')
+
+
+def pubmed_article(pmid: int, seed: int = 0, title: str = None) -> str:
+    """ A PubmedArticle element with a structured abstract, authors, MeSH headings and article ids """
+    rng = random.Random(seed * 1000003 + pmid)
+    title = title or "A study of <i>{}</i> &amp; {} {}".format(rng.choice(VOCABULARY), rng.choice(VOCABULARY), pmid)
+    sections = "".join(
+        '<AbstractText Label="{}">{}</AbstractText>'.format(label, " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(20, 60))))
+        for label in ("BACKGROUND", "METHODS", "RESULTS"))
+    authors = "".join("<Author><LastName>Name{}</LastName><ForeName>Author {}</ForeName></Author>".format(i, i) for i in range(rng.randint(1, 4)))
+    mesh = "".join('<MeshHeading><DescriptorName UI="{}" MajorTopicYN="N">{}</DescriptorName></MeshHeading>'.format(ui, name)
+                   for ui, name in rng.sample(MESH, rng.randint(1, 3)))
+    return (
+        '<PubmedArticle><MedlineCitation Status="MEDLINE" Owner="NLM"><PMID Version="1">{pmid}</PMID>'
+        '<Article PubModel="Print"><Journal><Title>Journal of {journal}</Title><JournalIssue><PubDate><Year>{year}</Year>'
+        '</PubDate></JournalIssue></Journal><ArticleTitle>{title}</ArticleTitle><Abstract>{sections}</Abstract>'
+        '<AuthorList CompleteYN="Y">{authors}</AuthorList></Article><MeshHeadingList>{mesh}</MeshHeadingList></MedlineCitation>'
+        '<PubmedData><ArticleIdList><ArticleId IdType="pubmed">{pmid}</ArticleId><ArticleId IdType="doi">10.1000/{pmid}</ArticleId>'
+        '</ArticleIdList></PubmedData></PubmedArticle>\n'
+    ).format(pmid=pmid, journal=rng.choice(VOCABULARY).capitalize(), year=rng.randint(1990, 2024), title=title,
+             sections=sections, authors=authors, mesh=mesh)
+
+
+def synthetic_pubmed_file(path: str, pmids, seed: int = 0, titles: dict = None, deleted=()):
+    """
+    Write a gzipped PubMed XML file (a PubmedArticleSet) like the baseline and update files.
+
+    Parameters
+    ----------
+    pmids : iterable of int
+        PMIDs of the articles
+
+    titles : dict
+        Optional titles by PMID, e.g. of revised articles
+
+    deleted : iterable of int
+        PMIDs of a DeleteCitation element, as in the update files
+    """
+    titles = titles or {}
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(PUBMED_DOCTYPE + "<PubmedArticleSet>\n")
+        for pmid in pmids:
+            f.write(pubmed_article(pmid, seed, titles.get(pmid)))
+        if deleted:
+            f.write("<DeleteCitation>" + "".join('<PMID Version="1">{}</PMID>'.format(pmid) for pmid in deleted) + "</DeleteCitation>\n")
+        f.write("</PubmedArticleSet>\n")
+
+
+def jats_article(pmcid: int, seed: int = 0) -> str:
+    """ A JATS article of the PMC Open Access subset with a body, a table, a figure and references """
+    rng = random.Random(seed * 1000003 + pmcid)
+    body = synthetic_text(seed + pmcid, n_words=300, noise=0.05).replace("&", "and").replace("<", " ").replace(">", " ")
+    return (
+        '<?xml version="1.0" ?>\n<!DOCTYPE article PUBLIC "-//NLM//DTD JATS (Z39.96) Journal Archiving and Interchange DTD v1.3 20210610//EN" "JATS-archivearticle1-3.dtd">\n'
+        '<article xmlns:xlink="http://www.w3.org/1999/xlink" article-type="research-article"><front>'
+        '<journal-meta><journal-title-group><journal-title>PLoS {journal}</journal-title></journal-title-group></journal-meta>'
+        '<article-meta><article-id pub-id-type="pmid">{pmid}</article-id><article-id pub-id-type="pmc">{pmcid}</article-id>'
+        '<article-id pub-id-type="doi">10.1371/{pmcid}</article-id><article-categories><subj-group subj-group-type="heading">'
+        '<subject>Research Article</subject></subj-group></article-categories><title-group><article-title>Open access '
+        '<italic>{word}</italic> {pmcid}</article-title></title-group><contrib-group><contrib contrib-type="author"><name>'
+        '<surname>Doe</surname><given-names>Jane</given-names></name></contrib></contrib-group><pub-date pub-type="epub">'
+        '<year>{year}</year></pub-date><abstract><title>Abstract</title><p>The abstract of article {pmcid} on a {word}.</p>'
+        '</abstract></article-meta></front><body><sec><title>Introduction</title><p>{body}</p><fig id="f1"><caption>'
+        '<p>FIGURECAPTION</p></caption></fig><table-wrap id="t1"><table><tr><td>TABLECELL</td></tr></table></table-wrap>'
+        '<p>See <xref ref-type="bibr" rid="r1">[1]</xref> for the learning model.</p></sec></body><back><ref-list>'
+        '<ref id="r1"><mixed-citation>REFERENCE</mixed-citation></ref></ref-list></back></article>\n'
+    ).format(journal=rng.choice(VOCABULARY).capitalize(), pmid=900000 + pmcid, pmcid=pmcid, word=rng.choice(VOCABULARY),
+             year=rng.randint(2000, 2024), body=body)
+
+
+def synthetic_pmc_bundle(path: str, pmcids, seed: int = 0):
+    """ Write a tar.gz bundle of JATS articles (PMC<id>.nxml in a directory per journal) like the PMC bulk packages """
+    with tarfile.open(path, "w:gz") as bundle:
+        for pmcid in pmcids:
+            data = jats_article(pmcid, seed).encode("utf-8")
+            member = tarfile.TarInfo("PLoS_One/PMC{}.nxml".format(pmcid))
+            member.size = len(data)
+            bundle.addfile(member, io.BytesIO(data))
+
+
+def pubmed_fixtures(directory: str, n_articles: int = 20, seed: int = 0) -> dict:
+    """
+    Write a small PubMed / PMC input directory: a baseline file with PMIDs 1..n_articles, an update file that revises
+    PMID 2, deletes PMID 3 and adds PMID n_articles + 1, and a PMC bundle with three articles.
+
+    Returns
+    -------
+    expected : dict
+        "pmids" (the PMIDs of the output), "revised" (PMID -> title) and "pmcids"
+    """
+    os.makedirs(directory, exist_ok=True)
+    revised = {2: "Revised title of article 2"}
+    synthetic_pubmed_file(os.path.join(directory, "pubmed24n0001.xml.gz"), range(1, n_articles + 1), seed)
+    synthetic_pubmed_file(os.path.join(directory, "pubmed24n0002.xml.gz"), [2, n_articles + 1], seed, titles=revised, deleted=[3])
+    synthetic_pmc_bundle(os.path.join(directory, "oa_comm_xml.PMC000xxxxxx.baseline.tar.gz"), [101, 102, 103], seed)
+    pmids = [pmid for pmid in range(1, n_articles + 2) if pmid != 3]
+    return {"pmids": pmids, "revised": revised, "pmcids": ["PMC101", "PMC102", "PMC103"]}
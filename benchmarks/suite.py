@@ -0,0 +1,433 @@
+###############################################################################################################################
+#
+# Reproducible benchmark suite of the extraction and cleaning pipeline.
+#
+# Every case runs in a fresh interpreter in an empty temporary directory: the components helpers.fixunicode.fix_unicode(),
+# pdf2txt.cleaned_text(), pdf2txt.fulltext() and arxiv.preprocess() (building the columnar index, using it and streaming
+# the snapshot, for every metadata size), and the command line end to end with -s pdfs and -s arxiv -l. Reported are
+# docs/s, MB/s of input, the peak RSS of the case (the largest process of its tree, from wait4) and the wall time of
+# every pipeline stage from pipeline.metrics, for the fastest of the repeats.
+#
+# The fixtures are generated once per FIXTURES_VERSION and seed and reused: sample raw texts, synthetic PDFs, Kaggle-style
+# metadata snapshots and a vocabulary of made-up words, so everything runs offline and does not depend on the installed
+# NLTK corpus. The PDFs are converted with pdfminer only (see EXTRACTORS), which needs no external tool.
+#
+# The results are written as JSON. With a baseline (the results of an earlier run), every case is compared to it and the
+# run fails (exit code 1) when docs/s or MB/s drop, or the peak RSS or the time of a stage grow, by more than the
+# threshold, or when a case writes a different number of documents.
+#
+# Usage: python -m benchmarks.suite [--sizes 10000,100000,1000000] [--cases fulltext,e2e] [--repeat 3]
+#                                   [--baseline FILE] [--threshold 0.2] [--output FILE] [--fixtures DIR]
+#
+###############################################################################################################################
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import fixtures
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Bump when the fixture generators change, so that old fixtures are not compared with new ones
+FIXTURES_VERSION = 1
+FIXTURES_DIR = os.path.join(tempfile.gettempdir(), "pubcrawl_benchmarks")
+OUTPUT_FILE = "./benchmark_results.json"
+
+# Rows of the metadata snapshots
+SIZES = (10000, 100000, 1000000)
+N_TEXTS = 100
+N_WORDS = 5000
+N_PDFS = 40
+N_PAGES = 3
+SEED = 0
+REPEAT = 3
+# Allowed relative change before a metric counts as a regression
+THRESHOLD = 0.2
+# Stages that take less than this in the baseline are too short to compare
+MIN_STAGE_SECONDS = 0.5
+
+EXTRACTORS = "pdfminer"
+# Category filter of the metadata cases, about a quarter of the papers
+CATEGORY = "cs.AI OR cs.LG"
+
+TEXTS_FILE = "raw_texts.jsonl"
+PDF_DIR = "pdfs"
+VOCABULARY_DIR = "vocabulary"
+METADATA_FILE = "metadata-{}.json"
+# Snapshot of the -s arxiv case in its working directory, the smallest metadata fixture
+E2E_SNAPSHOT = "snapshot.json"
+
+# Runs a command and writes its ru_maxrss in KB (the largest process of its tree) to a file. A process starts with the
+# peak RSS of the process it was forked from, so the command is started from this bare interpreter and not from the suite.
+LAUNCHER = """
+import os, sys
+pid = os.fork()
+if pid == 0:
+    os.execv(sys.argv[2], sys.argv[2:])
+_, status, usage = os.wait4(pid, 0)
+with open(sys.argv[1], "w") as f:
+    f.write(str(usage.ru_maxrss))
+sys.exit(os.waitstatus_to_exitcode(status))
+"""
+
+# Results of a case that are compared with the baseline: higher is better for these and worse for peak_rss_mb
+THROUGHPUTS = ("docs_per_second", "mb_per_second")
+
+
+###############################################################################################################################
+# Fixtures
+###############################################################################################################################
+
+def fixtures_dir(directory: str, seed: int = SEED) -> str:
+    return os.path.join(directory, "v{}-seed{}".format(FIXTURES_VERSION, seed))
+
+
+def prepare_fixtures(directory: str, sizes=SIZES, seed: int = SEED):
+    """ Generate the fixtures in directory that do not exist yet. Every fixture is moved into place when it is complete. """
+    os.makedirs(directory, exist_ok=True)
+
+    path = os.path.join(directory, TEXTS_FILE)
+    if not os.path.exists(path):
+        print("Generating {} raw texts.".format(N_TEXTS))
+        with open(path + ".tmp", "w") as f:
+            for text in fixtures.synthetic_corpus(N_TEXTS, n_words=N_WORDS, seed=seed):
+                f.write(json.dumps(text) + "\n")
+        os.replace(path + ".tmp", path)
+
+    path = os.path.join(directory, PDF_DIR)
+    if not os.path.isdir(path):
+        print("Generating {} PDFs.".format(N_PDFS))
+        shutil.rmtree(path + ".tmp", ignore_errors=True)
+        fixtures.synthetic_pdf_corpus(path + ".tmp", n_docs=N_PDFS, n_pages=N_PAGES, seed=seed)
+        os.replace(path + ".tmp", path)
+
+    path = os.path.join(directory, VOCABULARY_DIR)
+    if not os.path.isdir(path):
+        print("Building the vocabulary.")
+        from pipeline import vocabulary
+
+        shutil.rmtree(path + ".tmp", ignore_errors=True)
+        vocabulary.build(path + ".tmp", words=fixtures.synthetic_vocabulary(seed=seed))
+        os.replace(path + ".tmp", path)
+
+    for rows in sizes:
+        path = os.path.join(directory, METADATA_FILE.format(rows))
+        if not os.path.exists(path):
+            print("Generating a metadata snapshot with {} rows.".format(rows))
+            fixtures.synthetic_metadata_file(path, rows, seed=seed)
+
+
+def input_bytes(paths) -> int:
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def pdf_files(directory: str) -> list:
+    pdf_dir = os.path.join(directory, PDF_DIR)
+    return sorted(os.path.join(pdf_dir, name) for name in os.listdir(pdf_dir))
+
+
+###############################################################################################################################
+# Components, run in the interpreter of the case (see run_component())
+###############################################################################################################################
+
+def bench_fix_unicode(directory: str):
+    from helpers.fixunicode import fix_unicode
+    from pipeline import metrics
+
+    with open(os.path.join(directory, TEXTS_FILE)) as f:
+        texts = [json.loads(line) for line in f]
+    sizes = [len(text.encode("utf-8")) for text in texts]
+
+    def run():
+        for text, size in zip(texts, sizes):
+            with metrics.timer("fix_unicode", bytes_in=size):
+                fix_unicode(text)
+        return len(texts), sum(sizes)
+    return run
+
+
+def bench_cleaned_text(directory: str):
+    from helpers.fixunicode import fix_unicode
+    from pipeline import metrics, pdf2txt
+
+    # The cleaning gets the texts as the extraction leaves them
+    with open(os.path.join(directory, TEXTS_FILE)) as f:
+        texts = [fix_unicode(json.loads(line)) for line in f]
+    sizes = [len(text.encode("utf-8")) for text in texts]
+    pdf2txt.cleaned_text(texts[0])
+
+    def run():
+        for text, size in zip(texts, sizes):
+            with metrics.timer("clean", bytes_in=size):
+                pdf2txt.cleaned_text(text)
+        return len(texts), sum(sizes)
+    return run
+
+
+def bench_fulltext(directory: str):
+    from pipeline import metrics, pdf2txt
+
+    paths = pdf_files(directory)
+
+    def run():
+        for path in paths:
+            timings = {}
+            pdf2txt.fulltext(path, extractor_chain=EXTRACTORS.split(","), timings=timings)
+            for stage, seconds in timings.items():
+                metrics.observe(stage, seconds)
+        return len(paths), input_bytes(paths)
+    return run
+
+
+def bench_preprocess(directory: str, rows: int, mode: str):
+    """ mode: "build" (index built in the timed run), "index" (index built before, see run_case()) or "stream" """
+    from datasources import arxiv, arxiv_index
+
+    snapshot = os.path.abspath(METADATA_FILE.format(rows))
+    if not os.path.lexists(snapshot):
+        link_snapshot(directory, rows, snapshot)
+
+    def run():
+        if mode == "build":
+            shutil.rmtree(arxiv_index.index_dir_for(snapshot), ignore_errors=True)
+        arxiv.preprocess(snapshot, arxiv_category=CATEGORY, use_index=mode != "stream")
+        return rows, os.path.getsize(snapshot)
+    return run
+
+
+def component(name: str, directory: str):
+    """ The setup of a component case, which returns the function of one timed pass """
+    if name.startswith("preprocess/"):
+        _, rows, mode = name.split("/")
+        return bench_preprocess(directory, int(rows), mode)
+    return {"fix_unicode": bench_fix_unicode, "cleaned_text": bench_cleaned_text, "fulltext": bench_fulltext}[name](directory)
+
+
+def run_component(name: str, directory: str, repeat: int, result_path: str):
+    """ Time repeat passes of a component and write the fastest one to result_path """
+    from pipeline import metrics
+
+    run = component(name, directory)
+    best = None
+    for _ in range(repeat):
+        metrics.reset()
+        start = time.perf_counter()
+        documents, size = run()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best["seconds"]:
+            stages = {stage: values["seconds"] for stage, values in metrics.report()["stages"].items()}
+            best = {"documents": documents, "bytes": size, "seconds": seconds, "stages": stages}
+    with open(result_path, "w") as f:
+        json.dump(best, f)
+
+
+###############################################################################################################################
+# Cases
+###############################################################################################################################
+
+def cases(sizes=SIZES) -> list:
+    names = ["fix_unicode", "cleaned_text", "fulltext"]
+    for rows in sizes:
+        names += ["preprocess/{}/{}".format(rows, mode) for mode in ("build", "index", "stream")]
+    return names + ["e2e/pdfs", "e2e/arxiv"]
+
+
+def e2e_command(name: str, directory: str, workers: int) -> list:
+    """ The command line of an end to end case, run in a working directory with the link of link_snapshot() """
+    command = [os.path.join(ROOT, "main.py"), "-x", EXTRACTORS, "-j", str(workers), "--report", "report.json"]
+    pdf_dir = os.path.join(directory, PDF_DIR)
+    if name == "e2e/pdfs":
+        return command + ["-s", "pdfs", "-l", pdf_dir, "-p"]
+    return command + ["-s", "arxiv", "-f", E2E_SNAPSHOT, "-l", pdf_dir]
+
+
+def link_snapshot(directory: str, rows: int, path: str):
+    """ Link a metadata snapshot into a working directory, so that its index is built there and not next to the fixture """
+    os.symlink(os.path.join(directory, METADATA_FILE.format(rows)), path)
+
+
+def execute(command: list, cwd: str, env: dict):
+    """ Run a command, return its wall time, its peak RSS in MB and the tail of its output, or raise on failure """
+    with tempfile.TemporaryFile() as output, tempfile.NamedTemporaryFile("r") as usage:
+        start = time.perf_counter()
+        returncode = subprocess.call([sys.executable, "-S", "-c", LAUNCHER, usage.name, sys.executable] + command,
+                                     cwd=cwd, env=env, stdout=output, stderr=subprocess.STDOUT)
+        seconds = time.perf_counter() - start
+        output.seek(0)
+        tail = output.read().decode("utf-8", errors="replace")[-3000:]
+        max_rss = usage.read()
+    if returncode != 0:
+        raise RuntimeError("exit code {}\n{}".format(returncode, tail))
+    return seconds, int(max_rss) / 1024, tail
+
+
+def run_case(name: str, directory: str, sizes, repeat: int, workers: int) -> dict:
+    """ Run a case in a fresh interpreter and working directory and return its results """
+    env = dict(os.environ, PUBCRAWL_VOCABULARY=os.path.join(directory, VOCABULARY_DIR), PYTHONPATH=ROOT)
+    with tempfile.TemporaryDirectory() as cwd:
+        if not name.startswith("e2e/"):
+            result_path = os.path.join(cwd, "result.json")
+            command = ["-m", "benchmarks.suite", "--fixtures", directory, "--result", result_path]
+            if name.endswith("/index"):
+                # The index is built in a separate run, so that its memory does not count
+                execute(command + ["--case", name.replace("/index", "/build"), "--repeat", "1"], cwd, env)
+            _, peak_rss, _ = execute(command + ["--case", name, "--repeat", str(repeat)], cwd, env)
+            with open(result_path) as f:
+                result = json.load(f)
+        else:
+            command = e2e_command(name, directory, workers)
+            inputs = pdf_files(directory)
+            if name == "e2e/arxiv":
+                inputs.append(os.path.join(directory, METADATA_FILE.format(min(sizes))))
+            result, peak_rss = None, 0
+            for _ in range(repeat):
+                if name == "e2e/arxiv":
+                    link_snapshot(directory, min(sizes), os.path.join(cwd, E2E_SNAPSHOT))
+                seconds, rss, tail = execute(command, cwd, env)
+                with open(os.path.join(cwd, "report.json")) as f:
+                    report = json.load(f)
+                peak_rss = max(peak_rss, rss)
+                if result is None or seconds < result["seconds"]:
+                    stages = {stage: values["seconds"] for stage, values in report["stages"].items()}
+                    result = {"documents": report["counters"].get("documents", 0), "bytes": input_bytes(inputs),
+                              "seconds": seconds, "stages": stages}
+                # Every run starts without the outputs and the index of the last one
+                for entry in os.scandir(cwd):
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.remove(entry.path)
+            if not result["documents"]:
+                raise RuntimeError("no documents were processed\n" + tail)
+
+    result["docs_per_second"] = result["documents"] / result["seconds"]
+    result["mb_per_second"] = result["bytes"] / 1e6 / result["seconds"]
+    result["peak_rss_mb"] = peak_rss
+    return result
+
+
+###############################################################################################################################
+# Baseline
+###############################################################################################################################
+
+def compare(results: dict, baseline: dict, threshold: float = THRESHOLD) -> list:
+    """
+    Compare the cases of two runs.
+
+    Returns
+    -------
+    regressions : list of str
+        One line per metric of a case that got worse by more than threshold (relative)
+    """
+    regressions = []
+    for name, case in results["cases"].items():
+        base = baseline["cases"].get(name)
+        if base is None:
+            continue
+        if case["documents"] != base["documents"]:
+            regressions.append("{}: {} documents instead of {}".format(name, case["documents"], base["documents"]))
+        for metric in THROUGHPUTS:
+            if case[metric] < base[metric] * (1 - threshold):
+                regressions.append("{}: {} {:.2f} < {:.2f}".format(name, metric, case[metric], base[metric]))
+        if case["peak_rss_mb"] > base["peak_rss_mb"] * (1 + threshold):
+            regressions.append("{}: peak_rss_mb {:.1f} > {:.1f}".format(name, case["peak_rss_mb"], base["peak_rss_mb"]))
+        for stage, seconds in case["stages"].items():
+            base_seconds = base["stages"].get(stage)
+            if base_seconds is not None and base_seconds >= MIN_STAGE_SECONDS and seconds > base_seconds * (1 + threshold):
+                regressions.append("{}: stage {} {:.3f} s > {:.3f} s".format(name, stage, seconds, base_seconds))
+    return regressions
+
+
+def change(value: float, base: float) -> str:
+    return "{:+.0%}".format(value / base - 1) if base else ""
+
+
+def print_results(results: dict, baseline: dict = None):
+    print("{:<26} {:>9} {:>9} {:>10} {:>9} {:>10} {:>7}  {}".format(
+        "case", "docs", "seconds", "docs/s", "MB/s", "peak MB", "docs/s", "slowest stages"))
+    for name, case in results["cases"].items():
+        base = (baseline or {}).get("cases", {}).get(name)
+        stages = sorted(case["stages"].items(), key=lambda stage: -stage[1])[:3]
+        print("{:<26} {:>9} {:>9.2f} {:>10.1f} {:>9.2f} {:>10.1f} {:>7}  {}".format(
+            name, case["documents"], case["seconds"], case["docs_per_second"], case["mb_per_second"], case["peak_rss_mb"],
+            change(case["docs_per_second"], base["docs_per_second"]) if base else "",
+            ", ".join("{} {:.2f} s".format(stage, seconds) for stage, seconds in stages)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite of the extraction and cleaning pipeline.")
+    parser.add_argument("--sizes", type=str, default=",".join(map(str, SIZES)), help="Rows of the metadata snapshots. Example: --sizes 10000,100000")
+    parser.add_argument("--cases", type=str, help="Only run the cases that start with one of these prefixes. Example: --cases fulltext,e2e")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="Number of runs of every case, the fastest counts. Example: --repeat 5")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes of the end to end cases. Example: --workers 4")
+    parser.add_argument("--seed", type=int, default=SEED, help="Seed of the fixtures. Example: --seed 1")
+    parser.add_argument("--fixtures", type=str, default=FIXTURES_DIR, help="Directory of the generated fixtures. Example: --fixtures ./fixtures")
+    parser.add_argument("--output", type=str, default=OUTPUT_FILE, help="Write the results to this JSON file. Example: --output ./baseline.json")
+    parser.add_argument("--baseline", type=str, help="Compare with the results of an earlier run and fail on regressions. Example: --baseline ./baseline.json")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="Allowed relative regression. Example: --threshold 0.1")
+    # A single component case in this interpreter, see run_case()
+    parser.add_argument("--case", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--result", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        run_component(args.case, args.fixtures, args.repeat, args.result)
+        return
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    names = cases(sizes)
+    if args.cases:
+        names = [name for name in names if name.startswith(tuple(args.cases.split(",")))]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    directory = fixtures_dir(os.path.abspath(args.fixtures), args.seed)
+    prepare_fixtures(directory, sizes, args.seed)
+
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "settings": {"fixtures": FIXTURES_VERSION, "seed": args.seed, "repeat": args.repeat, "workers": args.workers,
+                     "extractors": EXTRACTORS, "category": CATEGORY},
+        "cases": {},
+    }
+    if baseline is not None and baseline["settings"] != results["settings"]:
+        print("The baseline was measured with other settings: {}".format(baseline["settings"]))
+    if baseline is not None and baseline["machine"] != results["machine"]:
+        print("The baseline was measured on another machine: {}".format(baseline["machine"]))
+
+    failed = []
+    for name in names:
+        print("Running {} ...".format(name), flush=True)
+        try:
+            results["cases"][name] = run_case(name, directory, sizes, args.repeat, args.workers)
+        except RuntimeError as e:
+            print("{} failed: {}".format(name, e))
+            failed.append(name)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print("")
+    print_results(results, baseline)
+    print("Saved the results to {}.".format(args.output))
+
+    regressions = compare(results, baseline, args.threshold) if baseline is not None else []
+    for regression in regressions:
+        print("Regression: " + regression)
+    if failed or regressions:
+        print("{} failed cases, {} regressions beyond {:.0%}.".format(len(failed), len(regressions), args.threshold))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,15 +8,28 @@
 ###############################################################################################################################
 
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import json
 import os
 import shutil
+import re
+import time
+from contextlib import closing
 from functools import partial
-from multiprocessing import Pool
+from queue import Queue
+from threading import Event, Thread
 from termcolor import colored
 
-from pipeline import pdf2txt
+from datasources import arxiv_index
+from helpers.category_query import CategoryQuery
+from helpers.cli_loader import progress_bar
+from pipeline import cache, downloader, extractors, files, metrics, scheduler, shards, state, vocabulary, writer
+from pipeline.pdf2txt import extract_and_remove, extraction_failed
 
 TIMELIMIT = 2*60
+# Number of PDFs that are sent to a worker at once
+CHUNKSIZE = 1
 STAMP_SEARCH_LIMIT = 1000
 
 PDF2TXT = 'pdf2txt.py'
@@ -24,181 +37,830 @@ PDFTOTEXT = 'pdftotext'
 
 RE_REPEATS = r'(\(cid:\d+\)|lllll|\.\.\.\.\.|\*\*\*\*\*)'
 
+# Output of the processed papers
+OUTPUT_FILE = "./arxiv_fulltext.json"
+# Output of the filtered metadata
+METADATA_FILE = "./arxiv_metadata.json"
+
+# Fields of the Kaggle snapshot that are used by the later stages and written to the outputs
+METADATA_COLUMNS = ["id", "submitter", "authors", "title", "doi", "categories", "abstract", "versions", "update_date"]
+
+# Parts of a PDF file name that are not part of the arXiv id
+RE_ID_EXTENSION = re.compile(r"\.(txt|pdf)$")
+RE_ID_VERSION = re.compile(r"v(\d+)$")
+RE_ID_SUBJECT_CLASS = re.compile(r"^([a-z\-]+)\.[A-Za-z\-]+/")
+RE_ID_OLD_STYLE = re.compile(r"^([a-z\-]+)(\d{7})$")
+
+# The categories field of a raw snapshot line, so that records can be filtered without parsing the whole line
+RE_CATEGORIES = re.compile(r'"categories":\s*"([^"]*)"')
+
+
+def stream_metadata(arxiv_kaggle_file, arxiv_category=None, arxiv_rows=None, columns=METADATA_COLUMNS, stats=None):
+    """
+    Read the Kaggle arXiv metadata snapshot line by line and yield the records that
+    match the category filter. Only one line is held in memory at a time.
+
+    Parameters
+    ----------
+    arxiv_kaggle_file : str
+        Path to the line-delimited Kaggle arXiv metadata JSON
+
+    arxiv_category : str
+        Optional category expression (see :mod:`helpers.category_query`)
+
+    arxiv_rows : int
+        Stop reading after this many lines of the snapshot
+
+    columns : list
+        Fields of each record to keep
+
+    stats : dict
+        Optional dict that receives the number of "scanned" and "kept" records
+
+    Yields
+    ------
+    record : dict
+        The selected fields of a matching record
+    """
+    if stats is None:
+        stats = {}
+    stats.update(scanned=0, kept=0)
+
+    query = CategoryQuery(arxiv_category) if arxiv_category is not None else None
+
+    with open(arxiv_kaggle_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if arxiv_rows is not None and stats["scanned"] >= arxiv_rows:
+                break
+            if not line.strip():
+                continue
+            stats["scanned"] += 1
+
+            if query is not None:
+                # Filter on the raw line first, so that only matching records are parsed
+                categories = RE_CATEGORIES.search(line)
+                if categories is not None and not query.matches(categories.group(1)):
+                    continue
+
+            record = json.loads(line)
+            if query is not None and categories is None and not query.matches(record.get("categories") or ""):
+                continue
+
+            stats["kept"] += 1
+            yield {column: record.get(column) for column in columns}
+
+
+def _index_rows(postings, n_rows, arxiv_category=None, arxiv_rows=None):
+    """
+    Select the row ids of the columnar index that match the category expression.
+
+    Parameters
+    ----------
+    postings : dict
+        Inverted category index (see :func:`datasources.arxiv_index.load_categories`)
+
+    n_rows : int
+        Number of rows in the index
+
+    arxiv_category : str
+        Optional category expression (see :mod:`helpers.category_query`)
+
+    arxiv_rows : int
+        Only consider the first arxiv_rows rows of the snapshot
+
+    Returns
+    -------
+    rows : np.ndarray
+        Sorted row ids
+    """
+    if arxiv_category is None:
+        rows = np.arange(n_rows)
+    else:
+        rows = np.flatnonzero(CategoryQuery(arxiv_category).mask_index(postings, n_rows))
 
-def preprocess(arxiv_kaggle_file, arxiv_category=None, arxiv_rows=None):
-    # Load the Kaggle arXiv Metadata JSON file
-    arxiv_metadata_json = pd.read_json(arxiv_kaggle_file, lines=True, orient="records")
     if arxiv_rows is not None:
-        arxiv_metadata_json = arxiv_metadata_json.head(arxiv_rows)
+        rows = rows[rows < arxiv_rows]
+    return rows
+
+
+def parquet_schema(text=True):
+    """ Typed columns of the Parquet outputs: the metadata and, for the processed papers, the text """
+    fields = []
+    for column in METADATA_COLUMNS:
+        if column == "versions":
+            fields.append((column, arxiv_index.VERSION_TYPE))
+        elif column == "update_date":
+            fields.append((column, pa.date32()))
+        else:
+            fields.append((column, pa.string()))
+    if text:
+        fields.append((writer.TEXT_COLUMN, pa.string()))
+    return pa.schema(fields)
+
+
+def preprocess(arxiv_kaggle_file, arxiv_category=None, arxiv_rows=None, use_index=True, output_format="jsonl"):
+    # Load the metadata as one timed stage
+    with metrics.timer("metadata", bytes_in=os.path.getsize(arxiv_kaggle_file)):
+        if use_index:
+            # Ingest the snapshot into the columnar index once, then only read the matching rows
+            index_dir = arxiv_index.index_dir_for(arxiv_kaggle_file)
+            if not arxiv_index.is_fresh(index_dir, arxiv_kaggle_file, METADATA_COLUMNS):
+                print("Building the columnar index of the arXiv metadata in " + index_dir + ". This is only done once per snapshot.")
+                arxiv_index.build_index(stream_metadata(arxiv_kaggle_file), arxiv_kaggle_file, index_dir, METADATA_COLUMNS)
+
+            n_rows = arxiv_index.num_rows(index_dir)
+            rows = _index_rows(arxiv_index.load_categories(index_dir), n_rows, arxiv_category=arxiv_category, arxiv_rows=arxiv_rows)
+            arxiv_metadata_df = arxiv_index.read_rows(index_dir, rows, METADATA_COLUMNS)
+            scanned = n_rows if arxiv_rows is None else min(n_rows, arxiv_rows)
+        else:
+            # Stream the Kaggle arXiv Metadata JSON file and keep only the matching records
+            stats = {}
+            arxiv_metadata_df = pd.DataFrame.from_records(
+                stream_metadata(arxiv_kaggle_file, arxiv_category=arxiv_category, arxiv_rows=arxiv_rows, stats=stats),
+                columns=METADATA_COLUMNS,
+            )
+            scanned = stats["scanned"]
+    metrics.count("metadata_rows", len(arxiv_metadata_df))
+
     # Print the number of rows in the arXiv Metadata JSON
-    print("Loaded {} entreis from the arXiv metadata JSON file.".format(len(arxiv_metadata_json)))
+    print("Loaded {} entries from the arXiv metadata JSON file.".format(scanned))
 
     if arxiv_category is not None:
-        # Split the category string into a list if multiple categories are provided. Else put the category into a list
-        if "OR" in arxiv_category:
-            arxiv_category = arxiv_category.split(" OR ")
-            # Filter the arXiv Metadata JSON by category list with OR logic
-            arxiv_metadata_df = arxiv_metadata_json[arxiv_metadata_json["categories"].str.contains("|".join(arxiv_category))]
-        elif "AND" in arxiv_category:
-            arxiv_category = arxiv_category.split(" AND ")
-            # Filter the arXiv Metadata JSON by category list with AND logic
-            arxiv_metadata_df = arxiv_metadata_json[arxiv_metadata_json["categories"].str.contains("&".join(arxiv_category))]
-        else:
-            # Filter the arXiv Metadata JSON by single category
-            arxiv_metadata_df = arxiv_metadata_json[arxiv_metadata_json["categories"].str.contains(arxiv_category)]
-
         # Print the number of rows in the filtered arXiv Metadata df
-        print("Filtered out the categories " + str(arxiv_category) + " to a total number of " + str(arxiv_metadata_df["id"].count()) + " entries.")
-    else:
-        arxiv_metadata_df = arxiv_metadata_json
+        print("Filtered out the categories " + arxiv_category + " to a total number of " + str(arxiv_metadata_df["id"].count()) + " entries.")
 
     if arxiv_metadata_df["id"].count() == 0:
         print(colored("No entries found for the given category. Please check the categories and try again.", "red", attrs=["bold"]))
         exit()
     
     # Save the filtered arXiv Metadata JSON to a JSON file
-    arxiv_metadata_df.to_json("arxiv_metadata.json", orient="records", lines=True)
+    if output_format == "parquet":
+        # Missing values are written as null
+        with metrics.timer("write") as sizes:
+            with writer.ParquetWriter(METADATA_FILE, parquet_schema(text=False), observe=False) as output:
+                for record in arxiv_metadata_df.astype(object).where(arxiv_metadata_df.notna(), None).to_dict("records"):
+                    output.write(record)
+            sizes["bytes_out"] = os.path.getsize(output.path)
+    else:
+        with metrics.timer("write") as sizes:
+            arxiv_metadata_df.to_json(METADATA_FILE, orient="records", lines=True)
+            sizes["bytes_out"] = os.path.getsize(METADATA_FILE)
 
     return arxiv_metadata_df
 
-def process(arxiv_metadata_df, pdf_dir, arxiv_storage_size=None):
+def process(arxiv_metadata_df, pdf_dir, arxiv_storage_size=None, remove_pdfs=True, chunksize=CHUNKSIZE, stream_output=False, compression=None, output_format="jsonl", token_counts=False, deduplicator=None, cache_path=None, cache_size=cache.MAX_SIZE, extractor_chain=extractors.DEFAULT_CHAIN, max_pages=None, workers=None, task_timeout=scheduler.TASK_TIMEOUT, maxtasksperchild=scheduler.MAXTASKSPERCHILD, state_path=None):
+    crawl_state = state.CrawlState(state_path) if state_path else None
     try:
         # Convert the PDFs to text and save them to a JSON file
 
-        globber = os.path.join(pdf_dir, '**/*.pdf') # search expression for glob.glob
-        pdffiles = pdf2txt.sorted_files(globber)  # a list of path
+        # Largest files first, so that the slowest PDFs do not start at the end of the run
+        pdffiles = files.ordered(files.walk(pdf_dir), "largest")
+
+        if crawl_state is not None:
+            # Skip the PDFs whose paper was written in an earlier run with the same or a higher version
+            pending = crawl_state.pending(parse_file_name(os.path.basename(pdffile)) for pdffile in pdffiles)
+            print("Incremental crawl: " + str(sum(pending)) + " of " + str(len(pdffiles)) + " PDFs are new or have a new version.")
+            pdffiles = [pdffile for pdffile, is_pending in zip(pdffiles, pending) if is_pending]
+
+        # The vocabulary of the cleaning is built (and downloaded) here once, the workers only map it
+        vocabulary.ensure()
+
+        # Extract and clean the PDFs in the workers, the parent only collects the cleaned records
+        pool = scheduler.Scheduler(
+            partial(extract_and_remove, timelimit=TIMELIMIT, remove_pdf=remove_pdfs, cache_path=cache_path, cache_size=cache_size, extractor_chain=extractor_chain, max_pages=max_pages, minhash=deduplicator is not None),
+            workers=workers, chunksize=chunksize, task_timeout=task_timeout, maxtasksperchild=maxtasksperchild,
+            on_failure=partial(extraction_failed, remove_pdf=remove_pdfs))
+        print("Using " + str(pool.workers) + " worker processes (" + str(os.cpu_count()) + " cores are available).")
+
+        cache_counts = {}
+        with progress_bar("Converting PDFs", total=len(pdffiles)) as bar, closing(pool.imap_unordered(pdffiles)) as records:
+            records = metrics.track(cache.count_hits(records, cache_counts), progress=bar)
+            is_processed = collect_fulltext(arxiv_metadata_df, records, stream_output=stream_output, compression=compression, output_format=output_format, token_counts=token_counts, deduplicator=deduplicator, crawl_state=crawl_state)
+
+        print("Conversion finished.")
+        pool.report()
+        cache.report(cache_counts)
+
+        return is_processed
+
+    except Exception as e:
+        print("Processing failed: " + str(e))
+        return False
+
+    finally:
+        if crawl_state is not None:
+            crawl_state.close()
+
+def merge_fulltext(arxiv_metadata_df, records, compression=None, output_format="jsonl", token_counts=False, deduplicator=None, crawl_state=None, output_path=OUTPUT_FILE):
+    """
+    Join the texts with the metadata once all records are in and save them to output_path in the order of the
+    metadata. The metadata is indexed by arXiv id and every text is looked up as it arrives, so the texts are held
+    once and never copied into a dataframe. Of several versions of a paper the text of the highest one is kept, and of
+    near-duplicate papers the first one in the metadata. With a crawl state the papers are appended to the output and
+    recorded as written.
+    """
+    try:
+        with metrics.timer("merge"):
+            lookup = metadata_lookup(arxiv_metadata_df)
+
+        # arXiv id -> (version, text, signature)
+        fulltexts = {}
+        received = 0
+        stored = 0
+        for record in records:
+            received += 1
+            if record["text"] is None:
+                continue
+            stored += 1
+            pdf_id, version = parse_file_name(os.path.basename(record["path"]))
+            if pdf_id in lookup and version > fulltexts.get(pdf_id, (-1, None, None))[0]:
+                fulltexts[pdf_id] = (version, record["text"], record.get("signature"))
+
+        print("Finished storing " + str(stored) + " of " + str(received) + " fulltexts, " + str(len(fulltexts)) + " of them match the metadata.")
+
+        written = []
+        with writer.open_output(output_path, output_format=output_format, compression=compression, append=crawl_state is not None, schema=parquet_schema(), token_counts=token_counts) as output:
+            for pdf_id, metadata in lookup.items():
+                if pdf_id in fulltexts:
+                    version, text, signature = fulltexts.pop(pdf_id)
+                    if deduplicator is not None and deduplicator.check(metadata["id"], signature) is not None:
+                        continue
+                    output.write(dict(metadata, text=text))
+                    written.append((pdf_id, version))
+                    written = mark_written(crawl_state, output, written)
+            mark_written(crawl_state, output, written, force=True)
+
+        print("Finished saving the processed arXiv data to " + output.path + ".")
 
-        CPU_COUNT = os.cpu_count() - 2
-        # CPU_COUNT = 4
-        print("Using " + str(CPU_COUNT) + " cores (" + str(os.cpu_count()) + " are available).")
-        pool = Pool(CPU_COUNT)
-        pool.map(partial(pdf2txt.convert_safe, timelimit=TIMELIMIT), pdffiles)
-        pool.close()
-        pool.join()
+        return True
+    
+    except Exception as e:
+        print("Processing failed: " + str(e))
+        return False
 
-        print("Conversion finished. Now moving the files to the arxiv_txt folder and deleting the PDF files.")
+def clean_abstracts(abstracts):
+    """ Remove single characters and collapse the whitespace of the abstracts """
+    return abstracts.str.replace(r'\s+[a-zA-Z]\s+', ' ', regex=True).str.replace(r'\s+', ' ', regex=True).str.strip()
+
+
+def metadata_lookup(arxiv_metadata_df):
+    """
+    Index the metadata by normalized arXiv id (see :func:`normalize_id`) for merging texts as they arrive. The first
+    entry of duplicated ids is kept and the abstracts are cleaned. The caller's frame is not modified.
+
+    Returns
+    -------
+    lookup : dict
+        Maps every normalized id to its metadata record, in the order of the frame
+    """
+    metadata_df = arxiv_metadata_df.assign(abstract=clean_abstracts(arxiv_metadata_df["abstract"]))
+    # Missing values are written as null
+    metadata_df = metadata_df.astype(object).where(metadata_df.notna(), None)
+    lookup = {}
+    for record in metadata_df.to_dict("records"):
+        lookup.setdefault(normalize_id(record["id"]), record)
+    return lookup
+
+
+def stream_fulltext(arxiv_metadata_df, records, compression=None, output_format="jsonl", token_counts=False, deduplicator=None, crawl_state=None, output_path=OUTPUT_FILE):
+    """
+    Merge every text with its metadata and write it as soon as it arrives. Only the metadata is kept in memory, so
+    of several versions of a paper the one that arrives first is written, and of near-duplicate papers too. With a
+    crawl state the papers are appended to the output and recorded as written.
+    """
+    try:
+        with metrics.timer("merge"):
+            lookup = metadata_lookup(arxiv_metadata_df)
+        written_ids = set()
+        written = []
+        received = 0
+
+        with writer.open_output(output_path, output_format=output_format, compression=compression, append=crawl_state is not None, schema=parquet_schema(), token_counts=token_counts) as output:
+            for record in records:
+                received += 1
+                if record["text"] is None:
+                    continue
+
+                pdf_id, version = parse_file_name(os.path.basename(record["path"]))
+                if pdf_id in written_ids or pdf_id not in lookup:
+                    continue
+
+                written_ids.add(pdf_id)
+                if deduplicator is not None and deduplicator.check(lookup[pdf_id]["id"], record.get("signature")) is not None:
+                    continue
+                output.write(dict(lookup[pdf_id], text=record["text"]))
+                written.append((pdf_id, version))
+                written = mark_written(crawl_state, output, written)
+            mark_written(crawl_state, output, written, force=True)
+
+        print("Finished streaming " + str(len(written_ids)) + " of " + str(received) + " fulltexts to " + output.path + ".")
 
-        # Move the TXT files to the arxiv_txt folder and delete the PDF files
-        for pdffile in pdffiles:
-            txtfile = pdf2txt.reextension(pdffile, 'txt')
-            shutil.move(txtfile, "./tmp/arxiv_txt")
-            os.remove(pdffile)
+        return True
 
-        print("Finished moving the files to the arxiv_txt folder and deleting the PDF files.")
-        
-        # Open all *.txt files from the fulltext folder and save them in a dataframe
-        files = [f for f in os.listdir("./tmp/arxiv_txt") if f.endswith(".txt")]
+    except Exception as e:
+        print("Processing failed: " + str(e))
+        return False
 
-        print("Finished reading the fulltext files.")
 
-        # Store files in a pandas dataframe - name as id and content as text
-        file_list = []
-        for file in files:
-            with open("./tmp/arxiv_txt/" + str(file), "r") as f:
-                text = pdf2txt.cleaned_text(f.read())
-                file_list.append([str(file), str(text)])
-                #arxiv_fulltext_df = arxiv_fulltext_df.append({"id": str(file).str.replace("v\d+", "").str.replace(".txt", ""), "text": str(text)}, ignore_index=True)
-        arxiv_fulltext_df = pd.DataFrame(file_list, columns=["id", "text"])
+def collect_fulltext(arxiv_metadata_df, records, stream_output=False, compression=None, output_format="jsonl", token_counts=False, deduplicator=None, crawl_state=None, output_path=OUTPUT_FILE):
+    """
+    Merge the cleaned records from the workers with the metadata and save them to output_path.
 
-        print("Finished storing the fulltext files into a dataframe.")
+    Parameters
+    ----------
+    arxiv_metadata_df : pandas.DataFrame
+        Metadata of the papers
 
-        arxiv_fulltext_df["id"] = arxiv_fulltext_df["id"].str.replace(r"v\d+", "", regex=True).str.replace(r".txt", "", regex=True)
-        arxiv_fulltext_df.drop_duplicates(subset="id", inplace=True)
-        arxiv_metadata_df.drop_duplicates(subset="id", inplace=True)
+    records : iterable of dict
+        Records from :func:`extract_and_remove`
 
-        print("Finished dropping duplicates.")
+    stream_output : bool
+        Write every record as soon as it arrives instead of merging all of them in a dataframe
 
-        # Merge the two dataframes
-        processed_arxiv_df = pd.merge(arxiv_metadata_df, arxiv_fulltext_df, on="id")
+    compression : str
+        None, "gzip" or "zstd" (streaming output only). For Parquet outputs the codec of the columns.
 
-        print("Finished merging the two dataframes.")
+    output_format : str
+        "jsonl" or "parquet" (see pipeline.writer.FORMATS)
 
-        # Clean the abstracts in processed_arxiv_df
-        processed_arxiv_df["abstract"] = processed_arxiv_df["abstract"].str.replace(r'\s+[a-zA-Z]\s+', ' ', regex=True).str.replace(r'\s+', ' ', regex=True).str.strip()
+    token_counts : bool
+        Add the number of tokens of every text to Parquet outputs
 
-        print("Finished cleaning the abstracts.")
+    deduplicator : pipeline.dedup.Deduplicator
+        Optional index of the near-duplicate detection. Papers whose text is a near-duplicate of a written paper are
+        not written. The records need the MinHash signatures of the workers.
 
-        processed_arxiv_df.to_json("./arxiv_fulltext.json", orient="records", lines=True)
+    crawl_state : pipeline.state.CrawlState
+        Optional state of an incremental crawl. The status of every record is recorded and the output is appended to.
 
-        print("Finished saving the processed arXiv data to a JSON file.")
+    output_path : str
+        Output file (without the compression suffix, Parquet outputs get the suffix .parquet instead of .json)
 
-        return True
-    
-    except Exception as e:
-        print("Processing failed: " + str(e))
-        return False
+    Returns
+    -------
+    bool
+        True if the output was written
+    """
+    if crawl_state is not None:
+        records = record_status(records, crawl_state)
+    if stream_output:
+        return stream_fulltext(arxiv_metadata_df, records, compression=compression, output_format=output_format, token_counts=token_counts, deduplicator=deduplicator, crawl_state=crawl_state, output_path=output_path)
+    return merge_fulltext(arxiv_metadata_df, records, compression=compression, output_format=output_format, token_counts=token_counts, deduplicator=deduplicator, crawl_state=crawl_state, output_path=output_path)
 
-def download(arxiv_metadata_df, arxiv_storage_size=None, arxiv_process=False):
+
+def record_status(records, crawl_state):
+    """ Pass records through while recording in the crawl state whether their paper was extracted and cleaned """
+    for record in records:
+        paper = parse_file_name(os.path.basename(record["path"]))
+        if record["text"] is None:
+            crawl_state.fail(paper, record["error"])
+        else:
+            now = time.time()
+            crawl_state.mark([paper], "extracted", when=now - record["stats"]["stages"].get("clean", 0.0))
+            crawl_state.mark([paper], "cleaned", when=now)
+        yield record
+
+
+def mark_written(crawl_state, output, written, force=False):
+    """
+    Record the written papers in the crawl state once the output is synced, every writer.FSYNC_EVERY papers or when
+    forced. Returns the papers that are not recorded yet.
+    """
+    if crawl_state is None:
+        return []
+    if written and (force or len(written) >= writer.FSYNC_EVERY):
+        output.sync()
+        crawl_state.mark(written, "written")
+        return []
+    return written
+
+
+def latest_versions(arxiv_metadata_df):
+    """ The number of the latest version of every paper (the last entry of its versions) """
+    return [int(versions[-1]["version"].lstrip("v")) for versions in arxiv_metadata_df["versions"]]
+
+
+def pending_papers(arxiv_metadata_df, crawl_state, status="written"):
+    """
+    The rows of the metadata whose paper has not reached status in an earlier run of an incremental crawl, i.e. new
+    papers and papers with a new version since then.
+
+    Parameters
+    ----------
+    arxiv_metadata_df : pandas.DataFrame
+        Metadata with the "id" and "versions" columns
+
+    crawl_state : pipeline.state.CrawlState
+        State of the incremental crawl
+
+    status : str
+        "written" for crawls that process the PDFs, "downloaded" for download-only crawls
+
+    Returns
+    -------
+    arxiv_metadata_df : pandas.DataFrame
+        The pending rows
+    """
+    papers = zip([normalize_id(pdf_id) for pdf_id in arxiv_metadata_df["id"]], latest_versions(arxiv_metadata_df))
+    return arxiv_metadata_df[crawl_state.pending(papers, status)]
+
+
+def pdf_keys(arxiv_metadata_df):
+    """
+    Build the object keys of the latest PDF version of every paper in the GCP Bucket with vectorized column operations:
+
+        new-style ids: arxiv/arxiv/pdf/[yymm]/[id][version].pdf, e.g. arxiv/arxiv/pdf/0704/0704.0001v2.pdf
+        old-style ids: arxiv/[archive]/pdf/[yymm]/[archive][number][version].pdf, e.g. arxiv/hep-th/pdf/9901/hep-th9901001v1.pdf
+
+    Parameters
+    ----------
+    arxiv_metadata_df : pandas.DataFrame
+        Metadata with the "id" and "versions" columns
+
+    Returns
+    -------
+    keys : pandas.Series
+        Object keys aligned with arxiv_metadata_df
+    """
+    ids = arxiv_metadata_df["id"].astype(str)
+    # A single pass over the versions column; the last entry is the latest version
+    latest_version = pd.Series([versions[-1]["version"] for versions in arxiv_metadata_df["versions"]], index=ids.index, dtype=ids.dtype)
+
+    archive = pd.Series("arxiv", index=ids.index, dtype=ids.dtype)
+    yymm = ids.str[:4]
+    filename = ids.copy()
+
+    # Old-style ids (hep-th/9901001) may carry a subject class (math.GT/0309136), which is not part of the bucket layout
+    old_style = ids.str.contains("/", regex=False)
+    if old_style.any():
+        old_ids = ids[old_style]
+        archive[old_style] = old_ids.str.replace(r"[./].*$", "", regex=True)
+        yymm[old_style] = old_ids.str.replace(r"^.*/", "", regex=True).str[:4]
+        filename[old_style] = old_ids.str.replace(r"^([^./]+)[^/]*/", r"\1", regex=True)
+
+    return downloader.GCS_ARXIV_PREFIX + "/" + archive + "/pdf/" + yymm + "/" + filename + latest_version + ".pdf"
+
+
+def parse_file_name(name):
+    """
+    Turn a PDF or text file name from the GCP Bucket into the arXiv id and the version by stripping the extension and
+    restoring the slash of old-style ids (hep-th9901001v1.txt -> hep-th/9901001, 1).
+
+    Returns
+    -------
+    id : str
+        See :func:`normalize_id`
+
+    version : int
+        The version number, 0 if the name has none
+    """
+    name = RE_ID_EXTENSION.sub("", name)
+    version = RE_ID_VERSION.search(name)
+    if version is not None:
+        name = name[:version.start()]
+    return normalize_id(name), int(version.group(1)) if version is not None else 0
+
+
+def normalize_id(name):
+    """
+    The arXiv id of a metadata record or a file name, without extension, version and the subject class of old-style
+    ids, which is not part of the file names (math.GT/0309136 and math0309136v1.pdf -> math/0309136).
+    """
+    name = RE_ID_EXTENSION.sub("", name)
+    name = RE_ID_VERSION.sub("", name)
+    name = RE_ID_SUBJECT_CLASS.sub(r"\1/", name)
+    return RE_ID_OLD_STYLE.sub(r"\1/\2", name)
+
+
+def download(arxiv_metadata_df, arxiv_storage_size=None, arxiv_process=False, download_backend="gcs", download_location=None, download_workers=downloader.WORKERS, stream_output=False, compression=None, output_format="jsonl", token_counts=False, deduplicator=None, cache_path=None, cache_size=cache.MAX_SIZE, extractor_chain=extractors.DEFAULT_CHAIN, max_pages=None, workers=None, task_timeout=scheduler.TASK_TIMEOUT, maxtasksperchild=scheduler.MAXTASKSPERCHILD, state_path=None, output_path=OUTPUT_FILE, tmp_dir="./tmp"):
     # Download the PDFs from the arXiv Metadata JSON
 
+    crawl_state = state.CrawlState(state_path) if state_path else None
     try:
         # Print the number of rows of id column of the df
         print("Found " + str(arxiv_metadata_df["id"].count()) + " entries.")
 
-        # Filter all papers that have an update_date from 2008 and later - This has to be done since the arXiv ID changed after 2008
-        arxiv_metadata_df = arxiv_metadata_df[arxiv_metadata_df["update_date"] >= "2007-01-01"]
-        
-        # Print the number of rows of id column of the df
-        print("Reduced it to " + str(arxiv_metadata_df["id"].count()) + " entries after filtering for update_date > 2007 (IDs are different before that).")
+        if crawl_state is not None:
+            # Only the papers that are new or have a new version since the last run
+            total = len(arxiv_metadata_df)
+            arxiv_metadata_df = pending_papers(arxiv_metadata_df, crawl_state, "written" if arxiv_process else "downloaded")
+            print("Incremental crawl: " + str(len(arxiv_metadata_df)) + " of " + str(total) + " papers are new or have a new version.")
+            if arxiv_metadata_df.empty:
+                print("Everything is up to date.")
+                return True
 
-        list_of_gsutil_urls = []
+        def downloaded_file(pdffile):
+            if crawl_state is not None:
+                crawl_state.mark([parse_file_name(os.path.basename(pdffile))], "downloaded")
 
-        if not os.path.exists("./tmp/arxiv_pdf"):
-            os.makedirs("./tmp/arxiv_pdf")
-        if not os.path.exists("./tmp/arxiv_txt"):
-            os.makedirs("./tmp/arxiv_txt")
+        pdf_dir = os.path.join(tmp_dir, "arxiv_pdf")
+        if not os.path.exists(pdf_dir):
+            os.makedirs(pdf_dir)
 
-        # Download the PDFs from GCP Bucket by using gsutil cp with gs://arxiv-dataset/arxiv/cs/pdf/[json_id].pdf
-        for index, row in arxiv_metadata_df.iterrows():
-            # Get the id and the first 4 characters of the id for yymm marker
-            pdf_id = row['id']
-            pdf_yymm = row["id"][:4]
-
-            # Get the latest version from versions
-            pdf_version = row["versions"][-1]["version"]
-            list_of_gsutil_urls.append('gs://arxiv-dataset/arxiv/arxiv/pdf/'+pdf_yymm+"/"+pdf_id+pdf_version+'.pdf')
-            #print('gs://arxiv-dataset/arxiv/arxiv/pdf/'+pdf_yymm+"/"+pdf_id+pdf_version+'.pdf')
+        # Object keys in the GCP Bucket layout for old-style and new-style ids
+        with metrics.timer("keys"):
+            list_of_pdf_keys = list(zip(arxiv_metadata_df["id"], pdf_keys(arxiv_metadata_df)))
 
         # Print the number of PDFs to be downloaded
-        print("This script will download " + str(len(list_of_gsutil_urls)) + " PDFs from the GCP Bucket.")
-
-        # Save the list_of_gsutil_urls to a txt file
-        with open("./tmp/list_of_gsutil_urls.txt", "w") as f:
-            for item in list_of_gsutil_urls:
-                f.write("%s\n" % item)
+        print("This script will download " + str(len(list_of_pdf_keys)) + " PDFs using the " + download_backend + " backend.")
 
-        print("Saved the list of gsutil URLs to a txt file.")
+        backend = downloader.make_backend(download_backend, download_location)
+        manifest_path = os.path.join(tmp_dir, "download_manifest.jsonl")
 
-        # Download the PDFs from GCP Bucket by using gsutil cp with gs://arxiv-dataset/arxiv/cs/pdf/[json_id].pdf
-        os.system("gsutil -m cp -I ./tmp/arxiv_pdf/ < ./tmp/list_of_gsutil_urls.txt > /dev/null 2>&1")
+        if not arxiv_process:
+            # Download the PDFs concurrently. The manifest allows an interrupted run to resume where it stopped.
+            with progress_bar("Downloading PDFs", total=len(list_of_pdf_keys)) as bar:
+                summary = downloader.download_all(list_of_pdf_keys, pdf_dir, backend, manifest_path, workers=download_workers, on_done=lambda pdf_id, pdffile: (downloaded_file(pdffile), bar()))
+        else:
+            # Extract and clean the PDFs while they are downloaded. Every PDF is deleted as soon as its text is back
+            # in the parent and the downloads pause while the PDFs on disk would exceed the storage size.
+            budget = downloader.DiskBudget(arxiv_storage_size * 1024**3 if arxiv_storage_size else None)
+            downloaded = Queue()
+            download_result = {}
+            cancel = Event()
+
+            def run_downloads():
+                try:
+                    download_result["summary"] = downloader.download_all(
+                        list_of_pdf_keys, pdf_dir, backend, manifest_path, workers=download_workers,
+                        on_done=lambda pdf_id, pdffile: (downloaded_file(pdffile), downloaded.put(pdffile)), budget=budget, cancel=cancel)
+                except Exception as e:
+                    download_result["error"] = e
+                finally:
+                    downloaded.put(None)
+
+            vocabulary.ensure()
+            pool = scheduler.Scheduler(
+                partial(extract_and_remove, timelimit=TIMELIMIT, cache_path=cache_path, cache_size=cache_size, extractor_chain=extractor_chain, max_pages=max_pages, minhash=deduplicator is not None),
+                workers=workers, task_timeout=task_timeout, maxtasksperchild=maxtasksperchild, on_failure=extraction_failed)
+            print("Using " + str(pool.workers) + " worker processes (" + str(os.cpu_count()) + " cores are available).")
+
+            download_thread = Thread(target=run_downloads, daemon=True)
+            download_thread.start()
+
+            def released(records):
+                for record in records:
+                    budget.release(record["stats"]["pdf_bytes"])
+                    yield record
+
+            # Every record releases the space of its PDF, including the ones of timed out and crashed workers
+            cache_counts = {}
+            try:
+                with progress_bar("Downloading and converting PDFs", total=len(list_of_pdf_keys)) as bar, closing(pool.imap_unordered(iter(downloaded.get, None))) as records:
+                    records = metrics.track(cache.count_hits(released(records), cache_counts), progress=bar)
+                    is_processed = collect_fulltext(arxiv_metadata_df, records, stream_output=stream_output, compression=compression, output_format=output_format, token_counts=token_counts, deduplicator=deduplicator, crawl_state=crawl_state, output_path=output_path)
+            finally:
+                # Stop the downloads if collecting the texts stopped early, nobody would delete their PDFs anymore.
+                # After a complete run the downloads are already done.
+                cancel.set()
+                download_thread.join()
+
+            if "error" in download_result:
+                raise download_result["error"]
+            summary = download_result["summary"]
+
+            print("Conversion finished. Peak storage of the downloaded PDFs was {:.2f} GB.".format(budget.peak / 1024**3))
+            pool.report()
+            cache.report(cache_counts)
+
+        if summary["failed"]:
+            print(colored("Failed to download " + str(summary["failed"]) + " PDFs. See " + manifest_path + " for details.", "red"))
+
+        if not arxiv_process:
+            is_processed = True
+        else:
+            # Delete the tmp folder with the download manifest
+            shutil.rmtree(tmp_dir, ignore_errors=True)
 
-        if arxiv_process:
-            # Process the PDFs
-            is_processed = process(arxiv_metadata_df, "./tmp/arxiv_pdf")
+        return is_processed
 
-            # Delete the PDFs
-            os.system("rm -rf ./tmp/arxiv_pdf")
+    except Exception as e:
+        print("Error: " + str(e))
+        return False
 
-            # Delete the TXT files
-            os.system("rm -rf ./tmp/list_of_gsutil_urls.txt")
-            os.system("rm -rf ./tmp/arxiv_txt")
+    finally:
+        if crawl_state is not None:
+            crawl_state.close()
+
+def process_local_pdfs(arxiv_metadata_df, arxiv_local_PDF_dir, chunksize=CHUNKSIZE, stream_output=False, compression=None, output_format="jsonl", token_counts=False, deduplicator=None, cache_path=None, cache_size=cache.MAX_SIZE, extractor_chain=extractors.DEFAULT_CHAIN, max_pages=None, workers=None, task_timeout=scheduler.TASK_TIMEOUT, maxtasksperchild=scheduler.MAXTASKSPERCHILD, state_path=None):    
+    # The local PDFs belong to the user, so they are kept
+    is_processed = process(arxiv_metadata_df, arxiv_local_PDF_dir, remove_pdfs=False, chunksize=chunksize, stream_output=stream_output, compression=compression, output_format=output_format, token_counts=token_counts, deduplicator=deduplicator, cache_path=cache_path, cache_size=cache_size, extractor_chain=extractor_chain, max_pages=max_pages, workers=workers, task_timeout=task_timeout, maxtasksperchild=maxtasksperchild, state_path=state_path)
+
+    return is_processed
+
+
+def split_shards(arxiv_metadata_df, crawl_dir, n_shards=shards.SHARDS):
+    """
+    Write the metadata of a sharded crawl to crawl_dir in n_shards contiguous shards of about the same size, so that
+    the merged outputs keep the order of the metadata. Duplicated ids are dropped first, as in :func:`metadata_lookup`.
+
+    Returns
+    -------
+    rows : list of int
+        Number of rows of every shard
+    """
+    arxiv_metadata_df = arxiv_metadata_df[~pd.Series([normalize_id(pdf_id) for pdf_id in arxiv_metadata_df["id"]]).duplicated().values]
+    os.makedirs(os.path.join(crawl_dir, shards.SHARDS_DIR), exist_ok=True)
+
+    rows = []
+    for shard, positions in enumerate(np.array_split(np.arange(len(arxiv_metadata_df)), max(1, min(n_shards, len(arxiv_metadata_df))))):
+        path = shards.shard_file(crawl_dir, shard)
+        tmp_path = path + ".tmp"
+        arxiv_metadata_df.iloc[positions].to_json(tmp_path, orient="records", lines=True)
+        os.replace(tmp_path, path)
+        rows.append(len(positions))
+    return rows
+
+
+def read_shard(crawl_dir, shard):
+    """ The metadata of a shard, with the same columns and types as the frame of :func:`preprocess` """
+    return pd.read_json(shards.shard_file(crawl_dir, shard), lines=True, dtype=False, convert_dates=False)
+
+
+def merge_shards(outputs, output_path=OUTPUT_FILE):
+    """
+    Concatenate the outputs of the shards into output_path. Compressed outputs are concatenated as they are, as gzip
+    members or zstd frames, which the decompressors read as one stream. Parquet outputs are merged row group by row
+    group. All outputs need the same format and compression.
+
+    Returns
+    -------
+    path : str
+        The merged output, with the compression suffix of the shard outputs. None if there are no outputs, e.g. when
+        every shard failed, as their format is unknown then.
+    """
+    if not outputs:
+        print("There is no shard output to merge.")
+        return None
+
+    formats = {writer.format_of(output) for output in outputs}
+    compressions = {writer.compression_of(output) for output in outputs}
+    if len(formats) > 1 or len(compressions) > 1:
+        raise ValueError("The shards were written with different formats or compressions: " + ", ".join(os.path.basename(output) for output in outputs[:2]))
+
+    if formats == {"parquet"}:
+        with metrics.timer("merge_shards") as sizes:
+            tmp_path = writer.merge_parquet(outputs, output_path + ".tmp")
+            path = writer.output_path(output_path, output_format="parquet")
+            os.replace(tmp_path, path)
+            sizes["bytes_out"] = os.path.getsize(path)
+        return path
+
+    path = writer.output_path(output_path, compressions.pop() if compressions else None)
+
+    with metrics.timer("merge_shards") as sizes:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as merged:
+            for output in outputs:
+                with open(output, "rb") as f:
+                    shutil.copyfileobj(f, merged, downloader.CHUNK_SIZE)
+            merged.flush()
+            os.fsync(merged.fileno())
+        os.replace(tmp_path, path)
+        sizes["bytes_out"] = os.path.getsize(path)
+    return path
+
+
+def coordinate(arxiv_metadata_df, crawl_dir, n_shards=shards.SHARDS, poll_interval=shards.POLL_INTERVAL, output_path=OUTPUT_FILE):
+    """
+    Coordinator of a sharded crawl on several machines: split the metadata into shards and enqueue them in crawl_dir,
+    wait until the workers (see :func:`work`) processed every shard and merge their outputs into output_path. A crawl
+    that was started before in crawl_dir is resumed instead of split again.
+
+    Parameters
+    ----------
+    arxiv_metadata_df : pandas.DataFrame
+        Metadata of the papers, from :func:`preprocess`
+
+    crawl_dir : str
+        Directory on storage that all machines share
+
+    n_shards : int
+        Number of shards, at most one per paper
+
+    poll_interval : float
+        Seconds between two looks at the queue
+
+    Returns
+    -------
+    bool
+        True if every shard was processed and the outputs were merged
+    """
+    try:
+        with shards.ShardQueue(os.path.join(crawl_dir, shards.QUEUE_FILE)) as queue:
+            total = queue.total()
+            if total:
+                print("Resuming the sharded crawl in " + crawl_dir + " with " + str(total) + " shards.")
+            else:
+                with metrics.timer("split_shards"):
+                    rows = split_shards(arxiv_metadata_df, crawl_dir, n_shards)
+                # The shard files exist before the workers can claim them
+                queue.add(rows)
+                total = len(rows)
+                print("Split " + str(sum(rows)) + " papers into " + str(total) + " shards in " + crawl_dir + ". Start the workers with --worker " + crawl_dir + ".")
+
+            with progress_bar("Waiting for the workers", total=total) as bar:
+                shown = 0
+                while True:
+                    counts = queue.counts()
+                    finished = counts.get(shards.DONE, 0) + counts.get(shards.FAILED, 0)
+                    if finished > shown:
+                        bar(finished - shown)
+                        shown = finished
+                    if queue.finished():
+                        break
+                    time.sleep(poll_interval)
+
+            outputs = queue.outputs()
+            path = merge_shards(outputs, output_path)
+            if path is not None:
+                print("Merged the outputs of " + str(len(outputs)) + " of " + str(total) + " shards into " + path + ".")
+
+            failed = queue.failed()
+            if failed:
+                print(colored("Gave up on " + str(len(failed)) + " shards after " + str(shards.MAX_ATTEMPTS) + " attempts:", "red"))
+                for shard, error in list(failed.items())[:scheduler.REPORT_LIMIT]:
+                    print(colored("  shard {}: {}".format(shard, error or "the worker stopped renewing its lease"), "red"))
+                return False
+
+            return True
 
-            # Delete the tmp folder
-            os.system("rm -rf ./tmp")
+    except Exception as e:
+        print("Error: " + str(e))
+        return False
 
-            # Save the processed arXiv Metadata JSON to a JSON file
-            # processed_arxiv_df.to_json("arxiv_fulltext.json")
 
-        return is_processed
+def work(crawl_dir, lease=shards.LEASE, poll_interval=shards.POLL_INTERVAL, arxiv_storage_size=None, download_backend="gcs", download_location=None, download_workers=downloader.WORKERS, stream_output=False, compression=None, output_format="jsonl", token_counts=False, cache_path=None, cache_size=cache.MAX_SIZE, extractor_chain=extractors.DEFAULT_CHAIN, max_pages=None, workers=None, task_timeout=scheduler.TASK_TIMEOUT, maxtasksperchild=scheduler.MAXTASKSPERCHILD):
+    """
+    Worker of a sharded crawl: claim shards from the queue in crawl_dir, download and convert their PDFs (see
+    :func:`download`) and write the texts to the output of the shard, until every shard is done. The lease of a shard
+    is renewed while it is processed. Run one worker per machine, it uses all cores.
+
+    Parameters
+    ----------
+    crawl_dir : str
+        Directory of the crawl, see :func:`coordinate`
+
+    lease : float
+        Seconds after which the shard of a worker that died is claimed again
+
+    poll_interval : float
+        Seconds between two looks at the queue while the other workers hold the remaining shards
+
+    Returns
+    -------
+    bool
+        True if every shard that this worker claimed was processed
+    """
+    queue = shards.ShardQueue(os.path.join(crawl_dir, shards.QUEUE_FILE))
+    worker = shards.worker_name()
+    os.makedirs(os.path.join(crawl_dir, shards.OUTPUT_DIR), exist_ok=True)
+    completed = 0
+    failed = 0
+    try:
+        while True:
+            shard = queue.claim(worker, lease)
+            if shard is None:
+                if queue.finished():
+                    break
+                # The other shards are in progress, their leases may still expire
+                time.sleep(poll_interval)
+                continue
+
+            print(colored("Worker " + worker + " claimed shard " + str(shard) + ".", "yellow"))
+            # Every attempt writes its own file, which becomes the output of the shard if the worker still holds the
+            # lease when it completes the shard. The worker name comes before the extension, which the Parquet output
+            # replaces.
+            attempt_output = os.path.splitext(shards.output_file(crawl_dir, shard))[0] + "." + worker + ".json"
+            attempt_path = writer.output_path(attempt_output, compression, output_format)
+            try:
+                with shards.Heartbeat(queue, shard, worker, lease) as heartbeat:
+                    is_processed = download(read_shard(crawl_dir, shard), arxiv_storage_size=arxiv_storage_size, arxiv_process=True, download_backend=download_backend, download_location=download_location, download_workers=download_workers, stream_output=stream_output, compression=compression, output_format=output_format, token_counts=token_counts, cache_path=cache_path, cache_size=cache_size, extractor_chain=extractor_chain, max_pages=max_pages, workers=workers, task_timeout=task_timeout, maxtasksperchild=maxtasksperchild, output_path=attempt_output, tmp_dir=os.path.join("./tmp", "shard-{:05d}".format(shard)))
+                error = None if is_processed else "Processing failed on " + worker
+                lost = heartbeat.lost
+            except Exception as e:
+                is_processed, error, lost = False, str(e), False
+
+            if is_processed and not lost and queue.complete(shard, worker, os.path.basename(attempt_path)):
+                completed += 1
+                continue
+
+            # The output of a failed attempt, or of one whose shard was claimed by another worker, is never merged
+            if os.path.exists(attempt_path):
+                os.remove(attempt_path)
+            if is_processed:
+                print("The lease of shard " + str(shard) + " expired while it was processed, its output was discarded.")
+            else:
+                queue.fail(shard, worker, error)
+                failed += 1
+
+        print("Worker " + worker + " finished " + str(completed) + " shards, " + str(failed) + " failed.")
+
+        return failed == 0
 
     except Exception as e:
         print("Error: " + str(e))
         return False
-    
-def process_local_pdfs(arxiv_metadata_df, arxiv_local_PDF_dir):    
-    if not os.path.exists("./tmp/arxiv_txt"):
-        os.makedirs("./tmp/arxiv_txt")
-
-    is_processed = process(arxiv_metadata_df, arxiv_local_PDF_dir)
 
-    return is_processed
\ No newline at end of file
+    finally:
+        queue.close()
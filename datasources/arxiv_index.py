@@ -0,0 +1,207 @@
+###############################################################################################################################
+#
+# Persistent columnar index of the Kaggle arXiv metadata snapshot.
+#
+# INFO: The snapshot is ingested once into a Parquet file (one row per paper, categories split into a list column) and a
+#       small inverted index from category to row ids. Later runs only read the row groups that contain matching rows.
+#       The index is rebuilt automatically when the size or mtime of the snapshot changes.
+#
+###############################################################################################################################
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+INDEX_VERSION = 1
+ROW_GROUP_SIZE = 50000
+
+METADATA_FILE = "meta.json"
+TABLE_FILE = "metadata.parquet"
+CATEGORIES_FILE = "categories.npz"
+
+VERSION_TYPE = pa.list_(pa.struct([("version", pa.string()), ("created", pa.string())]))
+
+
+def index_dir_for(arxiv_kaggle_file: str) -> str:
+    """ Default location of the index: next to the snapshot """
+    return arxiv_kaggle_file + ".index"
+
+
+def _snapshot_signature(arxiv_kaggle_file: str) -> dict:
+    stat = os.stat(arxiv_kaggle_file)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "version": INDEX_VERSION}
+
+
+def _schema(columns):
+    fields = []
+    for column in columns:
+        if column == "versions":
+            fields.append((column, VERSION_TYPE))
+        else:
+            fields.append((column, pa.string()))
+    fields.append(("category_list", pa.list_(pa.string())))
+    return pa.schema(fields)
+
+
+def is_fresh(index_dir: str, arxiv_kaggle_file: str, columns) -> bool:
+    """
+    Check whether the index in index_dir was built from the current snapshot.
+
+    Parameters
+    ----------
+    index_dir : str
+        Directory of the index
+
+    arxiv_kaggle_file : str
+        Path to the Kaggle arXiv metadata snapshot
+
+    columns : list
+        Metadata fields the index has to contain
+
+    Returns
+    -------
+    bool
+        True if the index can be used as is
+    """
+    try:
+        with open(os.path.join(index_dir, METADATA_FILE)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    return meta.get("snapshot") == _snapshot_signature(arxiv_kaggle_file) and meta.get("columns") == list(columns)
+
+
+def build_index(records, arxiv_kaggle_file: str, index_dir: str, columns):
+    """
+    Ingest the snapshot into a Parquet table plus an inverted category index.
+    The index is written to a temporary directory first and moved in place when complete.
+
+    Parameters
+    ----------
+    records : iterable of dict
+        All records of the snapshot, e.g. from :func:`datasources.arxiv.stream_metadata`
+
+    arxiv_kaggle_file : str
+        Path to the snapshot the records come from
+
+    index_dir : str
+        Target directory of the index
+
+    columns : list
+        Metadata fields to store
+
+    Returns
+    -------
+    n_rows : int
+        Number of rows in the index
+    """
+    # Take the signature before reading, so that a snapshot that changes during the ingest is picked up next time
+    signature = _snapshot_signature(arxiv_kaggle_file)
+    schema = _schema(columns)
+
+    tmp_dir = index_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    postings = {}
+    n_rows = 0
+    batch = []
+
+    writer = pq.ParquetWriter(os.path.join(tmp_dir, TABLE_FILE), schema, compression="zstd")
+    try:
+        for record in records:
+            category_list = (record.get("categories") or "").split()
+            for category in category_list:
+                postings.setdefault(category, []).append(n_rows)
+
+            row = {column: record.get(column) for column in columns}
+            row["category_list"] = category_list
+            batch.append(row)
+            n_rows += 1
+
+            if len(batch) == ROW_GROUP_SIZE:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                batch = []
+
+        if batch:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+    finally:
+        writer.close()
+
+    # Store the inverted index in CSR form: names[i] owns rows[offsets[i]:offsets[i + 1]]
+    names = sorted(postings)
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(postings[name]) for name in names])
+    rows = np.fromiter((row for name in names for row in postings[name]), dtype=np.int32, count=int(offsets[-1]))
+    np.savez(os.path.join(tmp_dir, CATEGORIES_FILE), names=np.array(names, dtype=str), offsets=offsets, rows=rows)
+
+    with open(os.path.join(tmp_dir, METADATA_FILE), "w") as f:
+        json.dump({"snapshot": signature, "columns": list(columns), "rows": n_rows, "row_group_size": ROW_GROUP_SIZE}, f)
+
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+
+    return n_rows
+
+
+def load_categories(index_dir: str) -> dict:
+    """
+    Load the inverted category index.
+
+    Returns
+    -------
+    postings : dict
+        Maps every category to a sorted int32 array of row ids
+    """
+    with np.load(os.path.join(index_dir, CATEGORIES_FILE)) as data:
+        names, offsets, rows = data["names"], data["offsets"], data["rows"]
+    return {str(name): rows[offsets[i]:offsets[i + 1]] for i, name in enumerate(names)}
+
+
+def num_rows(index_dir: str) -> int:
+    """ Number of rows stored in the index """
+    with open(os.path.join(index_dir, METADATA_FILE)) as f:
+        return json.load(f)["rows"]
+
+
+def read_rows(index_dir: str, rows, columns):
+    """
+    Read the given rows from the index. Only row groups that contain at least one requested row are decoded.
+
+    Parameters
+    ----------
+    index_dir : str
+        Directory of the index
+
+    rows : array of int
+        Sorted row ids to read
+
+    columns : list
+        Metadata fields to return
+
+    Returns
+    -------
+    pandas.DataFrame
+        The requested rows in snapshot order
+    """
+    parquet_file = pq.ParquetFile(os.path.join(index_dir, TABLE_FILE))
+    rows = np.asarray(rows, dtype=np.int64)
+
+    tables = []
+    start = 0
+    for i in range(parquet_file.num_row_groups):
+        stop = start + parquet_file.metadata.row_group(i).num_rows
+        lo, hi = np.searchsorted(rows, [start, stop])
+        if hi > lo:
+            table = parquet_file.read_row_group(i, columns=list(columns))
+            tables.append(table.take(pa.array(rows[lo:hi] - start)))
+        start = stop
+
+    if not tables:
+        return pa.schema([(column, _schema(columns).field(column).type) for column in columns]).empty_table().to_pandas()
+    return pa.concat_tables(tables).to_pandas()
@@ -5,15 +5,18 @@
 ###############################################################################################################################
 
 import pandas as pd
+import pyarrow as pa
 import os
-import shutil
+from contextlib import closing
 from functools import partial
-from multiprocessing import Pool
 from termcolor import colored
 
-from pipeline import pdf2txt
+from helpers.cli_loader import progress_bar
+from pipeline import cache, extractors, files, metrics, pdf2txt, scheduler, vocabulary, writer
 
 TIMELIMIT = 2*60
+# Number of PDFs that are sent to a worker at once
+CHUNKSIZE = 1
 STAMP_SEARCH_LIMIT = 1000
 
 PDF2TXT = 'pdf2txt.py'
@@ -21,63 +24,92 @@ PDFTOTEXT = 'pdftotext'
 
 RE_REPEATS = r'(\(cid:\d+\)|lllll|\.\.\.\.\.|\*\*\*\*\*)'
 
-def local_pdfs(pdf_dir):
-    try:
-        # Create a folder for the txt files
-        if not os.path.exists("./txt"):
-            os.makedirs("./txt")  
-
-        # Print the number of pdf files in the folder
-        print("Found " + str(len(os.listdir(pdf_dir))) + " PDF files in the folder.")
+# Output of the converted PDFs
+OUTPUT_FILE = "./pdf_fulltext.json"
+# Typed columns of the Parquet output
+PARQUET_SCHEMA = pa.schema([("id", pa.string()), (writer.TEXT_COLUMN, pa.string())])
 
+def local_pdfs(pdf_dir, chunksize=CHUNKSIZE, stream_output=False, compression=None, output_format="jsonl", token_counts=False, deduplicator=None, cache_path=None, cache_size=cache.MAX_SIZE, extractor_chain=extractors.DEFAULT_CHAIN, max_pages=None, workers=None, task_timeout=scheduler.TASK_TIMEOUT, maxtasksperchild=scheduler.MAXTASKSPERCHILD, order="largest"):
+    try:
         # Convert the PDFs to text and save them to a JSON file
 
-        globber = os.path.join(pdf_dir, '**/*.pdf') # search expression for glob.glob
-        pdffiles = pdf2txt.sorted_files(globber)  # a list of path
-
-        CPU_COUNT = os.cpu_count() - 2
-        # CPU_COUNT = 4
-        print("Using " + str(CPU_COUNT) + " cores (" + str(os.cpu_count()) + " are available).")
-        pool = Pool(CPU_COUNT)
-        pool.map(partial(pdf2txt.convert_safe, timelimit=TIMELIMIT), pdffiles)
-        pool.close()
-        pool.join()
-
-        print("Conversion finished. Now moving the files to the txt folder and deleting the PDF files.")
+        # Walk the whole tree once. By default the largest files come first, so that the slowest PDFs do not start at
+        # the end of the run. Without an order the conversion starts while the tree is walked.
+        pdffiles = files.ordered(files.walk(pdf_dir), order)
+        total = None if order == "none" else len(pdffiles)
 
-        # Move the TXT files to the arxiv_txt folder
-        for pdffile in pdffiles:
-            txtfile = pdf2txt.reextension(pdffile, 'txt')
-            shutil.move(txtfile, "./txt")
-            #os.remove(pdffile)
-
-        print("Finished moving the files to the txt folder and deleting the PDF files.")
-        
-        # Open all *.txt files from the fulltext folder and save them in a dataframe
-        files = [f for f in os.listdir("./txt") if f.endswith(".txt")]
-
-        print("Finished reading the fulltext files.")
+        # Print the number of pdf files in the folder
+        if total is None:
+            print("Converting the PDF files while the folder is walked.")
+        else:
+            print("Found " + str(total) + " PDF files in the folder.")
+
+        # The vocabulary of the cleaning is built (and downloaded) here once, the workers only map it
+        vocabulary.ensure()
+
+        # Extract and clean the PDFs in the workers, the parent only collects the cleaned records
+        pool = scheduler.Scheduler(
+            partial(pdf2txt.extract_clean, timelimit=TIMELIMIT, cache_path=cache_path, cache_size=cache_size, extractor_chain=extractor_chain, max_pages=max_pages, minhash=deduplicator is not None),
+            workers=workers, chunksize=chunksize, task_timeout=task_timeout, maxtasksperchild=maxtasksperchild,
+            on_failure=pdf2txt.failed_record)
+        print("Using " + str(pool.workers) + " worker processes (" + str(os.cpu_count()) + " cores are available).")
+
+        cache_counts = {}
+        with progress_bar("Converting PDFs", total=total) as bar, closing(pool.imap_unordered(pdffiles)) as records:
+            records = metrics.track(cache.count_hits(records, cache_counts), progress=bar)
+
+            if stream_output:
+                # Write every text as soon as it arrives
+                with writer.open_output(OUTPUT_FILE, output_format=output_format, compression=compression, schema=PARQUET_SCHEMA, token_counts=token_counts) as output:
+                    for record in records:
+                        if record["text"] is not None:
+                            pdf_id = files.document_id(record["path"], pdf_dir)
+                            # Of near-duplicate PDFs the one that arrives first is written
+                            if deduplicator is not None and deduplicator.check(pdf_id, record.get("signature")) is not None:
+                                continue
+                            output.write({"id": pdf_id, "text": record["text"]})
+
+                print("Conversion finished. Streamed " + str(output.count) + " texts to " + output.path + ".")
+                pool.report()
+                cache.report(cache_counts)
+                return True
+
+            file_list = []
+            for record in records:
+                if record["text"] is not None:
+                    file_list.append([files.document_id(record["path"], pdf_dir), record["text"], record.get("signature")])
+
+        print("Conversion finished.")
+        pool.report()
+        cache.report(cache_counts)
 
         # Store files in a pandas dataframe - name as id and content as text
-        file_list = []
-        for file in files:
-            with open("./txt/" + str(file), "r") as f:
-                text = pdf2txt.cleaned_text(f.read())
-                file_list.append([str(file).replace(".txt", ""), str(text)])
-                #arxiv_fulltext_df = arxiv_fulltext_df.append({"id": str(file).str.replace("v\d+", "").str.replace(".txt", ""), "text": str(text)}, ignore_index=True)
-        pdf_fulltext_df = pd.DataFrame(file_list, columns=["id", "text"])
+        file_list.sort(key=lambda entry: entry[0])
+        if deduplicator is not None:
+            # Of near-duplicate PDFs the first one by id is kept
+            file_list = [entry for entry in file_list if deduplicator.check(entry[0], entry[2]) is None]
+        file_list = [entry[:2] for entry in file_list]
+
+        if output_format == "parquet":
+            with metrics.timer("write") as sizes:
+                with writer.ParquetWriter(OUTPUT_FILE, PARQUET_SCHEMA, compression=compression, token_counts=token_counts, observe=False) as output:
+                    for pdf_id, text in file_list:
+                        output.write({"id": pdf_id, "text": text})
+                sizes["bytes_out"] = os.path.getsize(output.path)
+            print("Finished saving the processed PDFs to " + output.path + ".")
+            return True
 
+        pdf_fulltext_df = pd.DataFrame(file_list, columns=["id", "text"])
         print("Finished storing the fulltext files into a dataframe.")
 
-        pdf_fulltext_df.to_json("./pdf_fulltext.json", orient="records", lines=True)
+        with metrics.timer("write") as sizes:
+            pdf_fulltext_df.to_json(OUTPUT_FILE, orient="records", lines=True)
+            sizes["bytes_out"] = os.path.getsize(OUTPUT_FILE)
 
         print("Finished saving the processed PDFs to a JSON file.")
 
-        # Delete the txt folder
-        shutil.rmtree("./txt")
-
         return True
     
     except Exception as e:
         print("Processing failed: " + str(e))
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,477 @@
+###############################################################################################################################
+#
+# Welcome to the PubMed datasource. This file contains the functions for parsing the PubMed baseline and update files
+# and the PMC Open Access bundles.
+#
+# INFO: The inputs are the gzipped XML files of https://ftp.ncbi.nlm.nih.gov/pubmed/baseline/ and .../pubmed/updatefiles/
+#       (one PubmedArticleSet each) and the tar.gz bundles of https://ftp.ncbi.nlm.nih.gov/pub/pmc/oa_bulk/ (one JATS
+#       article per .nxml file). Every file is parsed by a worker process with a streaming parser that clears every
+#       record once it is read, so the memory of a worker does not grow with the size of a file. The records are
+#       filtered by MeSH descriptor (the --category query), cleaned like the arXiv abstracts and the PDF texts, and
+#       written to a part file per input file. The parent concatenates the parts in the order of the files, so later
+#       update files replace revised records and remove deleted ones.
+#
+###############################################################################################################################
+
+import gzip
+import json
+import os
+import re
+import shutil
+import tarfile
+import time
+import xml.etree.ElementTree as ET
+from contextlib import closing
+from functools import partial
+
+import numpy as np
+from termcolor import colored
+
+from helpers import fixunicode
+from helpers.category_query import CategoryQuery
+from helpers.cli_loader import progress_bar
+from pipeline import files, metrics, pdf2txt, scheduler, vocabulary, writer
+
+# Output of the parsed records
+OUTPUT_FILE = "./pubmed_fulltext.json"
+
+# PubMed XML files and PMC bundles
+PUBMED_SUFFIXES = (".xml.gz", ".xml")
+PMC_SUFFIXES = (".tar.gz", ".tgz")
+
+# Fields of the output records
+COLUMNS = ["id", "pmid", "pmcid", "doi", "title", "authors", "journal", "year", "mesh", "categories", "abstract", "text"]
+
+# What happened to the records of a file, in the order of the file, see parse_file()
+WRITTEN = 0
+FILTERED = 1
+DELETED = 2
+
+# JATS elements whose text is not part of the running text of an article
+SKIPPED_ELEMENTS = {"table-wrap", "fig", "disp-formula", "ref-list", "supplementary-material"}
+
+RE_SINGLE_CHARACTERS = re.compile(r'\s+[a-zA-Z]\s+')
+RE_WHITESPACE = re.compile(r'\s+')
+RE_YEAR = re.compile(r'\d{4}')
+RE_PMCID = re.compile(r'\d+')
+
+
+def parquet_schema():
+    """ Typed columns of the Parquet output """
+    # pyarrow is only needed by the parent, the workers import this module without it
+    import pyarrow as pa
+
+    types = {"year": pa.int16(), "mesh": pa.list_(pa.string())}
+    return pa.schema([(column, types.get(column, pa.string())) for column in COLUMNS])
+
+
+def kind_of(path):
+    """ "pmc" for PMC bundles, "pubmed" for PubMed XML files """
+    return "pmc" if path.endswith(PMC_SUFFIXES) else "pubmed"
+
+
+def clean_abstract(abstract):
+    """ Remove single characters and collapse the whitespace, like datasources.arxiv.clean_abstracts() """
+    if not abstract:
+        return abstract
+    return RE_WHITESPACE.sub(' ', RE_SINGLE_CHARACTERS.sub(' ', abstract)).strip()
+
+
+def _text(element):
+    """ All text of an element and its children, with collapsed whitespace (None for a missing element) """
+    if element is None:
+        return None
+    return RE_WHITESPACE.sub(' ', "".join(element.itertext())).strip()
+
+
+def pubmed_record(article):
+    """
+    The record of a PubmedArticle element.
+
+    Returns
+    -------
+    record : dict
+        See COLUMNS. "categories" holds the MeSH descriptor ids (e.g. D009369), separated by spaces, and "text" is None.
+    """
+    citation = article.find("MedlineCitation")
+    journal = citation.find("Article/Journal")
+    year = None
+    if journal is not None:
+        date = journal.find("JournalIssue/PubDate")
+        if date is not None:
+            year = RE_YEAR.search(date.findtext("Year") or date.findtext("MedlineDate") or "")
+            year = year.group() if year else None
+
+    authors = []
+    for author in citation.iterfind("Article/AuthorList/Author"):
+        name = author.findtext("CollectiveName") or " ".join(part for part in (author.findtext("ForeName"), author.findtext("LastName")) if part)
+        if name:
+            authors.append(name)
+
+    descriptors = list(citation.iterfind("MeshHeadingList/MeshHeading/DescriptorName"))
+    ids = {article_id.get("IdType"): article_id.text for article_id in article.iterfind("PubmedData/ArticleIdList/ArticleId")}
+    pmid = citation.findtext("PMID")
+    abstract = " ".join(_text(part) for part in citation.iterfind("Article/Abstract/AbstractText"))
+
+    return {
+        "id": pmid,
+        "pmid": pmid,
+        "pmcid": ids.get("pmc"),
+        "doi": ids.get("doi"),
+        "title": _text(citation.find("Article/ArticleTitle")),
+        "authors": ", ".join(authors),
+        "journal": journal.findtext("Title") if journal is not None else None,
+        "year": year,
+        "mesh": [descriptor.text for descriptor in descriptors],
+        "categories": " ".join(descriptor.get("UI") for descriptor in descriptors if descriptor.get("UI")),
+        "abstract": clean_abstract(abstract) or None,
+        "text": None,
+    }
+
+
+def iter_pubmed(fileobj):
+    """
+    Stream the records of a PubMed XML file. The tree is cleared after every record.
+
+    Yields
+    ------
+    kind, key, record : int, int, dict
+        WRITTEN and the record of every article (the caller filters them), DELETED and None for every deleted PMID
+    """
+    context = ET.iterparse(fileobj, events=("start", "end"))
+    _, root = next(context)
+    for event, element in context:
+        if event != "end":
+            continue
+        if element.tag == "PubmedArticle":
+            record = pubmed_record(element)
+            yield WRITTEN, int(record["pmid"]), record
+            root.clear()
+        elif element.tag == "DeleteCitation":
+            for pmid in element.iter("PMID"):
+                yield DELETED, int(pmid.text), None
+            root.clear()
+        elif element.tag == "PubmedBookArticle":
+            root.clear()
+
+
+def abstract_text(abstract):
+    """ The text of a JATS abstract: its paragraphs without the section titles, or all of its text """
+    if abstract is None:
+        return None
+    paragraphs = [_text(paragraph) for paragraph in abstract.iter("p")]
+    return " ".join(paragraphs) if paragraphs else _text(abstract)
+
+
+def jats_record(fileobj):
+    """
+    The record of a JATS article (one .nxml file of a PMC bundle). Paragraphs are cleared once their text is read.
+
+    Returns
+    -------
+    record : dict
+        See COLUMNS. "categories" holds the subjects of the article with spaces replaced by _ and "text" is the raw
+        text of the body.
+    """
+    record = dict.fromkeys(COLUMNS)
+    record["mesh"] = []
+    paragraphs = []
+    # Depth in the body and in skipped elements (tables, figures, ...) of the body
+    in_body = 0
+    skipped = 0
+
+    for event, element in ET.iterparse(fileobj, events=("start", "end")):
+        tag = element.tag
+        if event == "start":
+            if tag == "body":
+                in_body += 1
+            elif in_body and tag in SKIPPED_ELEMENTS:
+                skipped += 1
+            continue
+
+        if tag == "body":
+            in_body -= 1
+            element.clear()
+        elif in_body:
+            if tag in SKIPPED_ELEMENTS:
+                skipped -= 1
+                element.clear()
+            elif tag in ("p", "title") and not skipped:
+                paragraphs.append("".join(element.itertext()))
+                element.clear()
+        elif tag == "article-meta":
+            ids = {article_id.get("pub-id-type"): article_id.text for article_id in element.iterfind("article-id")}
+            authors = []
+            for name in element.iterfind("contrib-group/contrib[@contrib-type='author']/name"):
+                authors.append(" ".join(part for part in (name.findtext("given-names"), name.findtext("surname")) if part))
+            year = RE_YEAR.search(element.findtext("pub-date/year") or "")
+            pmcid = ids.get("pmc") or ids.get("pmcid")
+            if pmcid and not pmcid.startswith("PMC"):
+                pmcid = "PMC" + pmcid
+            record.update({
+                "id": pmcid,
+                "pmid": ids.get("pmid"),
+                "pmcid": pmcid,
+                "doi": ids.get("doi"),
+                "title": _text(element.find("title-group/article-title")),
+                "authors": ", ".join(authors),
+                "year": year.group() if year else None,
+                "categories": " ".join(_text(subject).replace(" ", "_") for subject in element.iterfind("article-categories//subject")),
+                "abstract": clean_abstract(abstract_text(element.find("abstract"))),
+            })
+            element.clear()
+        elif tag == "journal-meta":
+            record["journal"] = _text(element.find("journal-title-group/journal-title")) or _text(element.find("journal-title"))
+            element.clear()
+
+    record["text"] = "\n".join(paragraphs)
+    return record
+
+
+def iter_pmc(fileobj):
+    """
+    Stream the records of a PMC bundle, reading the tar.gz as a stream.
+
+    Yields
+    ------
+    kind, key, record : int, int, dict
+        WRITTEN, the number of the PMCID and the record of every article
+    """
+    with tarfile.open(fileobj=fileobj, mode="r|gz") as bundle:
+        for member in bundle:
+            if not member.isfile() or not member.name.endswith((".nxml", ".xml")):
+                continue
+            try:
+                record = jats_record(bundle.extractfile(member))
+            except ET.ParseError as e:
+                print("Skipping " + member.name + ": " + str(e))
+                continue
+            if record["pmcid"] is None:
+                print("Skipping " + member.name + ": the article has no PMCID.")
+                continue
+            yield WRITTEN, int(RE_PMCID.search(record["pmcid"]).group()), record
+
+
+def parse_file(path, part_dir, category=None, clean_texts=True, data_dir=None):
+    """
+    Worker stage: parse a PubMed XML file or a PMC bundle, filter and clean its records and write them to a part file.
+
+    Parameters
+    ----------
+    path : str
+        PubMed XML file (.xml or .xml.gz) or PMC bundle (.tar.gz)
+
+    part_dir : str
+        Directory of the part files
+
+    category : str
+        Optional category query on the MeSH descriptor ids (PubMed) or the subjects (PMC), see
+        helpers.category_query.CategoryQuery
+
+    clean_texts : bool
+        Fix the unicode and clean the full texts of PMC articles like the texts of PDFs
+
+    data_dir : str
+        Input directory of path. The part file is named after the path relative to it, so that files with the same
+        name in different subdirectories get different parts (after the file name if None).
+
+    Returns
+    -------
+    summary : dict
+        "path", "kind", "part" (the part file), "keys" (PMID or PMCID number of every record and deletion in the
+        order of the file), "status" (WRITTEN, FILTERED or DELETED for every key, the WRITTEN ones are the lines of
+        the part), "error" and "stats"
+    """
+    start = time.time()
+    query = CategoryQuery(category) if category else None
+    kind = kind_of(path)
+    part = os.path.join(part_dir, (os.path.relpath(path, data_dir) if data_dir else os.path.basename(path)) + ".jsonl")
+    os.makedirs(os.path.dirname(part), exist_ok=True)
+    keys = []
+    status = []
+    stages = {"parse": 0.0, "clean": 0.0}
+    chars = 0
+
+    with open(path, "rb") as raw:
+        fileobj = gzip.GzipFile(fileobj=raw) if kind == "pubmed" and path.endswith(".gz") else raw
+        entries = iter_pubmed(fileobj) if kind == "pubmed" else iter_pmc(fileobj)
+        with open(part, "wb") as output:
+            parse = time.perf_counter()
+            for entry_kind, key, record in entries:
+                keys.append(key)
+                if entry_kind == DELETED:
+                    status.append(DELETED)
+                elif query is not None and not query.matches(record["categories"]):
+                    status.append(FILTERED)
+                else:
+                    if clean_texts and record["text"]:
+                        clean = time.perf_counter()
+                        record["text"] = pdf2txt.cleaned_text(fixunicode.fix_unicode(record["text"]))
+                        stages["clean"] += time.perf_counter() - clean
+                    line = json.dumps(record).encode("utf-8") + b"\n"
+                    output.write(line)
+                    chars += len(line)
+                    status.append(WRITTEN)
+            # Parsing includes everything but the cleaning
+            stages["parse"] = time.perf_counter() - parse - stages["clean"]
+
+    return {
+        "path": path,
+        "kind": kind,
+        "part": part,
+        "keys": np.array(keys, dtype=np.int64),
+        "status": np.array(status, dtype=np.int8),
+        "error": None,
+        "stats": {"seconds": time.time() - start, "stages": stages, "bytes_in": os.path.getsize(path), "bytes_out": chars},
+    }
+
+
+def failed_file(path, error):
+    """ Summary in the format of :func:`parse_file` for a file whose worker failed, timed out or crashed """
+    print("Parsing failed for '%s': %s" % (path, error))
+    return {"path": path, "kind": kind_of(path), "part": None, "keys": None, "status": None, "error": error, "stats": None}
+
+
+def observe_summary(summary):
+    """ Account the stages, bytes and records of a parsed file in the run metrics """
+    stats = summary["stats"]
+    if stats is None:
+        metrics.count("failed_files")
+        return
+    for stage, seconds in stats["stages"].items():
+        metrics.observe(stage, seconds)
+    metrics.observe("file", stats["seconds"], bytes_in=stats["bytes_in"], bytes_out=stats["bytes_out"])
+    metrics.count("records", int((summary["status"] == WRITTEN).sum()))
+    metrics.count("filtered_records", int((summary["status"] == FILTERED).sum()))
+    metrics.count("deleted_records", int((summary["status"] == DELETED).sum()))
+
+
+def latest_records(summaries):
+    """
+    Which written records of the files are the latest entry of their PMID (or PMCID), i.e. are not revised or
+    deleted by a later file.
+
+    Parameters
+    ----------
+    summaries : list of dict
+        Summaries of :func:`parse_file` of one kind, in the order of the files
+
+    Returns
+    -------
+    masks : list of np.ndarray
+        Boolean array per file, one entry per line of its part
+    """
+    if not summaries:
+        return []
+    keys = np.concatenate([summary["keys"] for summary in summaries])
+    status = np.concatenate([summary["status"] for summary in summaries])
+
+    # A stable sort keeps the entries of every key in the order of the files, the last one of a key is the latest
+    order = np.argsort(keys, kind="stable")
+    last = np.ones(len(keys), dtype=bool)
+    last[:-1] = keys[order][1:] != keys[order][:-1]
+    latest = np.zeros(len(keys), dtype=bool)
+    latest[order[last]] = True
+    # Filtered versions also remove the earlier ones: the revised record does not match the query anymore
+    keep = latest & (status == WRITTEN)
+
+    masks = []
+    for summary, file_keep in zip(summaries, np.split(keep, np.cumsum([len(summary["keys"]) for summary in summaries])[:-1])):
+        masks.append(file_keep[summary["status"] == WRITTEN])
+    return masks
+
+
+def pubmed(data_dir, category=None, compression=None, output_format="jsonl", token_counts=False, clean_texts=True, workers=None, task_timeout=scheduler.TASK_TIMEOUT, maxtasksperchild=scheduler.MAXTASKSPERCHILD, output_path=OUTPUT_FILE, tmp_dir="./tmp/pubmed"):
+    """
+    Parse all PubMed XML files and PMC bundles below data_dir in parallel and write the records to output_path.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory with the baseline and update files (.xml.gz) and / or PMC bundles (.tar.gz). The files are read in
+        natural order of their names, so that the update files come after the baseline.
+
+    category : str
+        Optional category query on the MeSH descriptor ids, e.g. "D009369 AND NOT D000818", see parse_file()
+
+    compression : str
+        None, "gzip" or "zstd". For Parquet outputs the codec of the columns.
+
+    output_format : str
+        "jsonl" or "parquet" (see pipeline.writer.FORMATS)
+
+    token_counts : bool
+        Add the number of tokens of every text to Parquet outputs
+
+    clean_texts : bool
+        Clean the full texts of PMC articles like the texts of PDFs
+
+    workers, task_timeout, maxtasksperchild :
+        See pipeline.scheduler.Scheduler. Every worker parses one file at a time.
+
+    Returns
+    -------
+    bool
+        True if every file was parsed and the output was written
+    """
+    try:
+        paths = files.ordered(files.walk(data_dir, PUBMED_SUFFIXES + PMC_SUFFIXES), "natural")
+        print("Found " + str(len(paths)) + " PubMed XML files and PMC bundles in the folder.")
+        if not paths:
+            return False
+
+        os.makedirs(tmp_dir, exist_ok=True)
+        # The vocabulary of the cleaning is built (and downloaded) here once, the workers only map it
+        if clean_texts and any(kind_of(path) == "pmc" for path in paths):
+            vocabulary.ensure()
+
+        # One file per task, the workers write the records and only send back the keys
+        pool = scheduler.Scheduler(
+            partial(parse_file, part_dir=tmp_dir, category=category, clean_texts=clean_texts, data_dir=data_dir),
+            workers=workers, chunksize=1, task_timeout=task_timeout, maxtasksperchild=maxtasksperchild,
+            on_failure=failed_file)
+        print("Using " + str(pool.workers) + " worker processes (" + str(os.cpu_count()) + " cores are available).")
+
+        summaries = {}
+        with progress_bar("Parsing XML files", total=len(paths)) as bar, closing(pool.imap_unordered(paths)) as results:
+            for summary in results:
+                observe_summary(summary)
+                summaries[summary["path"]] = summary
+                bar()
+
+        print("Parsing finished.")
+        pool.report()
+
+        # Concatenate the parts in the order of the files, without the revised and deleted records
+        parsed = [summaries[path] for path in paths if summaries[path]["error"] is None]
+        masks = {}
+        for kind in ("pubmed", "pmc"):
+            of_kind = [summary for summary in parsed if summary["kind"] == kind]
+            masks.update(zip([summary["path"] for summary in of_kind], latest_records(of_kind)))
+
+        with metrics.timer("merge"):
+            with writer.open_output(output_path, output_format=output_format, compression=compression, schema=parquet_schema(), token_counts=token_counts) as output:
+                for summary in parsed:
+                    with open(summary["part"], "rb") as part:
+                        for line, keep in zip(part, masks[summary["path"]]):
+                            if keep:
+                                output.write_line(line)
+                    os.remove(summary["part"])
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        # Revised and deleted records are only counted once
+        metrics.count("documents", output.count)
+
+        print("Finished saving " + str(output.count) + " records to " + output.path + ".")
+
+        failed = [path for path in paths if summaries[path]["error"] is not None]
+        if failed:
+            print(colored("Failed to parse " + str(len(failed)) + " files, their records are missing:", "red"))
+            for path in failed[:scheduler.REPORT_LIMIT]:
+                print(colored("  " + path + ": " + summaries[path]["error"], "red"))
+            return False
+
+        return True
+
+    except Exception as e:
+        print("Processing failed: " + str(e))
+        return False
@@ -0,0 +1,170 @@
+###############################################################################################################################
+#
+# Boolean category queries for the --category flag.
+#
+# Grammar (operators are case sensitive, & | ! are accepted as aliases):
+#
+#     expr    := and_expr ( ("OR" | "|") and_expr )*
+#     and_expr:= not_expr ( ("AND" | "&") not_expr )*
+#     not_expr:= ("NOT" | "!") not_expr | "(" expr ")" | CATEGORY
+#
+# A CATEGORY is matched exactly against the whitespace separated tokens of the arXiv "categories" field. A trailing * turns
+# it into a prefix match, e.g. cs.* or math.*. A query is parsed once and compiled into set tests or bitmaps, so no
+# regular expression is ever run on a record.
+#
+###############################################################################################################################
+
+import re
+
+RE_TOKENS = re.compile(r'\(|\)|&|\||!|[^\s()&|!]+')
+
+OPERATORS = {"AND": "&", "OR": "|", "NOT": "!"}
+
+
+def _tokenize(expression: str):
+    tokens = [OPERATORS.get(token, token) for token in RE_TOKENS.findall(expression)]
+    if not tokens:
+        raise ValueError("Empty category expression.")
+    return tokens
+
+
+def _parse(tokens):
+    """ Recursive descent parser producing a tree of tuples """
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        token = peek()
+        position += 1
+        return token
+
+    def parse_or():
+        nodes = [parse_and()]
+        while peek() == "|":
+            take()
+            nodes.append(parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", tuple(nodes))
+
+    def parse_and():
+        nodes = [parse_not()]
+        while peek() == "&":
+            take()
+            nodes.append(parse_not())
+        return nodes[0] if len(nodes) == 1 else ("and", tuple(nodes))
+
+    def parse_not():
+        token = take()
+        if token == "!":
+            return ("not", parse_not())
+        if token == "(":
+            node = parse_or()
+            if take() != ")":
+                raise ValueError("Missing closing parenthesis.")
+            return node
+        if token is None or token in ("&", "|", ")"):
+            raise ValueError("Expected a category but found {}.".format(repr(token) if token else "the end of the expression"))
+        if "*" in token[:-1]:
+            raise ValueError("Wildcards are only supported at the end of a category: {}".format(token))
+        if token.endswith("*"):
+            return ("prefix", token[:-1])
+        return ("cat", token)
+
+    tree = parse_or()
+    if peek() is not None:
+        raise ValueError("Unexpected {} in category expression.".format(repr(peek())))
+    return tree
+
+
+class CategoryQuery:
+    """
+    A compiled category expression.
+
+    Parameters
+    ----------
+    expression : str
+        Category expression, e.g. "cs.AI AND (cs.CL OR cs.LG) AND NOT math.*"
+
+    Raises
+    ------
+    ValueError
+        If the expression cannot be parsed
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tree = _parse(_tokenize(expression))
+        self._match = self._compile(self.tree)
+
+    def __repr__(self):
+        return "CategoryQuery({!r})".format(self.expression)
+
+    def _compile(self, node):
+        kind = node[0]
+        if kind == "cat":
+            name = node[1]
+            return lambda categories: name in categories
+        if kind == "prefix":
+            prefix = node[1]
+            return lambda categories: any(category.startswith(prefix) for category in categories)
+        if kind == "not":
+            child = self._compile(node[1])
+            return lambda categories: not child(categories)
+        children = [self._compile(child) for child in node[1]]
+        if kind == "and":
+            return lambda categories: all(child(categories) for child in children)
+        return lambda categories: any(child(categories) for child in children)
+
+    def matches(self, categories) -> bool:
+        """
+        Evaluate the query on a single record.
+
+        Parameters
+        ----------
+        categories : str or set
+            The "categories" field of a record or the set of its tokens
+        """
+        if isinstance(categories, str):
+            categories = set(categories.split())
+        return self._match(categories)
+
+    def mask_index(self, postings: dict, n_rows: int) -> "np.ndarray":
+        """
+        Evaluate the query on an inverted index with one bitmap per category.
+
+        Parameters
+        ----------
+        postings : dict
+            Maps every category to an array of row ids
+
+        n_rows : int
+            Number of rows in the index
+
+        Returns
+        -------
+        mask : np.ndarray
+            Boolean array of length n_rows
+        """
+        # Imported here, so that parsing a query (e.g. to validate the command line) stays light
+        import numpy as np
+
+        def bitmap(names):
+            mask = np.zeros(n_rows, dtype=bool)
+            for name in names:
+                mask[postings[name]] = True
+            return mask
+
+        def evaluate(node):
+            kind = node[0]
+            if kind == "cat":
+                return bitmap([node[1]] if node[1] in postings else [])
+            if kind == "prefix":
+                return bitmap([name for name in postings if name.startswith(node[1])])
+            if kind == "not":
+                return ~evaluate(node[1])
+            masks = [evaluate(child) for child in node[1]]
+            return np.logical_and.reduce(masks) if kind == "and" else np.logical_or.reduce(masks)
+
+        return evaluate(self.tree)
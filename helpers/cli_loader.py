@@ -1,5 +1,12 @@
-from alive_progress import alive_bar
 from typing import ContextManager, Optional
 
+# alive_progress is imported when a bar is shown, so that the command line starts fast
+
 def load_bar(title: Optional[str] = None) -> ContextManager:
-    return alive_bar(monitor=None, stats=None, title=title)
\ No newline at end of file
+    from alive_progress import alive_bar
+    return alive_bar(monitor=None, stats=None, title=title)
+
+def progress_bar(title: Optional[str] = None, total: Optional[int] = None) -> ContextManager:
+    """ Bar with done/total, docs/s and ETA. Call the yielded bar once per finished document. """
+    from alive_progress import alive_bar
+    return alive_bar(total, title=title, unit=" docs")
\ No newline at end of file
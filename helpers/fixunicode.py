@@ -89,12 +89,61 @@ unicode_mapping.update({
 })
 
 
+# Keys of unicode_mapping that replace single characters: a literal character, an escape or a class of them
+RE_CHARACTERS_KEY = re.compile(r'^(\[)?((?:\\x[0-9a-fA-F]{2}|\\u[0-9a-fA-F]{4}|[^\\\[\]().*+?^$|{}])+)(?(1)\])$')
+RE_ESCAPE = re.compile(r'\\x([0-9a-fA-F]{2})|\\u([0-9a-fA-F]{4})')
+
+
+def _unescape(search: str) -> str:
+    return RE_ESCAPE.sub(lambda m: chr(int(m.group(1) or m.group(2), 16)), search)
+
+
+def _build_normalizer(mapping: dict):
+    """
+    Split the mapping into a table of all single-character replacements, which are done in one pass with a single
+    compiled character class, and the remaining context-sensitive regex rules. Every rule is compiled once, together
+    with the non-ASCII characters it needs to match, so that it is skipped on texts without them.
+    """
+    table = {}
+    rules = []
+    for search, replace in mapping.items():
+        match = RE_CHARACTERS_KEY.match(search)
+        if match and '\\' not in replace:
+            characters = _unescape(match.group(2))
+            if match.group(1) or len(characters) == 1:
+                for character in characters:
+                    # The first rule for a character wins, like in the sequential passes
+                    table.setdefault(character, replace)
+                continue
+        triggers = ''.join(sorted({c for c in _unescape(search) if not c.isascii()}))
+        rules.append((re.compile(search), replace, triggers))
+    pattern = re.compile('[' + ''.join(re.escape(character) for character in sorted(table)) + ']')
+    return table, pattern, rules
+
+
+replacement_table, RE_REPLACED, context_rules = _build_normalizer(unicode_mapping)
+
+
+def _nfkc(txt: str) -> str:
+    """
+    NFKC of the lines that are not pure ASCII. A line feed neither composes nor reorders with its neighbours, so this
+    equals the normalization of the whole text.
+    """
+    lines = txt.split('\n')
+    return '\n'.join(line if line.isascii() else unicodedata.normalize('NFKC', line) for line in lines)
+
+
 def fix_unicode(txt: str) -> str:
     """
     Given UTF-8 encoded text, remove typographical ligatures (normalize to true
     non-display character set) and do a general normalization of the unicode
     so that possible redundant characters and simplified to a single set.
 
+    All single-character replacements of unicode_mapping are done in one pass
+    over the text, followed by the context-sensitive rules (e.g. the sharp s).
+    Pure ASCII text is returned as is, since none of the rules nor NFKC
+    change it.
+
     Parameters
     ----------
     txt : unicode string
@@ -103,6 +152,10 @@ def fix_unicode(txt: str) -> str:
     -------
     output : unicode string
     """
-    for search, replace in unicode_mapping.items():
-        txt = re.subn(search, replace, txt)[0]
-    return unicodedata.normalize('NFKC', txt)
+    if txt.isascii():
+        return txt
+    txt = RE_REPLACED.sub(lambda m: replacement_table[m.group()], txt)
+    for pattern, replace, triggers in context_rules:
+        if not triggers or any(c in txt for c in triggers):
+            txt = pattern.sub(replace, txt)
+    return _nfkc(txt)
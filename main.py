@@ -8,9 +8,12 @@ from termcolor import colored
 import argparse
 import os
 
+# Only light modules are imported here. The datasources (pandas, pyarrow, numpy, ...) are imported once the arguments
+# are valid, so that -h and argument errors return immediately.
 from helpers.cli_loader import load_bar
-from datasources.arxiv import *
-from datasources.pdfs import *
+from helpers.category_query import CategoryQuery
+from pipeline import files, metrics, shards
+from pipeline.extractors import parse_chain
 
 
 
@@ -27,16 +30,123 @@ if __name__ == "__main__":
     # Add the arguments
     parser.add_argument("-s", "--source", type=str, help="Choose the datasource. Example: -s arxiv", required=True)
     parser.add_argument("-f", "--file", type=str, help="Load the arXiv dataset from a JSON file. Use the Kaggle arXiv Dataset JSON. Example: -f arxiv-metadata-oai-snapshot.json")
-    parser.add_argument("-c", "--category", type=str, help='Filter the arXiv dataset by category. Delimit multiple categories AND, OR. Be sure to use quotes. Example: -c "cs.AI AND cs.CL"')
-    parser.add_argument("-l", "--local_PDFS", type=str, help="Use local PDFs and provide a PDF dicrectory instead of downloading them. Example: -l ./PDFs")
+    parser.add_argument("-c", "--category", type=str, help='Filter the arXiv dataset by category. Combine categories with AND, OR, NOT and parentheses, use * for prefixes. Be sure to use quotes. Example: -c "cs.AI AND (cs.CL OR cs.LG)"')
+    parser.add_argument("-l", "--local_PDFS", type=str, help="Use local files instead of downloading them: the directory of the PDFs, or for -s pubmed the directory of the PubMed XML files and PMC bundles. Example: -l ./PDFs")
     parser.add_argument("-p", "--process", action="store_true", help="Process the arXiv dataset: PDF2TXT, Text Cleaning, ... Example: -p")
     parser.add_argument("-g", "--storage_size", type=int, help="Set the maximum storage size for the arXiv dataset download. Lower storage means longer processing. [GB] Example: -s 100")
     parser.add_argument("-r", "--rows", type=int, help="Set the number of rows to be processed. Example: -r 1000")
+    parser.add_argument("-b", "--backend", type=str, default="gcs", choices=["gcs", "http", "local"], help="Choose where the arXiv PDFs are downloaded from. Example: -b local")
+    parser.add_argument("-m", "--mirror", type=str, help="Base URL (gcs, http) or directory (local) that mirrors the arXiv bucket layout. Example: -m ./arxiv-mirror")
+    parser.add_argument("-w", "--download_workers", type=int, default=16, help="Set the number of concurrent downloads. Example: -w 32")
+    parser.add_argument("-k", "--chunksize", type=int, default=1, help="Set the number of PDFs that are sent to a worker process at once. Example: -k 4")
+    parser.add_argument("-o", "--stream_output", action="store_true", help="Write every processed paper to the output file as soon as it is ready instead of collecting all of them in memory. Example: -o")
+    parser.add_argument("-z", "--compression", type=str, choices=["gzip", "zstd"], help="Compress the streamed output file. For Parquet outputs the codec of the columns (default zstd). Example: -z gzip")
+    parser.add_argument("--output_format", "--output-format", type=str, default="jsonl", choices=["jsonl", "parquet"], help="Write the outputs as line-delimited JSON or as Parquet files with typed columns, in row groups as the documents finish. Example: --output_format parquet")
+    parser.add_argument("--token_counts", action="store_true", help="Add a column with the number of tokens of every text to Parquet outputs. Example: --token_counts")
+    parser.add_argument("--dedup", action="store_true", help="Detect near-duplicate texts with MinHash and LSH and only write the first document of every cluster. Example: --dedup")
+    parser.add_argument("--dedup_threshold", type=float, default=0.8, help="Set the minimum estimated Jaccard similarity of the word 5-grams of near-duplicates. Example: --dedup_threshold 0.9")
+    parser.add_argument("--dedup_report", type=str, default="./pubcrawl_duplicates.json", help="Write the near-duplicate clusters to this JSON file. Example: --dedup_report ./duplicates.json")
+    parser.add_argument("--cache", type=str, help="Cache the extracted texts by PDF hash in this SQLite file, so that re-runs skip the extraction of known PDFs. Example: --cache ./pubcrawl_cache.sqlite")
+    parser.add_argument("--cache_size", type=int, default=10, help="Set the maximum size of the extraction cache, the least recently used texts are evicted. [GB] Example: --cache_size 50")
+    parser.add_argument("-x", "--extractors", type=str, default="pdftotext,pdfminer,pdfminer-A", help="Set the chain of PDF text extractors, the next one is tried when an extractor fails or returns garbled text. Choose from pdftotext, pdf2txt, pdf2txt-A, pdfminer, pdfminer-A and pypdfium2. Example: -x pdfminer,pdfminer-A")
+    parser.add_argument("--max_pages", type=int, help="Only extract the first pages of every PDF, for faster crawls. Example: --max_pages 20")
+    parser.add_argument("-j", "--workers", type=int, help="Set the number of worker processes for the PDF conversion. Defaults to all cores but two. Example: -j 8")
+    parser.add_argument("--task_timeout", type=int, default=600, help="Kill and replace a worker when a single PDF takes longer than this. [s] Example: --task_timeout 300")
+    parser.add_argument("--maxtasksperchild", type=int, default=200, help="Replace every worker process after this many PDFs to limit memory creep. Example: --maxtasksperchild 50")
+    parser.add_argument("--order", type=str, default="largest", choices=["largest", "natural", "none"], help="Set the order of the local PDFs: largest first, natural (numbers in the paths by value) or none, which starts the conversion while the directory is walked. Example: --order none")
+    parser.add_argument("--report", type=str, default="./pubcrawl_report.json", help="Write the run report with the time, latency percentiles and bytes of every pipeline stage to this JSON file. Example: --report ./report.json")
+    parser.add_argument("--prometheus", type=str, help="Also write the run metrics in the Prometheus text format to this file. Example: --prometheus ./pubcrawl.prom")
+    parser.add_argument("--state", type=str, help="Incremental crawl: record every processed arXiv paper and version in this SQLite file, only fetch new papers and new versions in later runs and append them to the output. Example: --state ./pubcrawl_state.sqlite")
+    parser.add_argument("--coordinator", type=str, help="Sharded crawl on several machines: split the filtered arXiv metadata into shards in this directory on shared storage, wait for the workers and merge their outputs. Example: --coordinator /mnt/shared/crawl")
+    parser.add_argument("--shards", type=int, default=64, help="Set the number of shards of a sharded crawl. Example: --shards 256")
+    parser.add_argument("--worker", type=str, help="Sharded crawl on several machines: claim shards from the coordinator in this directory on shared storage, download and process them until all are done. Run one worker per machine. Example: --worker /mnt/shared/crawl")
+    parser.add_argument("--lease", type=int, default=600, help="Give the shard of a worker that stopped renewing its lease to another worker after this time. [s] Example: --lease 300")
+    parser.add_argument("--no_index", action="store_true", help="Stream the arXiv metadata JSON instead of building and using the columnar index next to it. Example: --no_index")
 
     # Execute the parse_args() method
     args = parser.parse_args()
 
-    if args.source == "arxiv":
+    try:
+        args.extractors = parse_chain(args.extractors)
+    except ValueError as e:
+        print(colored("The provided extractor chain is invalid: {}".format(e), "red"))
+        os._exit(1)
+
+    if args.token_counts and args.output_format != "parquet":
+        print(colored("Token counts are only written to Parquet outputs. Please add the flag --output_format parquet.", "red"))
+        os._exit(1)
+
+    if args.state and args.output_format == "parquet":
+        print(colored("Incremental crawls append to the output, which is only supported for line-delimited JSON.", "red"))
+        os._exit(1)
+
+    if args.dedup and (args.state or args.coordinator or args.worker or args.source == "pubmed"):
+        print(colored("Near-duplicate detection is not supported by incremental and sharded crawls and the PubMed datasource.", "red"))
+        os._exit(1)
+
+    if args.dedup and not 0 < args.dedup_threshold <= 1:
+        print(colored("The near-duplicate threshold has to be between 0 and 1.", "red"))
+        os._exit(1)
+
+    # Parquet files compress their columns, the flag -z only chooses the codec. PubMed outputs are always streamed.
+    if args.compression and not args.stream_output and args.output_format == "jsonl" and args.source != "pubmed":
+        print(colored("Compression is only supported for the streamed output. Please add the flag -o.", "red"))
+        os._exit(1)
+
+    # File suffix of the outputs
+    output_suffix = ".parquet" if args.output_format == "parquet" else ".json"
+
+    if args.source == "arxiv" and args.worker:
+
+        # Integrity checks
+        if args.coordinator:
+            print(colored("A process is either the coordinator or a worker of a sharded crawl.", "red"))
+            os._exit(1)
+
+        if not os.path.isfile(os.path.join(args.worker, shards.QUEUE_FILE)):
+            print(colored("The provided directory does not contain a sharded crawl. Please start the coordinator first.", "red"))
+            os._exit(1)
+
+        if not args.process:
+            print(colored("The workers of a sharded crawl process the PDFs. Please add the flag -p.", "red"))
+            os._exit(1)
+
+        if args.local_PDFS or args.state:
+            print(colored("Local PDFs and incremental crawls are not supported by sharded crawls.", "red"))
+            os._exit(1)
+
+        if args.backend != "gcs" and not args.mirror:
+            print(colored("The {} download backend needs a mirror location. Please add the flag -m.".format(args.backend), "red"))
+            os._exit(1)
+
+        # Print the chosen arguments
+        print("")
+        print(colored("✓ You have chosen to work on the sharded crawl in {}.".format(args.worker), "yellow"))
+        if args.storage_size:
+            print(colored("✓ You have chosen a storage size of {} GB.".format(args.storage_size), "yellow"))
+        print("")
+
+        from datasources.arxiv import work
+
+        # Process shards until all of them are done
+        work_success = work(args.worker, lease=args.lease, arxiv_storage_size=args.storage_size, download_backend=args.backend, download_location=args.mirror, download_workers=args.download_workers, stream_output=args.stream_output, compression=args.compression, output_format=args.output_format, token_counts=args.token_counts, cache_path=args.cache, cache_size=args.cache_size * 1024**3, extractor_chain=args.extractors, max_pages=args.max_pages, workers=args.workers, task_timeout=args.task_timeout, maxtasksperchild=args.maxtasksperchild)
+
+        if work_success:
+            print("")
+            print(colored("Successfully processed all claimed shards to {}.".format(os.path.join(args.worker, shards.OUTPUT_DIR)), "green", attrs=["bold"]))
+            print("")
+        else:
+            print(colored("An error occured while processing the shards.", "red"))
+            os._exit(1)
+
+        # Save the metrics of the run
+        metrics.print_summary(metrics.write_report(args.report))
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus)
+        print(colored("Saved the run report to {}.".format(args.report), "green"))
+        print("")
+
+    elif args.source == "arxiv":
 
         # Integrity checks
         if not args.file:
@@ -47,6 +157,10 @@ if __name__ == "__main__":
             print(colored("The provided file does not exist.", "red"))
             os._exit(1)
 
+        if args.coordinator and (args.local_PDFS or args.state):
+            print(colored("Local PDFs and incremental crawls are not supported by sharded crawls.", "red"))
+            os._exit(1)
+
         if args.storage_size and not args.process:
             print(colored("You have provided a storage limit but do not wish to process the PDFs. This will result in an error.", "red"))
             os._exit(1)
@@ -55,6 +169,21 @@ if __name__ == "__main__":
             print(colored("The provided directory does not exist.", "red"))
             os._exit(1)
 
+        if args.backend != "gcs" and not args.mirror:
+            print(colored("The {} download backend needs a mirror location. Please add the flag -m.".format(args.backend), "red"))
+            os._exit(1)
+
+        if args.dedup and not (args.process or args.local_PDFS):
+            print(colored("The near-duplicate detection needs the texts of the PDFs. Please add the flag -p.", "red"))
+            os._exit(1)
+
+        if args.category:
+            try:
+                CategoryQuery(args.category)
+            except ValueError as e:
+                print(colored("The provided category expression is invalid: {}".format(e), "red"))
+                os._exit(1)
+
         # Print the chosen arguments
 
         print("")
@@ -70,19 +199,37 @@ if __name__ == "__main__":
         if args.storage_size:
             print(colored("✓ You have chosen a storage size of {} GB.".format(args.storage_size), "yellow"))
 
+        if args.state:
+            print(colored("✓ You have chosen an incremental crawl with the state in {}.".format(args.state), "yellow"))
+
+        if args.coordinator:
+            print(colored("✓ You have chosen to coordinate a sharded crawl with {} shards in {}.".format(args.shards, args.coordinator), "yellow"))
+
+        if args.dedup:
+            print(colored("✓ You have chosen to drop near-duplicates with a similarity of at least {}.".format(args.dedup_threshold), "yellow"))
+
         print("")
         print(colored("Loading the Metadata...", "green", attrs=["bold"]))
         print("")
 
+        from datasources.arxiv import coordinate, download, preprocess, process_local_pdfs
+        from pipeline.dedup import Deduplicator
+
+        deduplicator = Deduplicator(threshold=args.dedup_threshold) if args.dedup else None
+
         # Load the arXiv JSON and filter for the chosen category
         with load_bar(colored("Filtering arXiv Metadata JSON by category...", "yellow")):
-            arxiv_metadata_df = preprocess(arxiv_kaggle_file=args.file, arxiv_category=args.category, arxiv_rows=args.rows)
+            arxiv_metadata_df = preprocess(arxiv_kaggle_file=args.file, arxiv_category=args.category, arxiv_rows=args.rows, use_index=not args.no_index, output_format=args.output_format)
         
         print("")
-        print(colored("Successfully loaded the arXiv metadata and saved it to arxiv_metadata.json.", "green", attrs=["bold"]))
+        print(colored("Successfully loaded the arXiv metadata and saved it to arxiv_metadata{}.".format(output_suffix), "green", attrs=["bold"]))
         print("")
 
-        if args.local_PDFS:
+        if args.coordinator:
+            # The workers download and process the shards
+            download_success = coordinate(arxiv_metadata_df, args.coordinator, n_shards=args.shards)
+
+        elif args.local_PDFS:
             print("")
             print(colored("✓ You have chosen to use local PDFs.", "yellow"))
             print(colored("✓ The directory you have provided is valid.", "yellow"))
@@ -90,23 +237,22 @@ if __name__ == "__main__":
             print(colored("Loading the PDFs...", "green", attrs=["bold"]))
             print("")
 
-            # Load the local PDFs
-            with load_bar(colored("Loading local PDFs...", "yellow")):
-                arxiv_metadata_df = process_local_pdfs(arxiv_metadata_df, arxiv_local_PDF_dir=args.local_PDFS)
+            # Process the local PDFs instead of downloading them
+            download_success = process_local_pdfs(arxiv_metadata_df, arxiv_local_PDF_dir=args.local_PDFS, chunksize=args.chunksize, stream_output=args.stream_output, compression=args.compression, output_format=args.output_format, token_counts=args.token_counts, deduplicator=deduplicator, cache_path=args.cache, cache_size=args.cache_size * 1024**3, extractor_chain=args.extractors, max_pages=args.max_pages, workers=args.workers, task_timeout=args.task_timeout, maxtasksperchild=args.maxtasksperchild, state_path=args.state)
 
             print("")
             print(colored("Successfully loaded the local PDFs.", "green", attrs=["bold"]))
             print("")
 
-        # Download the arXiv dataset
-        with load_bar(colored("Downloading arXiv PDFs from GCP", "yellow")):
-            download_success = download(arxiv_metadata_df, arxiv_storage_size=args.storage_size, arxiv_process=args.process)
+        else:
+            # Download the arXiv dataset
+            download_success = download(arxiv_metadata_df, arxiv_storage_size=args.storage_size, arxiv_process=args.process, download_backend=args.backend, download_location=args.mirror, download_workers=args.download_workers, stream_output=args.stream_output, compression=args.compression, output_format=args.output_format, token_counts=args.token_counts, deduplicator=deduplicator, cache_path=args.cache, cache_size=args.cache_size * 1024**3, extractor_chain=args.extractors, max_pages=args.max_pages, workers=args.workers, task_timeout=args.task_timeout, maxtasksperchild=args.maxtasksperchild, state_path=args.state)
 
         if download_success:
 
-            if args.process:
+            if args.process or args.local_PDFS or args.coordinator:
                 print("")
-                print(colored("Successfully processed all PDFs to arxiv_fulltext.json", "green", attrs=["bold"]))
+                print(colored("Successfully processed all PDFs to arxiv_fulltext{}".format(output_suffix), "green", attrs=["bold"]))
                 print("")
             else:
                 print("")
@@ -117,6 +263,19 @@ if __name__ == "__main__":
             print(colored("An error occured during the download and processing phase.", "red"))
             os._exit(1)
 
+        # Save the near-duplicate clusters
+        if deduplicator is not None:
+            deduplicator.report(args.dedup_report)
+            deduplicator.close()
+            print("")
+
+        # Save the metrics of the run
+        metrics.print_summary(metrics.write_report(args.report))
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus)
+        print(colored("Saved the run report to {}.".format(args.report), "green"))
+        print("")
+
         print(colored("Thank you for using PubCrawl. Good bye!", "green", attrs=["bold"]))
         print(colored("--------------------", "green", attrs=["bold"]))
         print("")
@@ -127,34 +286,103 @@ if __name__ == "__main__":
             print(colored("The provided directory does not exist.", "red"))
             os._exit(1)
 
-        # Check if there are pdf files in the directory
-        if args.local_PDFS:
-            pdfs = [f for f in os.listdir(args.local_PDFS) if f.endswith(".pdf")]
-            if len(pdfs) == 0:
-                print(colored("The provided directory does not contain any PDFs.", "red"))
-                os._exit(1)
+        # Check if there are pdf files in the directory, the walk stops at the first one
+        if args.local_PDFS and not files.contains_any(args.local_PDFS):
+            print(colored("The provided directory does not contain any PDFs.", "red"))
+            os._exit(1)
 
         if not args.process:
             print(colored("You have not chosen to process the PDFs. This will result in an error. Please add the flag -p.", "red"))
             os._exit(1)
 
+        if args.state:
+            print(colored("Incremental crawls are only supported for the arXiv datasource.", "red"))
+            os._exit(1)
+
         # Print the chosen arguments
         print("")
         print(colored("✓ You have chosen to process local PDFs.", "yellow"))
         print(colored("✓ The directory you have provided is valid.", "yellow"))
         print(colored("✓ The directory contains valid PDF files.", "yellow"))
+        if args.dedup:
+            print(colored("✓ You have chosen to drop near-duplicates with a similarity of at least {}.".format(args.dedup_threshold), "yellow"))
         print("")
 
+        from datasources.pdfs import local_pdfs
+        from pipeline.dedup import Deduplicator
+
+        deduplicator = Deduplicator(threshold=args.dedup_threshold) if args.dedup else None
+
         # Load the local PDFs
-        with load_bar(colored("Loading local PDFs...", "yellow")):
-            processed_pdfs = local_pdfs(pdf_dir=args.local_PDFS)
+        processed_pdfs = local_pdfs(pdf_dir=args.local_PDFS, chunksize=args.chunksize, stream_output=args.stream_output, compression=args.compression, output_format=args.output_format, token_counts=args.token_counts, deduplicator=deduplicator, cache_path=args.cache, cache_size=args.cache_size * 1024**3, extractor_chain=args.extractors, max_pages=args.max_pages, workers=args.workers, task_timeout=args.task_timeout, maxtasksperchild=args.maxtasksperchild, order=args.order)
 
         print("")
         print(colored("Successfully loaded the local PDFs.", "green", attrs=["bold"]))
         print("")
 
+        # Save the near-duplicate clusters
+        if deduplicator is not None:
+            deduplicator.report(args.dedup_report)
+            deduplicator.close()
+            print("")
+
+        # Save the metrics of the run
+        metrics.print_summary(metrics.write_report(args.report))
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus)
+        print(colored("Saved the run report to {}.".format(args.report), "green"))
+        print("")
+
 
 
+    elif args.source == "pubmed":
+        # Integrity checks
+        if not args.local_PDFS or not os.path.isdir(args.local_PDFS):
+            print(colored("Please provide the directory of the PubMed XML files and PMC bundles with the flag -l.", "red"))
+            os._exit(1)
+
+        if not files.contains_any(args.local_PDFS, (".xml.gz", ".xml", ".tar.gz", ".tgz")):
+            print(colored("The provided directory does not contain any PubMed XML files or PMC bundles.", "red"))
+            os._exit(1)
+
+        if args.state or args.coordinator or args.worker:
+            print(colored("Incremental and sharded crawls are only supported for the arXiv datasource.", "red"))
+            os._exit(1)
+
+        if args.category:
+            try:
+                CategoryQuery(args.category)
+            except ValueError as e:
+                print(colored("The provided category expression is invalid: {}".format(e), "red"))
+                os._exit(1)
+
+        # Print the chosen arguments
+        print("")
+        print(colored("✓ You have chosen to parse PubMed and PMC files.", "yellow"))
+        print(colored("✓ The directory you have provided is valid.", "yellow"))
+        if args.category:
+            print(colored("✓ You have chosen the MeSH descriptors / subjects: {}".format(args.category), "yellow"))
+        print("")
+
+        from datasources.pubmed import pubmed
+
+        # Parse the files in parallel, the output is always streamed
+        pubmed_success = pubmed(args.local_PDFS, category=args.category, compression=args.compression, output_format=args.output_format, token_counts=args.token_counts, workers=args.workers, task_timeout=args.task_timeout, maxtasksperchild=args.maxtasksperchild)
+
+        if pubmed_success:
+            print("")
+            print(colored("Successfully parsed all files to pubmed_fulltext{}".format(output_suffix), "green", attrs=["bold"]))
+            print("")
+        else:
+            print(colored("An error occured while parsing the files.", "red"))
+            os._exit(1)
+
+        # Save the metrics of the run
+        metrics.print_summary(metrics.write_report(args.report))
+        if args.prometheus:
+            metrics.write_prometheus(args.prometheus)
+        print(colored("Saved the run report to {}.".format(args.report), "green"))
+        print("")
 
     else:
         print(colored("Please choose a valid datasource.", "red"))
@@ -0,0 +1,169 @@
+###############################################################################################################################
+#
+# Content-addressed cache of extracted texts.
+#
+# INFO: Entries are keyed by the SHA-256 of the PDF, the extractor (name and version) and the kind of text ("raw" output
+#       of the extractor or "cleaned" text). The texts are stored zlib compressed in a single SQLite file that can be
+#       shared by all worker processes. When the cache grows beyond its size limit, the least recently used entries are
+#       evicted. A hit only records its time when the last one is older than TOUCH_INTERVAL, so that reads by the
+#       workers do not contend for the write lock of the file.
+#
+###############################################################################################################################
+
+import hashlib
+import os
+import sqlite3
+import time
+import zlib
+
+MAX_SIZE = 10 * 1024**3
+# Fraction of the size limit that is kept after an eviction, so that not every insert has to evict
+EVICT_TO = 0.9
+HASH_CHUNK_SIZE = 1 << 20
+# Seconds after which a hit updates the time an entry was last used. The eviction order is only this precise.
+TOUCH_INTERVAL = 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL);
+INSERT OR IGNORE INTO totals VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries
+    BEGIN UPDATE totals SET size = size + new.size WHERE id = 0; END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries
+    BEGIN UPDATE totals SET size = size - old.size WHERE id = 0; END;
+"""
+
+# One connection per cache file and process, since the workers of a pool must not share connections
+_caches = {}
+
+
+def hash_file(path: str) -> str:
+    """ SHA-256 hex digest of a file """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """
+    SQLite backed, size-limited LRU cache of extracted texts.
+
+    Parameters
+    ----------
+    path : str
+        SQLite file of the cache. It is created if it does not exist.
+
+    max_size : int
+        Maximum size of the stored (compressed) texts in bytes
+
+    touch_interval : float
+        Seconds after which a hit updates the time the entry was last used
+    """
+
+    def __init__(self, path: str, max_size: int = MAX_SIZE, touch_interval: float = TOUCH_INTERVAL):
+        self.path = path
+        self.max_size = max_size
+        self.touch_interval = touch_interval
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    @staticmethod
+    def key(digest: str, extractor: str, kind: str) -> str:
+        return "{}:{}:{}".format(digest, extractor, kind)
+
+    def get(self, digest: str, extractor: str, kind: str):
+        """
+        Look up a text.
+
+        Returns
+        -------
+        text : str or None
+            The cached text or None on a miss
+        """
+        key = self.key(digest, extractor, kind)
+        row = self._db.execute("SELECT data, last_used FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] >= self.touch_interval:
+            # Another worker may have touched the entry meanwhile
+            self._db.execute("UPDATE entries SET last_used = ? WHERE key = ? AND last_used < ?", (now, key, now - self.touch_interval))
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def put(self, digest: str, extractor: str, kind: str, text: str):
+        """ Store a text and evict the least recently used entries if the cache is full """
+        data = zlib.compress(text.encode("utf-8"), 1)
+        self._db.execute(
+            "INSERT INTO entries VALUES (?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET last_used = excluded.last_used",
+            (self.key(digest, extractor, kind), data, len(data), time.time()),
+        )
+        if self.size() > self.max_size:
+            self.evict()
+
+    def size(self) -> int:
+        """ Size of the stored texts in bytes """
+        return self._db.execute("SELECT size FROM totals WHERE id = 0").fetchone()[0]
+
+    def evict(self):
+        """ Delete the least recently used entries until the cache is below its size limit """
+        target = self.max_size * EVICT_TO
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            excess = self.size() - target
+            if excess > 0:
+                # All entries up to the one where the running size exceeds the excess
+                self._db.execute(
+                    """
+                    DELETE FROM entries WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, SUM(size) OVER (ORDER BY last_used ROWS UNBOUNDED PRECEDING) - size AS before
+                            FROM entries
+                        ) WHERE before < ?
+                    )
+                    """,
+                    (excess,),
+                )
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+
+
+def open_cache(path: str, max_size: int = MAX_SIZE) -> ExtractionCache:
+    """ The cache for path in the current process """
+    cache_key = (os.getpid(), path)
+    if cache_key not in _caches:
+        _caches[cache_key] = ExtractionCache(path, max_size=max_size)
+    return _caches[cache_key]
+
+
+def count_hits(records, counts: dict):
+    """
+    Pass records through while counting the cache outcome of each one in counts ("hit", "raw_hit", "miss").
+    """
+    for record in records:
+        outcome = record["stats"].get("cache")
+        if outcome is not None:
+            counts[outcome] = counts.get(outcome, 0) + 1
+        yield record
+
+
+def report(counts: dict):
+    """ Print the hit/miss counts collected by :func:`count_hits` """
+    if counts:
+        print("Extraction cache: {} hits, {} raw text hits, {} misses.".format(
+            counts.get("hit", 0), counts.get("raw_hit", 0), counts.get("miss", 0)))
@@ -0,0 +1,285 @@
+###############################################################################################################################
+#
+# Near-duplicate detection of the cleaned texts with MinHash and locality-sensitive hashing (LSH).
+#
+# INFO: The workers compute the MinHash signature of every text they clean (see signature()). The word SHINGLE-grams
+#       of the text are hashed and NUM_PERM hash functions are applied to all of them at once with NumPy. The signature
+#       holds the minimum of every function, and the share of equal entries of two signatures estimates the Jaccard
+#       similarity of their shingle sets.
+#
+#       The parent process checks every document against the documents kept so far (see Deduplicator). The signature
+#       is cut into BANDS bands, and the kept documents that share all entries of at least one band are candidates. Only
+#       the candidates are compared, so a check does not get slower with the number of documents. A document whose
+#       estimated similarity to a candidate reaches THRESHOLD is a duplicate of it and is not written. With 16 bands of
+#       8 entries, documents with a similarity of 0.8 become candidates with a probability of 95%, at 0.9 of over 99.9%.
+#
+#       The band keys of the index are held in sorted NumPy arrays (192 bytes per document, see Deduplicator._merge())
+#       and the signatures in a temporary file, so millions of documents fit in memory. The arrays are segments of
+#       geometrically growing sizes, so every key is only copied O(log N) times while the index grows.
+#
+###############################################################################################################################
+
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from pipeline import metrics
+
+NUM_PERM = 128
+BANDS = 16
+# Number of words of a shingle
+SHINGLE = 5
+# Minimum estimated Jaccard similarity of near-duplicates
+THRESHOLD = 0.8
+SEED = 1
+
+# Number of shingles that are hashed at once, bounds the memory of a worker to BLOCK * NUM_PERM * 8 bytes
+BLOCK = 4096
+# Number of documents after which the recent band keys are merged into the sorted arrays of the index
+MERGE_EVERY = 10000
+# Size ratio of two consecutive segments of the index below which they are merged, see Deduplicator._merge()
+SEGMENT_GROWTH = 4
+# Number of clusters listed in the printed summary
+REPORT_LIMIT = 10
+
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_HASH_SHIFT = np.uint64(29)
+_SHIFT_32 = np.uint64(32)
+
+
+def _permutations(num_perm: int = NUM_PERM, seed: int = SEED):
+    """ Parameters of the multiply-shift hash functions: odd multipliers and offsets """
+    rng = np.random.default_rng(seed)
+    multipliers = rng.integers(1, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64, endpoint=True) | np.uint64(1)
+    offsets = rng.integers(0, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64, endpoint=True)
+    return multipliers, offsets
+
+
+_MULTIPLIERS, _OFFSETS = _permutations()
+
+
+def _fold(columns: np.ndarray, seed) -> np.ndarray:
+    """ 64-bit hashes of the rows of a 2D array of unsigned integers, over all rows at once """
+    hashes = np.full(len(columns), seed, dtype=np.uint64)
+    for column in columns.T:
+        hashes ^= column.astype(np.uint64)
+        hashes *= _HASH_MULTIPLIER
+        hashes ^= hashes >> _HASH_SHIFT
+    return hashes
+
+
+def shingles(text: str, shingle: int = SHINGLE) -> np.ndarray:
+    """ The distinct 64-bit hashes of the word shingle-grams of a text (one shingle for shorter texts) """
+    words = text.encode("utf-8").split()
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    # Fixed-width byte strings whose width is a multiple of 8, hashed eight bytes at a time
+    width = -(-max(map(len, words)) // 8) * 8
+    words = np.array(words, dtype="S{}".format(width))
+    hashes = _fold(words.view(np.uint64).reshape(len(words), -1), width)
+
+    n = max(1, len(hashes) - shingle + 1)
+    grams = np.stack([hashes[j:j + n] for j in range(min(shingle, len(hashes)))], axis=1)
+    return np.unique(_fold(grams, shingle))
+
+
+def signature(text: str, num_perm: int = NUM_PERM) -> np.ndarray:
+    """
+    MinHash signature of a text.
+
+    Parameters
+    ----------
+    text : str
+        Cleaned text, see pipeline.pdf2txt.cleaned_text()
+
+    num_perm : int
+        Number of hash functions, at most NUM_PERM
+
+    Returns
+    -------
+    signature : numpy.ndarray
+        num_perm uint32 values, None for a text without words
+    """
+    hashed = shingles(text)
+    if len(hashed) == 0:
+        return None
+    multipliers, offsets = _MULTIPLIERS[:num_perm], _OFFSETS[:num_perm]
+    minimum = np.full(num_perm, np.iinfo(np.uint32).max, dtype=np.uint64)
+    for start in range(0, len(hashed), BLOCK):
+        # The upper 32 bits of a * x + b (mod 2^64), for every shingle and hash function
+        values = (hashed[start:start + BLOCK, None] * multipliers + offsets) >> _SHIFT_32
+        np.minimum(minimum, values.min(axis=0), out=minimum)
+    return minimum.astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """ Estimated Jaccard similarity of the texts of two signatures """
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+def band_keys(signature: np.ndarray, bands: int = BANDS) -> np.ndarray:
+    """ One 64-bit key per band of a signature, seeded with the number of the band so that the bands share an index """
+    rows = signature.reshape(bands, -1).astype(np.uint64)
+    return _fold(np.concatenate([np.arange(bands, dtype=np.uint64)[:, None], rows], axis=1), bands)
+
+
+def _merge_sorted(first: tuple, second: tuple) -> tuple:
+    """ Merge two segments of sorted keys and their document numbers in linear time """
+    first_keys, first_docs = first
+    second_keys, second_docs = second
+    # Every key of the second segment goes after the keys of the first one that are not larger
+    positions = np.searchsorted(first_keys, second_keys, side="right") + np.arange(len(second_keys))
+    from_first = np.ones(len(first_keys) + len(second_keys), dtype=bool)
+    from_first[positions] = False
+    keys = np.empty(len(from_first), dtype=np.uint64)
+    docs = np.empty(len(from_first), dtype=np.uint32)
+    keys[positions], docs[positions] = second_keys, second_docs
+    keys[from_first], docs[from_first] = first_keys, first_docs
+    return keys, docs
+
+
+class Deduplicator:
+    """
+    LSH index of the documents kept so far. Documents are checked in the order in which they are written, so the
+    first document of a cluster is kept.
+
+    Parameters
+    ----------
+    threshold : float
+        Minimum estimated similarity of near-duplicates
+
+    bands : int
+        Number of bands of the signatures, NUM_PERM has to be a multiple of it
+    """
+
+    def __init__(self, threshold: float = THRESHOLD, bands: int = BANDS):
+        self.threshold = threshold
+        self.bands = bands
+        self.checked = 0
+        self.duplicates = 0
+
+        # Ids of the kept documents, by their number in the index
+        self._ids = []
+        # Segments of sorted band keys and the numbers of their documents, largest first, and the keys added since the
+        # last merge
+        self._segments = []
+        self._recent = {}
+        # Kept document number -> [(id, similarity)] of its duplicates
+        self._clusters = {}
+        self._signatures = tempfile.TemporaryFile()
+        self._width = None
+
+    def _candidates(self, keys: np.ndarray) -> set:
+        candidates = set()
+        for segment_keys, segment_docs in self._segments:
+            left = np.searchsorted(segment_keys, keys, side="left")
+            # Most keys are in no segment, the ends of the runs are only searched for the ones that are
+            hits = segment_keys.take(left, mode="clip") == keys
+            if hits.any():
+                right = np.searchsorted(segment_keys, keys[hits], side="right")
+                for start, end in zip(left[hits].tolist(), right.tolist()):
+                    candidates.update(segment_docs[start:end].tolist())
+        for key in keys.tolist():
+            candidates.update(self._recent.get(key, ()))
+        return candidates
+
+    def _signature(self, doc: int) -> np.ndarray:
+        return np.frombuffer(os.pread(self._signatures.fileno(), self._width, doc * self._width), dtype=np.uint32)
+
+    def _merge(self):
+        keys = np.fromiter((key for key, docs in self._recent.items() for _ in docs), dtype=np.uint64)
+        docs = np.fromiter((doc for docs in self._recent.values() for doc in docs), dtype=np.uint32, count=len(keys))
+        order = np.argsort(keys, kind="stable")
+        self._segments.append((keys[order], docs[order]))
+        self._recent = {}
+        # The last segment is merged into the one before it until that one is more than SEGMENT_GROWTH times as large
+        while len(self._segments) > 1 and len(self._segments[-2][0]) <= SEGMENT_GROWTH * len(self._segments[-1][0]):
+            last = self._segments.pop()
+            self._segments[-1] = _merge_sorted(self._segments[-1], last)
+
+    def check(self, doc_id: str, signature: np.ndarray) -> str:
+        """
+        Check a document against the kept documents and keep it if it is new.
+
+        Parameters
+        ----------
+        doc_id : str
+            Id of the document in the output
+
+        signature : numpy.ndarray
+            Signature of its text, see :func:`signature`. Documents without a signature are always kept.
+
+        Returns
+        -------
+        str
+            The id of the kept document that this one duplicates, None if it is kept
+        """
+        self.checked += 1
+        if signature is None:
+            return None
+        start = time.perf_counter()
+
+        keys = band_keys(signature, self.bands)
+        best, best_similarity = None, 0.0
+        for doc in self._candidates(keys):
+            doc_similarity = similarity(signature, self._signature(doc))
+            if doc_similarity > best_similarity:
+                best, best_similarity = doc, doc_similarity
+
+        if best is not None and best_similarity >= self.threshold:
+            self.duplicates += 1
+            self._clusters.setdefault(best, []).append((doc_id, round(best_similarity, 3)))
+            metrics.count("duplicates")
+            metrics.observe("dedup", time.perf_counter() - start)
+            return self._ids[best]
+
+        doc = len(self._ids)
+        self._ids.append(doc_id)
+        self._width = signature.nbytes
+        self._signatures.seek(0, os.SEEK_END)
+        self._signatures.write(signature.astype(np.uint32).tobytes())
+        self._signatures.flush()
+        for key in keys.tolist():
+            self._recent.setdefault(key, []).append(doc)
+        if doc % MERGE_EVERY == MERGE_EVERY - 1:
+            self._merge()
+        metrics.observe("dedup", time.perf_counter() - start)
+        return None
+
+    def clusters(self) -> list:
+        """ The duplicate clusters, largest first: the kept id and the ids and similarities of its duplicates """
+        clusters = [{"id": self._ids[doc], "duplicates": [{"id": doc_id, "similarity": value} for doc_id, value in duplicates]}
+                    for doc, duplicates in self._clusters.items()]
+        return sorted(clusters, key=lambda cluster: -len(cluster["duplicates"]))
+
+    def report(self, path: str) -> dict:
+        """ Write the duplicate clusters to a JSON file, print a summary and return the report """
+        report = {
+            "documents": self.checked,
+            "kept": self.checked - self.duplicates,
+            "duplicates": self.duplicates,
+            "threshold": self.threshold,
+            "clusters": self.clusters(),
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, path)
+
+        print("Found {} near-duplicates of {} documents in {} clusters, see {}.".format(
+            self.duplicates, self.checked, len(report["clusters"]), path))
+        for cluster in report["clusters"][:REPORT_LIMIT]:
+            print("  " + cluster["id"] + ": " + ", ".join(duplicate["id"] for duplicate in cluster["duplicates"]))
+        return report
+
+    def close(self):
+        self._signatures.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,362 @@
+###############################################################################################################################
+#
+# Concurrent, resumable PDF downloader.
+#
+# INFO: PDFs are fetched by a bounded pool of threads from a pluggable storage backend. Every object is retried with
+#       exponential backoff, and the outcome is appended to a JSONL manifest so that an interrupted run only fetches what
+#       is still missing. The "gcs" backend reads the public arXiv bucket (gs://arxiv-dataset) through its HTTP endpoint,
+#       "http" reads the same layout from any base URL and "local" copies it from a directory (both handy for tests).
+#
+###############################################################################################################################
+
+import json
+import os
+import random
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from pipeline import metrics
+
+GCS_BASE_URL = "https://storage.googleapis.com/arxiv-dataset"
+GCS_ARXIV_PREFIX = "arxiv"
+
+WORKERS = 16
+RETRIES = 4
+BACKOFF = 1.0
+REPORT_INTERVAL = 10
+CHUNK_SIZE = 1 << 20
+
+# Size that is reserved for a download in flight until its actual size is known
+ESTIMATED_PDF_SIZE = 5 << 20
+# Seconds between two looks at the cancel event of a download that waits for disk space
+CANCEL_POLL = 1.0
+
+
+class PermanentError(Exception):
+    """ Raised by a backend when retrying an object is pointless, e.g. because it does not exist """
+
+
+class LocalBackend:
+    """
+    Copy objects from a local directory that mirrors the bucket layout.
+
+    Parameters
+    ----------
+    root : str
+        Directory that contains the object keys as relative paths
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def fetch(self, key: str, outfile: str) -> int:
+        source = os.path.join(self.root, key)
+        if not os.path.isfile(source):
+            raise PermanentError("No such object: {}".format(source))
+        shutil.copyfile(source, outfile)
+        return os.path.getsize(outfile)
+
+
+class HTTPBackend:
+    """
+    Fetch objects over HTTP(S) from base_url/key.
+
+    Parameters
+    ----------
+    base_url : str
+        URL under which the object keys are served
+
+    timeout : int
+        Socket timeout in seconds
+    """
+
+    def __init__(self, base_url: str, timeout: int = 60):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def fetch(self, key: str, outfile: str) -> int:
+        url = "{}/{}".format(self.base_url, key)
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response, open(outfile, "wb") as f:
+                shutil.copyfileobj(response, f, CHUNK_SIZE)
+        except urllib.error.HTTPError as e:
+            if e.code in (400, 401, 403, 404, 410):
+                raise PermanentError("{} returned HTTP {}".format(url, e.code)) from e
+            raise
+        return os.path.getsize(outfile)
+
+
+class GCSBackend(HTTPBackend):
+    """ Fetch objects from the public arXiv bucket gs://arxiv-dataset """
+
+    def __init__(self, base_url: str = GCS_BASE_URL, timeout: int = 60):
+        super().__init__(base_url, timeout=timeout)
+
+
+class DiskBudget:
+    """
+    Thread-safe account of the scratch disk space in use. Downloads reserve space before they start and consumers
+    release it when they have deleted a file. A single file is always admitted, even if it exceeds the limit.
+
+    Parameters
+    ----------
+    limit : int
+        Maximum number of bytes in use. None means unlimited.
+    """
+
+    def __init__(self, limit: int = None):
+        self.limit = limit
+        self.used = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+    def _fits(self, size: int) -> bool:
+        return self.limit is None or self.used == 0 or self.used + size <= self.limit
+
+    def has_room(self, size: int) -> bool:
+        with self._condition:
+            return self._fits(size)
+
+    def wait_for_room(self, size: int, timeout: float = None) -> bool:
+        """ Block until size fits. False if it still does not fit after timeout seconds. """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._fits(size), timeout=timeout)
+
+    def acquire(self, size: int):
+        with self._condition:
+            self.used += size
+            self.peak = max(self.peak, self.used)
+
+    def release(self, size: int):
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+BACKENDS = {"gcs": GCSBackend, "http": HTTPBackend, "local": LocalBackend}
+
+
+def make_backend(name: str = "gcs", location: str = None):
+    """
+    Instantiate a storage backend by name.
+
+    Parameters
+    ----------
+    name : str
+        One of "gcs", "http" or "local"
+
+    location : str
+        Base URL (gcs, http) or directory (local) of the bucket layout. Optional for gcs.
+    """
+    if name not in BACKENDS:
+        raise ValueError("Unknown download backend '{}'. Choose one of {}.".format(name, ", ".join(BACKENDS)))
+    if name == "gcs":
+        return GCSBackend(location) if location else GCSBackend()
+    if not location:
+        raise ValueError("The '{}' download backend needs a location.".format(name))
+    return BACKENDS[name](location)
+
+
+def load_manifest(manifest_path: str) -> dict:
+    """
+    Read the download manifest. Later lines override earlier ones.
+
+    Returns
+    -------
+    manifest : dict
+        Maps every id to its last recorded entry ({"id", "status", "bytes", "error"})
+    """
+    manifest = {}
+    if not os.path.exists(manifest_path):
+        return manifest
+    with open(manifest_path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # torn last line of an interrupted run
+            manifest[entry["id"]] = entry
+    return manifest
+
+
+def fetch_with_retry(backend, key: str, outfile: str, retries: int = RETRIES, backoff: float = BACKOFF) -> int:
+    """
+    Fetch a single object to outfile. The data is written to a .part file first, so that outfile only ever exists
+    when it is complete.
+
+    Returns
+    -------
+    size : int
+        Number of bytes written
+    """
+    partfile = outfile + ".part"
+    for attempt in range(retries + 1):
+        try:
+            size = backend.fetch(key, partfile)
+            os.replace(partfile, outfile)
+            return size
+        except PermanentError:
+            raise
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt * (1 + random.random()))
+        finally:
+            if os.path.exists(partfile):
+                os.remove(partfile)
+
+
+def download_all(items, pdf_dir: str, backend, manifest_path: str, workers: int = WORKERS, retries: int = RETRIES,
+                 on_done=None, budget=None, cancel=None, backoff: float = BACKOFF):
+    """
+    Download objects with a bounded pool of threads and record the outcome of each one in the manifest.
+
+    Parameters
+    ----------
+    items : iterable of (str, str)
+        Pairs of (id, object key). The file is stored as the basename of the key in pdf_dir.
+
+    pdf_dir : str
+        Target directory
+
+    backend : object
+        Storage backend with a fetch(key, outfile) method (see :func:`make_backend`)
+
+    manifest_path : str
+        JSONL file with the outcome of every download. Ids that are already recorded as done and whose file still
+        exists are skipped.
+
+    workers : int
+        Number of concurrent downloads
+
+    retries : int
+        Number of retries per object for transient errors
+
+    on_done : callable
+        Optional callback on_done(id, path), called from the calling thread for every successful or skipped download
+
+    budget : DiskBudget
+        Optional disk budget. Space is reserved before a download starts and downloads pause while the budget is
+        exhausted. The space of a downloaded file stays acquired until the consumer releases it.
+
+    cancel : threading.Event
+        Optional event that stops the downloads, e.g. when the consumer failed. No new download is started, the ones
+        in flight are finished and leftover .part files are removed.
+
+    backoff : float
+        Seconds before the first retry of an object, doubled with every further retry (see :func:`fetch_with_retry`)
+
+    Returns
+    -------
+    summary : dict
+        Counts of "done", "skipped" and "failed" downloads, the "failed_ids", "bytes", "seconds" and whether the
+        downloads were "cancelled"
+    """
+    os.makedirs(pdf_dir, exist_ok=True)
+    manifest = load_manifest(manifest_path)
+
+    summary = {"done": 0, "skipped": 0, "failed": 0, "failed_ids": [], "bytes": 0, "seconds": 0.0, "cancelled": False}
+    start = last_report = time.time()
+    lock = threading.Lock()
+
+    def report():
+        elapsed = max(time.time() - start, 1e-9)
+        print("Downloaded {} PDFs ({} skipped, {} failed) - {:.1f} PDFs/s, {:.1f} MB/s.".format(
+            summary["done"], summary["skipped"], summary["failed"],
+            summary["done"] / elapsed, summary["bytes"] / elapsed / 1e6))
+
+    def run(pdf_id, key, outfile):
+        started = time.perf_counter()
+        size = fetch_with_retry(backend, key, outfile, retries=retries, backoff=backoff)
+        return pdf_id, outfile, size, time.perf_counter() - started
+
+    def estimate():
+        return summary["bytes"] // summary["done"] if summary["done"] else ESTIMATED_PDF_SIZE
+
+    def cancelled():
+        return cancel is not None and cancel.is_set()
+
+    with open(manifest_path, "a") as manifest_file, ThreadPoolExecutor(max_workers=workers) as executor:
+
+        def record(entry):
+            with lock:
+                manifest_file.write(json.dumps(entry) + "\n")
+                manifest_file.flush()
+
+        def collect(futures):
+            nonlocal last_report
+            finished, pending = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                pdf_id, reserved = futures_ids.pop(future)
+                if budget is not None:
+                    budget.release(reserved)
+                try:
+                    pdf_id, outfile, size, seconds = future.result()
+                except Exception as e:
+                    metrics.count("failed_downloads")
+                    summary["failed"] += 1
+                    summary["failed_ids"].append(pdf_id)
+                    record({"id": pdf_id, "status": "failed", "error": str(e)})
+                    continue
+                metrics.observe("download", seconds, bytes_in=size)
+                summary["done"] += 1
+                summary["bytes"] += size
+                if budget is not None:
+                    budget.acquire(size)
+                record({"id": pdf_id, "status": "done", "bytes": size})
+                if on_done is not None:
+                    on_done(pdf_id, outfile)
+            if time.time() - last_report >= REPORT_INTERVAL:
+                report()
+                last_report = time.time()
+            return pending
+
+        futures_ids = {}
+        pending = set()
+        for pdf_id, key in items:
+            if cancelled():
+                break
+            outfile = os.path.join(pdf_dir, os.path.basename(key))
+            if manifest.get(pdf_id, {}).get("status") == "done" and os.path.exists(outfile):
+                summary["skipped"] += 1
+                if budget is not None:
+                    budget.acquire(os.path.getsize(outfile))
+                if on_done is not None:
+                    on_done(pdf_id, outfile)
+                continue
+
+            # Keep the number of queued downloads bounded and pause while the disk budget is exhausted. Finished
+            # downloads are handed to on_done first, so that the consumer can free space.
+            reserved = estimate()
+            while len(pending) >= 2 * workers or (pending and budget is not None and not budget.has_room(reserved)):
+                pending = collect(pending)
+            if budget is not None:
+                while not budget.wait_for_room(reserved, timeout=CANCEL_POLL) and not cancelled():
+                    pass
+            # The consumer may have failed while this download waited
+            if cancelled():
+                break
+            if budget is not None:
+                budget.acquire(reserved)
+
+            future = executor.submit(run, pdf_id, key, outfile)
+            futures_ids[future] = (pdf_id, reserved)
+            pending.add(future)
+
+        while pending:
+            pending = collect(pending)
+
+    if cancelled():
+        summary["cancelled"] = True
+        for entry in os.scandir(pdf_dir):
+            if entry.name.endswith(".part"):
+                os.remove(entry.path)
+        print("Cancelled the downloads.")
+
+    summary["seconds"] = time.time() - start
+    report()
+    return summary
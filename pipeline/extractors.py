@@ -0,0 +1,244 @@
+###############################################################################################################################
+#
+# Pluggable PDF text extractors.
+#
+# INFO: Every extractor turns a PDF into plain text in memory, without temp files. "pdftotext" (poppler) and the
+#       "pdf2txt" command line tool of pdfminer.six run as subprocesses and stream their output through a pipe,
+#       "pdfminer" calls the pdfminer.six API in the worker process itself and "pypdfium2" uses PDFium through the
+#       optional pypdfium2 package. The "-A" variants run pdfminer's layout analysis on the text in figures as well,
+#       which helps when words are glued together. The text is produced page by page, so that a bad extraction can be
+#       abandoned early. A run tries the extractors of a chain in order, see pipeline.pdf2txt.fulltext().
+#
+###############################################################################################################################
+
+import codecs
+import io
+import signal
+import subprocess
+import threading
+from contextlib import contextmanager
+
+PDF2TXT = 'pdf2txt.py'
+PDFTOTEXT = 'pdftotext'
+
+READ_SIZE = 1 << 16
+
+# pdftotext is by far the fastest, the in-process pdfminer backends are the fallbacks for PDFs it cannot handle
+DEFAULT_CHAIN = ("pdftotext", "pdfminer", "pdfminer-A")
+
+
+@contextmanager
+def time_limit(seconds: float):
+    """
+    Raise a TimeoutError in the block after seconds. Only enforced in the main thread of a process (which is where the
+    pool workers run their tasks), elsewhere the block runs without a limit.
+    """
+    if not seconds or threading.current_thread() is not threading.main_thread() or not hasattr(signal, "setitimer"):
+        yield
+        return
+
+    def expired(signum, frame):
+        raise TimeoutError("Extraction took longer than {} seconds".format(seconds))
+
+    previous = signal.signal(signal.SIGALRM, expired)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def stream_command(cmd: list, timelimit: float):
+    """
+    Run cmd and yield what it writes to stdout page by page, split after every form feed. The process is killed when it
+    runs longer than timelimit or when the generator is closed early. Raises CalledProcessError, TimeoutError or OSError.
+    """
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        process.kill()
+
+    timer = threading.Timer(timelimit, kill) if timelimit else None
+    if timer is not None:
+        timer.start()
+    try:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        buffer = ""
+        for chunk in iter(lambda: process.stdout.read1(READ_SIZE), b""):
+            buffer += decoder.decode(chunk)
+            if "\x0c" in buffer:
+                *pages, buffer = buffer.split("\x0c")
+                for page in pages:
+                    yield page + "\x0c"
+        buffer += decoder.decode(b"", final=True)
+
+        returncode = process.wait()
+        if timed_out.is_set():
+            raise TimeoutError("Extraction took longer than {} seconds".format(timelimit))
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, cmd)
+        if buffer:
+            yield buffer
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+
+
+class Extractor:
+    """
+    Base class of the extractors. Subclasses implement pages(), which yields the text of a PDF page by page (every page
+    ends with a form feed), so that callers can stop early.
+    """
+
+    name = None
+
+    def pages(self, pdffile: str, timelimit: float, max_pages: int = None):
+        raise NotImplementedError
+
+    def extract(self, pdffile: str, timelimit: float, max_pages: int = None) -> str:
+        """ The text of the first max_pages pages (all if None) """
+        pages = self.pages(pdffile, timelimit, max_pages=max_pages)
+        try:
+            return "".join(pages)
+        finally:
+            pages.close()
+
+
+class PdftotextExtractor(Extractor):
+    """ poppler's pdftotext, writing to stdout """
+
+    name = "pdftotext-1"
+
+    def pages(self, pdffile: str, timelimit: float, max_pages: int = None):
+        options = ["-l", str(max_pages)] if max_pages else []
+        return stream_command([PDFTOTEXT] + options + [pdffile, "-"], timelimit)
+
+
+class PDF2TXTExtractor(Extractor):
+    """
+    pdfminer.six's pdf2txt command line tool, writing to stdout
+
+    Parameters
+    ----------
+    all_texts : bool
+        Run the layout analysis on the text in figures as well (-A)
+    """
+
+    def __init__(self, all_texts: bool = False):
+        self.all_texts = all_texts
+        self.name = "pdf2txt-A-1" if all_texts else "pdf2txt-1"
+
+    def pages(self, pdffile: str, timelimit: float, max_pages: int = None):
+        options = (["-A"] if self.all_texts else []) + (["-m", str(max_pages)] if max_pages else [])
+        return stream_command([PDF2TXT] + options + [pdffile], timelimit)
+
+
+class PDFMinerExtractor(Extractor):
+    """
+    pdfminer.six's layout analysis in the current process. Gives the same text as the pdf2txt tool without
+    starting an interpreter for every PDF.
+
+    Parameters
+    ----------
+    all_texts : bool
+        Run the layout analysis on the text in figures as well
+    """
+
+    def __init__(self, all_texts: bool = False):
+        self.all_texts = all_texts
+        self.name = "pdfminer-A-1" if all_texts else "pdfminer-1"
+
+    def pages(self, pdffile: str, timelimit: float, max_pages: int = None):
+        from pdfminer.converter import TextConverter
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+
+        # The same pipeline as pdfminer.high_level.extract_text(), with the output taken after every page
+        with time_limit(timelimit), open(pdffile, "rb") as f:
+            resources = PDFResourceManager(caching=True)
+            output = io.StringIO()
+            device = TextConverter(resources, output, laparams=LAParams(all_texts=self.all_texts))
+            interpreter = PDFPageInterpreter(resources, device)
+            try:
+                for page in PDFPage.get_pages(f, maxpages=max_pages or 0):
+                    interpreter.process_page(page)
+                    yield output.getvalue()
+                    output.seek(0)
+                    output.truncate()
+            finally:
+                device.close()
+
+
+class PDFiumExtractor(Extractor):
+    """ PDFium through the optional pypdfium2 package, in the current process """
+
+    name = "pypdfium2-1"
+
+    def pages(self, pdffile: str, timelimit: float, max_pages: int = None):
+        try:
+            import pypdfium2
+        except ImportError as e:
+            raise RuntimeError("The pypdfium2 extractor needs the pypdfium2 package: pip install pypdfium2") from e
+
+        with time_limit(timelimit):
+            pdf = pypdfium2.PdfDocument(pdffile)
+            try:
+                for index in range(min(len(pdf), max_pages or len(pdf))):
+                    page = pdf[index]
+                    textpage = page.get_textpage()
+                    text = textpage.get_text_range()
+                    textpage.close()
+                    page.close()
+                    yield text + "\x0c"
+            finally:
+                pdf.close()
+
+
+EXTRACTORS = {
+    "pdftotext": PdftotextExtractor(),
+    "pdf2txt": PDF2TXTExtractor(),
+    "pdf2txt-A": PDF2TXTExtractor(all_texts=True),
+    "pdfminer": PDFMinerExtractor(),
+    "pdfminer-A": PDFMinerExtractor(all_texts=True),
+    "pypdfium2": PDFiumExtractor(),
+}
+
+
+def parse_chain(chain) -> tuple:
+    """
+    Validate a chain of extractor names.
+
+    Parameters
+    ----------
+    chain : str or iterable of str
+        Extractor names, either as a sequence or comma-separated. None gives the default chain.
+
+    Returns
+    -------
+    chain : tuple of str
+    """
+    if chain is None:
+        return DEFAULT_CHAIN
+    if isinstance(chain, str):
+        chain = chain.split(",")
+    chain = tuple(name.strip() for name in chain if name.strip())
+    if not chain:
+        raise ValueError("The extractor chain is empty.")
+    for name in chain:
+        if name not in EXTRACTORS:
+            raise ValueError("Unknown extractor '{}'. Choose from {}.".format(name, ", ".join(EXTRACTORS)))
+    return chain
+
+
+def chain_name(chain, max_pages: int = None) -> str:
+    """ Name and version of every extractor in the chain and the page limit, e.g. for the extraction cache """
+    name = ">".join(EXTRACTORS[name].name for name in parse_chain(chain))
+    return "{}@{}pages".format(name, max_pages) if max_pages else name
@@ -0,0 +1,110 @@
+###############################################################################################################################
+#
+# Discovery of the PDFs of the local datasources.
+#
+# INFO: walk() streams the files of a directory tree with os.scandir, which returns the type of every entry with the
+#       directory listing, so only the matching files are stat'ed (once, for their size and modification time). The
+#       files are yielded while the walk goes on, so the conversion of a directory with millions of PDFs can start
+#       before the walk finishes (order "none", see ordered()). Hidden entries are skipped like glob does, and symlinked
+#       directories are not followed, so that links cannot make the walk loop.
+#
+###############################################################################################################################
+
+import os
+import re
+
+# Orders of the files: largest first (the slowest PDFs do not start at the end of a run), natural (numbers in the
+# paths are compared by value, so 9 comes before 10) and none (the order of the walk, streaming)
+ORDERS = ("largest", "natural", "none")
+
+RE_DIGITS = re.compile(r"(\d+)")
+
+
+def walk(directory: str, suffix=".pdf"):
+    """
+    Yield the files of a directory tree whose name ends with suffix, depth first in the order of the directory listings.
+
+    Parameters
+    ----------
+    directory : str
+        Root of the tree
+
+    suffix : str or tuple of str
+        File name suffix, e.g. ".pdf", or several of them
+
+    Yields
+    ------
+    path, size, mtime : str, int, float
+        Path of the file (below directory), its size in bytes and its modification time
+    """
+    stack = [directory]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as entries:
+                subdirectories = []
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.path)
+                        elif entry.name.endswith(suffix) and entry.is_file():
+                            stat = entry.stat()
+                            yield entry.path, stat.st_size, stat.st_mtime
+                    except OSError as e:
+                        # e.g. a broken symlink or a file that was deleted during the walk
+                        print("Skipping " + entry.path + ": " + str(e))
+        except OSError as e:
+            print("Skipping the directory " + current + ": " + str(e))
+            continue
+        # The first subdirectory of the listing is walked next
+        stack.extend(reversed(subdirectories))
+
+
+def natural_key(path: str) -> tuple:
+    """ Sort key of a path that compares the numbers in it by value: a9.pdf < a10.pdf """
+    parts = RE_DIGITS.split(path)
+    # Strings and numbers alternate, starting with a (possibly empty) string, so the keys of two paths always compare
+    parts[1::2] = [int(number) for number in parts[1::2]]
+    return tuple(parts)
+
+
+def ordered(files, order: str = "largest"):
+    """
+    Order the files of :func:`walk`.
+
+    Parameters
+    ----------
+    files : iterable of (str, int, float)
+        Files from :func:`walk`
+
+    order : str
+        One of ORDERS. "none" keeps the iterable as it is, the others read all files first.
+
+    Returns
+    -------
+    paths : list or iterator of str
+    """
+    if order == "none":
+        return (path for path, _, _ in files)
+    if order == "largest":
+        # Files of the same size by path, so that runs are reproducible
+        return [path for path, _, _ in sorted(files, key=lambda file: (-file[1], file[0]))]
+    if order == "natural":
+        return sorted((path for path, _, _ in files), key=natural_key)
+    raise ValueError("Unknown order '{}'. Choose one of {}.".format(order, ", ".join(ORDERS)))
+
+
+def document_id(path: str, directory: str) -> str:
+    """
+    The id of a document: its path relative to directory without the extension and with / as separator, so that
+    documents with the same name in different subdirectories keep different ids (papers/2021/a.pdf -> 2021/a).
+    """
+    relative = os.path.splitext(os.path.relpath(path, directory))[0]
+    return relative.replace(os.sep, "/")
+
+
+def contains_any(directory: str, suffix=".pdf") -> bool:
+    """ Whether the directory tree has at least one matching file, without walking all of it """
+    return next(walk(directory, suffix), None) is not None
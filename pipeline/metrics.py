@@ -0,0 +1,243 @@
+###############################################################################################################################
+#
+# Lightweight run metrics: per-stage timers, counters, latency histograms and bytes in/out.
+#
+# INFO: Everything is aggregated in the parent process. The workers measure their stages (extraction, unicode fixing,
+#       cleaning) themselves and send the timings back with every record, see observe_record(). Latencies go into
+#       log-scale histograms, so the memory use does not grow with the number of documents and the percentiles are
+#       accurate to a few percent. At the end of a run the metrics are written to a JSON report and optionally to a
+#       Prometheus text-format file (e.g. for the node_exporter textfile collector).
+#
+###############################################################################################################################
+
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram buckets: BUCKET_MIN seconds times powers of BUCKET_FACTOR, the last bucket is unbounded
+BUCKET_MIN = 1e-4
+BUCKET_FACTOR = 2 ** 0.25
+BUCKET_COUNT = 100
+
+PERCENTILES = (50, 95, 99)
+PROMETHEUS_PREFIX = "pubcrawl"
+
+
+class Histogram:
+    """ Latency histogram with fixed log-scale buckets """
+
+    def __init__(self):
+        self.buckets = [0] * (BUCKET_COUNT + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    @staticmethod
+    def bound(index: int) -> float:
+        """ Upper bound of a bucket """
+        return BUCKET_MIN * BUCKET_FACTOR ** index if index < BUCKET_COUNT else math.inf
+
+    def observe(self, value: float):
+        index = 0 if value <= BUCKET_MIN else min(BUCKET_COUNT, math.ceil(math.log(value / BUCKET_MIN, BUCKET_FACTOR)))
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """ The q-th percentile, linearly interpolated within its bucket """
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                lower = self.bound(index - 1) if index else 0.0
+                upper = min(self.bound(index), self.max)
+                lower = max(lower, self.min)
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.max
+
+
+class Stage:
+    """ Time, latency histogram and bytes of one pipeline stage """
+
+    def __init__(self):
+        self.histogram = Histogram()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def to_dict(self) -> dict:
+        histogram = self.histogram
+        stage = {
+            "count": histogram.count,
+            "seconds": round(histogram.sum, 6),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "per_second": round(histogram.count / histogram.sum, 3) if histogram.sum else None,
+            "max": round(histogram.max, 6),
+        }
+        for q in PERCENTILES:
+            stage["p{}".format(q)] = round(histogram.percentile(q), 6)
+        return stage
+
+
+class Metrics:
+    """ Thread-safe collection of the stages and counters of a run """
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, bytes_in: int = 0, bytes_out: int = 0):
+        """ Record one pass (usually one document) through a stage """
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = Stage()
+            entry = self.stages[stage]
+            entry.histogram.observe(seconds)
+            entry.bytes_in += bytes_in
+            entry.bytes_out += bytes_out
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self) -> dict:
+        with self._lock:
+            seconds = time.time() - self.started
+            documents = self.counters.get("documents", 0)
+            return {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "seconds": round(seconds, 3),
+                "documents_per_second": round(documents / seconds, 3) if seconds else None,
+                "counters": dict(self.counters),
+                "stages": {name: stage.to_dict() for name, stage in self.stages.items()},
+            }
+
+    def prometheus(self) -> str:
+        """ The metrics in the Prometheus text exposition format """
+        p = PROMETHEUS_PREFIX
+        lines = [
+            "# HELP {}_run_seconds Wall-clock time of the run".format(p),
+            "# TYPE {}_run_seconds gauge".format(p),
+            "{}_run_seconds {:.3f}".format(p, time.time() - self.started),
+        ]
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                lines += ["# TYPE {}_{}_total counter".format(p, name), "{}_{}_total {}".format(p, name, value)]
+
+            lines += ["# HELP {}_stage_seconds Latency per pass through a stage".format(p),
+                      "# TYPE {}_stage_seconds histogram".format(p)]
+            for name, stage in sorted(self.stages.items()):
+                histogram = stage.histogram
+                last = max((i for i, n in enumerate(histogram.buckets) if n), default=0)
+                cumulative = 0
+                for index in range(min(last + 1, BUCKET_COUNT)):
+                    cumulative += histogram.buckets[index]
+                    lines.append('{}_stage_seconds_bucket{{stage="{}",le="{:.6g}"}} {}'.format(p, name, histogram.bound(index), cumulative))
+                lines.append('{}_stage_seconds_bucket{{stage="{}",le="+Inf"}} {}'.format(p, name, histogram.count))
+                lines.append('{}_stage_seconds_sum{{stage="{}"}} {:.6f}'.format(p, name, histogram.sum))
+                lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(p, name, histogram.count))
+
+            for direction in ("in", "out"):
+                lines += ["# TYPE {}_stage_bytes_{}_total counter".format(p, direction)]
+                for name, stage in sorted(self.stages.items()):
+                    lines.append('{}_stage_bytes_{}_total{{stage="{}"}} {}'.format(p, direction, name, getattr(stage, "bytes_" + direction)))
+        return "\n".join(lines) + "\n"
+
+
+# The metrics of the current run
+_run = Metrics()
+
+
+def reset():
+    """ Start a new run """
+    global _run
+    _run = Metrics()
+
+
+def observe(stage: str, seconds: float, bytes_in: int = 0, bytes_out: int = 0):
+    _run.observe(stage, seconds, bytes_in=bytes_in, bytes_out=bytes_out)
+
+
+def count(name: str, n: int = 1):
+    _run.count(name, n)
+
+
+@contextmanager
+def timer(stage: str, bytes_in: int = 0):
+    """
+    Time the block as one pass through stage. The yielded dict can be used to set "bytes_in" and "bytes_out" once
+    they are known.
+    """
+    sizes = {"bytes_in": bytes_in, "bytes_out": 0}
+    start = time.perf_counter()
+    try:
+        yield sizes
+    finally:
+        _run.observe(stage, time.perf_counter() - start, bytes_in=sizes["bytes_in"], bytes_out=sizes["bytes_out"])
+
+
+def observe_record(record: dict):
+    """
+    Account a record of pipeline.pdf2txt.extract_clean(): the stage timings measured in the worker, the whole
+    conversion with PDF bytes in and text bytes out, and the document counters.
+    """
+    stats = record["stats"]
+    sizes = {"extract": (stats["pdf_bytes"], stats["raw_chars"]), "clean": (stats["raw_chars"], stats["chars"])}
+    for stage, seconds in stats.get("stages", {}).items():
+        bytes_in, bytes_out = sizes.get(stage, (0, 0))
+        observe(stage, seconds, bytes_in=bytes_in, bytes_out=bytes_out)
+    observe("convert", stats["seconds"], bytes_in=stats["pdf_bytes"], bytes_out=stats["chars"])
+    count("documents")
+    if record["text"] is None:
+        count("failed_documents")
+
+
+def track(records, progress=None):
+    """
+    Pass records through while observing each one (see :func:`observe_record`) and advancing the progress callback.
+    """
+    for record in records:
+        observe_record(record)
+        if progress is not None:
+            progress()
+        yield record
+
+
+def report() -> dict:
+    return _run.report()
+
+
+def write_report(path: str) -> dict:
+    """ Write the JSON run report and return it """
+    run_report = _run.report()
+    with open(path, "w") as f:
+        json.dump(run_report, f, indent=2)
+    return run_report
+
+
+def write_prometheus(path: str):
+    with open(path, "w") as f:
+        f.write(_run.prometheus())
+
+
+def print_summary(run_report: dict = None):
+    """ Print a table of the stages """
+    run_report = run_report or _run.report()
+    print("{:<12} {:>9} {:>10} {:>10} {:>10} {:>10} {:>12} {:>12}".format(
+        "stage", "count", "seconds", "p50 [ms]", "p95 [ms]", "p99 [ms]", "MB in", "MB out"))
+    for name, stage in run_report["stages"].items():
+        print("{:<12} {:>9} {:>10.2f} {:>10.1f} {:>10.1f} {:>10.1f} {:>12.2f} {:>12.2f}".format(
+            name, stage["count"], stage["seconds"], stage["p50"] * 1000, stage["p95"] * 1000, stage["p99"] * 1000,
+            stage["bytes_in"] / 1e6, stage["bytes_out"] / 1e6))
+    print("{} documents in {:.1f} s ({} docs/s).".format(
+        run_report["counters"].get("documents", 0), run_report["seconds"], run_report["documents_per_second"]))
@@ -1,16 +1,10 @@
-import pandas as pd
 import os
 import re
-import glob
-import shlex
-from functools import partial
-import nltk
-nltk.download('words', quiet=True)
-words = set(nltk.corpus.words.words())
-
-from subprocess import check_call, CalledProcessError, TimeoutExpired, PIPE
+import time
 
 from helpers import fixunicode
+from pipeline import cache as text_cache
+from pipeline import dedup, extractors, vocabulary
 
 TIMELIMIT = 2*60
 STAMP_SEARCH_LIMIT = 1000
@@ -20,131 +14,78 @@ PDFTOTEXT = 'pdftotext'
 
 RE_REPEATS = r'(\(cid:\d+\)|lllll|\.\.\.\.\.|\*\*\*\*\*)'
 
+# Name of the cleaning routine in the extraction cache. Bump the version when the output changes.
+CLEANER = 'cleaned_text-1'
+# Texts with a longer average word length are glued together and the next extractor of the chain is tried
+MAX_WORD_LENGTH = 45
+# Texts with a larger share of characters in RE_REPEATS runs, e.g. (cid:NN) glyphs, are garbage as well
+MAX_REPEAT_SHARE = 0.3
+# Number of pages after which an extraction is abandoned when its text is garbage or (nearly) empty
+QUALITY_PAGES = 3
+MIN_QUALITY_WORDS = 10
+
+RE_REPEATED_GLYPHS = re.compile(RE_REPEATS)
+
+# Everything up to the first (and, if it is on the same line, the second) "Introduction"
+RE_INTRODUCTION = re.compile(r'(?i)^.*?introduction(?:.*?introduction)?')
+# Whitespace runs that are not already a single space
+RE_WHITESPACE = re.compile(r'\s{2,}|[^\S ]')
+RE_BRACKETS_DIGITS = re.compile(r'[()\[\]{}\d]+')
+RE_HYPERLINKS = re.compile(r'https?://\S+')
+RE_DASH_SPACE = re.compile(r'-\s+')
+RE_NON_ASCII = re.compile(r'[^\x00-\x7F]+')
+RE_SINGLE_CHARACTERS = re.compile(r' +[a-zA-Z] +')
+# Spaces next to anything but a letter or a number
+RE_SPACES_AT_SYMBOLS = re.compile(r'(?<=[^a-zA-Z0-9 ]) +| +(?=[^a-zA-Z0-9 ])')
+RE_MULTIPLE_SPACES = re.compile(r'  +')
+RE_REPEATED_CHARACTERS = re.compile(r'([a-zA-Z0-9])\1\1\1+')
+# A run of punctuation marks is replaced by its last mark and a space
+RE_PUNCTUATION = re.compile(r'[^ a-zA-Z0-9]*([^ a-zA-Z0-9])')
+RE_WORDPUNCT = re.compile(r'\w+|[^\w\s]+')
+
 
 def cleaned_text(text):
     """
-    Clean the text of the PDFs by removing several things
-    """
-    # Find the first appearance of the word "Introduction" and delete everything before it. Make it case insensitive.
-    text = re.sub(r'(?i)^(.*?Introduction)', '', text)
-    text = re.sub(r'(?i)^(.*?INTRODUCTION)', '', text)
-
-    # Clean the text
-    text = re.sub(r'\s+', ' ', text)
-
-    # Remove every parenthesis, square bracket, and curly bracket
-    text = re.sub(r'[\(\)\[\]\{\}]', '', text)
-
-    # Remove special characters
-    # text = re.sub(r'[^a-zA-Z0-9\s]', '', text)
-
-    # Remove all numbers from the text
-    text = re.sub(r'\d+', '', text)
-
-    # Remove hyperlinks from the text
-    text = re.sub(r'https?://\S+', '', text)
-
-    # Remove all tokens that have a backslash in them
-    text = re.sub(r'\\', '', text)
-
-    # If a word has a dash followed by a space at the end, remove the dash and the space
-    text = re.sub(r'-\s+', '', text)
-
-    # Remove unusual brackets
-    # text = re.sub(r'\[.*?\]', '', text)
-    # text = re.sub(r'\{.*?\}', '', text)
-
-    # Remove all non-ASCII characters
-    text = re.sub(r'[^\x00-\x7F]+', '', text)
-
-    # Remove single characters
-    text = re.sub(r'\s+[a-zA-Z]\s+', '', text)
-
-    # Remove all equation characters like $, \, ^, _, =, etc.
-    text = re.sub(r'\\[a-zA-Z0-9]+', '', text)
-
-    # Remove all spaces that are not followed by a number or a letter
-    text = re.sub(r'\s+(?=[^a-zA-Z0-9])', '', text)
+    Clean the text of the PDFs by removing several things.
 
-    # Remove all spaces that are not preceded by a number or a letter
-    text = re.sub(r'(?<=[^a-zA-Z0-9])\s+', '', text)
+    The steps are applied in a fixed order, and each step only runs when the text can contain what it removes:
 
-    # Remove all spaces that are not preceded or followed by a number or a letter
-    text = re.sub(r'(?<=[^a-zA-Z0-9])\s+(?=[^a-zA-Z0-9])', '', text)
-
-    # Remove repeated characters
-    text = re.sub(r'([a-zA-Z0-9])\1{3,}', r'\1', text)
-
-    # Remove repeated punctuation marks
-    text = re.sub(r'([^\s\w]|_)\1{3,}', r'\1', text)
-
-    # Insert space after every punctuation mark
-    text = re.sub(r'([^\s\w]|_)+', r'\1 ', text)
-
-    # Delete equal signs
-    text = re.sub(r'=', '', text)
-
-    # Insert space before ( and [ if it is not preceded by a space
-    # text = re.sub(r'(?<!\s)(\(|\[)', r' \1', text)
-
-    # Insert space after ) and ] if it is directly followed by a number or a letter
-    # text = re.sub(r'(\)|\])(?=[a-zA-Z0-9])', r'\1 ', text)
-
-    # Remove every word that has \ in it
-    text = re.sub(r'\w*\\+\w*', '', text)
-
-    # Remove single characters that are followed by a ,
-    text = re.sub(r'\s+[a-zA-Z]\s+,', '', text)
-
-    # Remove all non-english words
-    text = " ".join(w for w in nltk.wordpunct_tokenize(text) if w.lower() in words or not w.isalpha())
-
-    # Remove all leading and trailing spaces from the text
-    text = text.strip()
-
-    # Remove punctuation
-    # translator = str.maketrans('', '', string.punctuation)
-    # text = text.translate(translator)
-
-    return text
-
-def sorted_files(globber: str):
+        - delete everything before "Introduction" (if it is on the first line)
+        - collapse whitespace, delete brackets, numbers, hyperlinks, backslashes and hyphenation
+        - delete non-ASCII characters and single characters surrounded by spaces
+        - delete spaces next to symbols, collapse repeated characters and put a space after punctuation
+        - delete equal signs and all non-english words
     """
-    Give a globbing expression of files to find. They will be sorted upon
-    return.  This function is most useful when sorting does not provide
-    numerical order,
+    text = RE_INTRODUCTION.sub('', text, count=1)
 
-    e.g.:
-        9 -> 12 returned as 10 11 12 9 by string sort
+    # From here on, every whitespace character is a plain space
+    text = RE_WHITESPACE.sub(' ', text)
 
-    In this case use num_sort=True, and it will be sorted by numbers in the
-    string, then by the string itself.
+    text = RE_BRACKETS_DIGITS.sub('', text)
 
-    Parameters
-    ----------
-    globber : str
-        Expression on which to search for files (bash glob expression)
+    if '://' in text:
+        text = RE_HYPERLINKS.sub('', text)
+    text = text.replace('\\', '')
+    if '-' in text:
+        text = RE_DASH_SPACE.sub('', text)
+    if not text.isascii():
+        text = RE_NON_ASCII.sub('', text)
 
+    text = RE_SINGLE_CHARACTERS.sub('', text)
+    text = RE_SPACES_AT_SYMBOLS.sub('', text)
+    text = RE_MULTIPLE_SPACES.sub(' ', text)
 
-    """
-    files = glob.glob(globber, recursive = True) # return a list of path, including sub directories
-    files.sort()
-
-    allfiles = []
+    text = RE_REPEATED_CHARACTERS.sub(r'\1', text)
+    text = RE_PUNCTUATION.sub(r'\1 ', text)
+    text = text.replace('=', '')
 
-    for fn in files:
-        nums = re.findall(r'\d+', fn) # regular expression, find number in path names
-        data = [str(int(n)) for n in nums] + [fn]
-        # a list of [first number, second number,..., filename] in string format otherwise sorted fill fail
-        allfiles.append(data) # list of list
+    # Tokenize once and look up every distinct word only once, in one batch, to remove all non-english words
+    tokens = RE_WORDPUNCT.findall(text)
+    rejected = vocabulary.unknown([w for w in set(tokens) if w.isalpha()])
+    if rejected:
+        tokens = [w for w in tokens if w not in rejected]
 
-    allfiles = sorted(allfiles)
-    return [f[-1] for f in allfiles] # sorted filenames
-
-def reextension(filename: str, extension: str) -> str:
-    """ Give a filename a new extension """
-    name, _ = os.path.splitext(filename)
-    return '{}.{}'.format(name, extension)
+    return " ".join(tokens)
 
 def average_word_length(txt):
     """
@@ -166,15 +107,12 @@ def average_word_length(txt):
     return avgw
 
 
-def process_timeout(cmd, timeout):
-    return check_call(cmd, timeout=timeout, stdout=PIPE, stderr=PIPE)
-
 # ============================================================================
 #  functions for calling the text extraction services
 # ============================================================================
-def run_pdf2txt(pdffile: str, timelimit: int=TIMELIMIT, options: str=''):
+def run_pdftotext(pdffile: str, timelimit: int = TIMELIMIT) -> str:
     """
-    Run pdf2txt to extract full text
+    Run pdftotext on PDF file for extracted plain text
 
     Parameters
     ----------
@@ -189,84 +127,70 @@ def run_pdf2txt(pdffile: str, timelimit: int=TIMELIMIT, options: str=''):
     output : str
         Full plain text output
     """
-    # print('Running {} on {}'.format(PDF2TXT, pdffile))
-    tmpfile = reextension(pdffile, 'pdf2txt')
-
-    cmd = '{cmd} {options} -o "{output}" "{pdf}"'.format(
-        cmd=PDF2TXT, options=options, output=tmpfile, pdf=pdffile
-    )
-    cmd = shlex.split(cmd)
-    output = process_timeout(cmd, timeout=timelimit)
+    return extractors.EXTRACTORS['pdftotext'].extract(pdffile, timelimit)
 
-    with open(tmpfile) as f:
-        return f.read()
 
-
-def run_pdftotext(pdffile: str, timelimit: int = TIMELIMIT) -> str:
+class PageQuality:
     """
-    Run pdftotext on PDF file for extracted plain text
-
-    Parameters
-    ----------
-    pdffile : str
-        Path to PDF file
-
-    timelimit : int
-        Amount of time to wait for the process to complete
-
-    Returns
-    -------
-    output : str
-        Full plain text output
+    Rolling quality estimate of the pages extracted so far: the average word length and the share of characters in
+    runs like (cid:NN), lllll or ***** (see RE_REPEATS).
     """
-    # print('Running {} on {}'.format(PDFTOTEXT, pdffile))
-    tmpfile = reextension(pdffile, 'pdftotxt')
 
-    cmd = '{cmd} "{pdf}" "{output}"'.format(
-        cmd=PDFTOTEXT, pdf=pdffile, output=tmpfile
-    )
-    cmd = shlex.split(cmd)
-    output = process_timeout(cmd, timeout=timelimit)
+    def __init__(self):
+        self.pages = 0
+        self.chars = 0
+        self.words = 0
+        self.repeats = 0
 
-    with open(tmpfile) as f:
-        return f.read()
-    
-def run_pdf2txt_A(pdffile: str, **kwargs) -> str:
-    """
-    Run pdf2txt with the -A option which runs 'positional analysis on images'
-    and can return better results when pdf2txt combines many words together.
+    def add(self, page: str):
+        self.pages += 1
+        self.chars += len(page)
+        self.words += len(page.split())
+        self.repeats += sum(len(run) for run in RE_REPEATED_GLYPHS.findall(page))
 
-    Parameters
-    ----------
-    pdffile : str
-        Path to PDF file
+    def word_length(self) -> float:
+        return self.chars / (self.words + 1)
 
-    kwargs : dict
-        Keyword arguments to :func:`run_pdf2txt`
+    def repeat_share(self) -> float:
+        return self.repeats / self.chars if self.chars else 0.0
 
-    Returns
-    -------
-    output : str
-        Full plain text output
-    """
-    return run_pdf2txt(pdffile, options='-A', **kwargs)
+    def is_garbage(self) -> bool:
+        return self.word_length() > MAX_WORD_LENGTH or self.repeat_share() > MAX_REPEAT_SHARE
+
+    def is_empty(self) -> bool:
+        return self.words < MIN_QUALITY_WORDS
 
 # ============================================================================
 #  main function which extracts text
 # ============================================================================
-def fulltext(pdffile: str, timelimit: int = TIMELIMIT):
+def fulltext(pdffile: str, timelimit: int = TIMELIMIT, extractor_chain=extractors.DEFAULT_CHAIN, max_pages: int = None,
+             timings: dict = None):
     """
     Given a pdf file, extract the unicode text and run through very basic
     unicode normalization routines. Determine the best extracted text and
     return as a string.
 
+    The extractors of the chain are tried in order. The text is extracted
+    page by page: after QUALITY_PAGES pages an extractor is abandoned when
+    its text so far is garbage (see :class:`PageQuality`) or empty, and the
+    next extractor is tried. The complete text is checked again at the end.
+
     Parameters
     ----------
     pdffile : str
         Path to PDF file from which to extract text
 
     timelimit : int
-        Time in seconds to allow the extraction routines to run
+        Time in seconds to allow each extraction routine to run
+
+    extractor_chain : iterable of str
+        Names of the extractors in :data:`pipeline.extractors.EXTRACTORS`
+
+    max_pages : int
+        Only extract the first max_pages pages (all if None)
+
+    timings : dict
+        Optional dict to which the seconds spent in the "extract" and "fix_unicode" stages are added
 
     Returns
     -------
@@ -279,79 +203,184 @@ def fulltext(pdffile: str, timelimit: int = TIMELIMIT):
     if os.stat(pdffile).st_size == 0:  # file is empty
         raise RuntimeError('"{}" is an empty file'.format(pdffile))
 
-    try:
-        output = run_pdftotext(pdffile, timelimit=timelimit)
-        #output = run_pdf2txt(pdffile, timelimit=timelimit)
-    except (TimeoutExpired, CalledProcessError, RuntimeError, OSError) as e:
-        output = run_pdf2txt(pdffile, timelimit=timelimit)
-        #output = run_pdftotext(pdffile, timelimit=timelimit)
-
-    output = fixunicode.fix_unicode(output)
-    #output = stamp.remove_stamp(output, split=STAMP_SEARCH_LIMIT)
-    wordlength = average_word_length(output)
+    if timings is None:
+        timings = {}
 
-    if wordlength <= 45:
+    errors = []
+    for name in extractor_chain:
+        pages = extractors.EXTRACTORS[name].pages(pdffile, timelimit, max_pages=max_pages)
+        quality = PageQuality()
+        output = []
+        start = time.perf_counter()
         try:
-            os.remove(reextension(pdffile, 'pdftotxt'))  # remove the tempfile
-        except OSError:
-            pass
-
-        return output
-
-    output = run_pdf2txt_A(pdffile, timelimit=timelimit)
-    output = fixunicode.fix_unicode(output)
-    #output = stamp.remove_stamp(output, split=STAMP_SEARCH_LIMIT)
-    wordlength = average_word_length(output)
+            for page in pages:
+                output.append(page)
+                quality.add(page)
+                if quality.pages == QUALITY_PAGES and (quality.is_garbage() or quality.is_empty()):
+                    raise RuntimeError('rejected after {} pages'.format(QUALITY_PAGES))
+        except Exception as e:
+            errors.append('{}: {}'.format(name, e))
+            continue
+        finally:
+            pages.close()
+            timings['extract'] = timings.get('extract', 0.0) + time.perf_counter() - start
+
+        start = time.perf_counter()
+        output = fixunicode.fix_unicode(''.join(output))
+        timings['fix_unicode'] = timings.get('fix_unicode', 0.0) + time.perf_counter() - start
+        #output = stamp.remove_stamp(output, split=STAMP_SEARCH_LIMIT)
+        if average_word_length(output) <= MAX_WORD_LENGTH and quality.repeat_share() <= MAX_REPEAT_SHARE:
+            return output
+        errors.append('{}: text is not accurate'.format(name))
+
+    raise RuntimeError(
+        'No accurate text could be extracted from "{}" ({})'.format(pdffile, '; '.join(errors))
+    )
 
-    if wordlength > 45:
-        raise RuntimeError(
-            'No accurate text could be extracted from "{}"'.format(pdffile)
-        )
 
+def failed_record(pdffile: str, error: str) -> dict:
+    """ Record in the format of :func:`extract_clean` for a PDF whose worker timed out or crashed """
+    print("Conversion failed for '%s': %s" % (pdffile, error))
+    record = {"path": pdffile, "text": None, "error": error, "stats": {"pdf_bytes": 0, "raw_chars": 0, "chars": 0, "seconds": 0.0, "cache": None, "stages": {}}}
     try:
-        os.remove(reextension(pdffile, 'pdftotxt'))  # remove the tempfile
+        record["stats"]["pdf_bytes"] = os.path.getsize(pdffile)
     except OSError:
         pass
+    return record
 
-    return output
 
-def convert(path: str, skipconverted=True, timelimit: int = TIMELIMIT) -> str:
+def extract_clean(pdffile: str, timelimit: int = TIMELIMIT, cache_path: str = None, cache_size: int = text_cache.MAX_SIZE,
+                  extractor_chain=extractors.DEFAULT_CHAIN, max_pages: int = None, minhash: bool = False) -> dict:
     """
-    Convert a single PDF to text.
+    Worker stage that extracts the text of a single PDF, fixes its unicode and cleans it in one go, so that the
+    parent process only has to collect the results. Never fails.
 
     Parameters
     ----------
-    path : str
-        Location of a PDF file.
+    pdffile : str
+        Path to PDF file
 
-    skipconverted : boolean
-        Skip conversion when there is a text file already
+    timelimit : int
+        Time in seconds to allow the extraction routines to run
+
+    cache_path : str
+        Optional SQLite file of the extraction cache (see :mod:`pipeline.cache`). The raw and the cleaned text are
+        looked up by the hash of the PDF before anything is extracted.
+
+    cache_size : int
+        Size limit of the extraction cache in bytes
+
+    extractor_chain : iterable of str
+        Extractors to try in order, see :func:`fulltext`
+
+    max_pages : int
+        Only extract the first max_pages pages (all if None)
+
+    minhash : bool
+        Add the MinHash "signature" of the cleaned text for the near-duplicate detection (see :mod:`pipeline.dedup`)
 
     Returns
     -------
-    str
-        Location of text file.
+    record : dict
+        "path" of the PDF, cleaned "text" (None if the extraction failed), "error" message and "stats" with the
+        PDF size in bytes, the number of raw and cleaned characters, the seconds spent, the "cache" outcome
+        ("hit", "raw_hit", "miss" or None without cache) and the seconds per "stages" (cache, extract,
+        fix_unicode, clean, minhash) for the metrics of the parent process
     """
-    if not os.path.exists(path):
-        raise RuntimeError('No such path: %s' % path)
-    outpath = reextension(path, 'txt')
-
-    if os.path.exists(outpath):
-        return outpath
-
+    start = time.time()
+    record = {"path": pdffile, "text": None, "error": None, "stats": {"pdf_bytes": 0, "raw_chars": 0, "chars": 0, "seconds": 0.0, "cache": None, "stages": {}}}
+    stages = record["stats"]["stages"]
     try:
-        content = fulltext(path, timelimit)
-        with open(outpath, 'w') as f:
-            f.write(content)
+        record["stats"]["pdf_bytes"] = os.path.getsize(pdffile)
+
+        store = digest = raw = text = None
+        extractor = extractors.chain_name(extractor_chain, max_pages=max_pages)
+        if cache_path is not None:
+            lookup = time.perf_counter()
+            store = text_cache.open_cache(cache_path, max_size=cache_size)
+            digest = text_cache.hash_file(pdffile)
+            text = store.get(digest, extractor + '+' + CLEANER, 'cleaned')
+            if text is None:
+                raw = store.get(digest, extractor, 'raw')
+            record["stats"]["cache"] = "hit" if text is not None else "raw_hit" if raw is not None else "miss"
+            stages["cache"] = time.perf_counter() - lookup
+
+        if text is None:
+            if raw is None:
+                raw = fulltext(pdffile, timelimit, extractor_chain=extractor_chain, max_pages=max_pages, timings=stages)
+                if store is not None:
+                    store.put(digest, extractor, 'raw', raw)
+            clean = time.perf_counter()
+            text = cleaned_text(raw)
+            stages["clean"] = time.perf_counter() - clean
+            if store is not None:
+                store.put(digest, extractor + '+' + CLEANER, 'cleaned', text)
+            record["stats"]["raw_chars"] = len(raw)
+
+        record["text"] = text
+        record["stats"]["chars"] = len(text)
+
+        if minhash:
+            signing = time.perf_counter()
+            record["signature"] = dedup.signature(text)
+            stages["minhash"] = time.perf_counter() - signing
     except Exception as e:
-        msg = "Conversion failed for '%s': %s"
-        print(msg % (path, e))
-        raise RuntimeError(msg % (path, e)) from e
-    return outpath
+        record["error"] = str(e)
+        print("Conversion failed for '%s': %s" % (pdffile, e))
+    record["stats"]["seconds"] = time.time() - start
+    return record
 
-def convert_safe(pdffile: str, timelimit: int = TIMELIMIT):
-    """ Conversion function that never fails """
-    try:
-        convert(pdffile, timelimit=timelimit)
-    except Exception as e:
-        print("Conversion failed for '%s': %s" % (pdffile, e))
\ No newline at end of file
+
+def extract_and_remove(pdffile, timelimit=TIMELIMIT, remove_pdf=True, cache_path=None, cache_size=text_cache.MAX_SIZE, extractor_chain=extractors.DEFAULT_CHAIN, max_pages=None, minhash=False):
+    """
+    Worker stage: extract, fix and clean the text of a single PDF and delete the PDF afterwards. Never fails.
+
+    Parameters
+    ----------
+    pdffile : str
+        Path to the PDF file
+
+    timelimit : int
+        Time in seconds to allow the extraction routines to run
+
+    remove_pdf : bool
+        Delete the PDF once its text is extracted
+
+    cache_path : str
+        Optional SQLite file of the extraction cache
+
+    cache_size : int
+        Size limit of the extraction cache in bytes
+
+    extractor_chain : iterable of str
+        Extractors to try in order, see :func:`pipeline.pdf2txt.fulltext`
+
+    max_pages : int
+        Only extract the first max_pages pages of every PDF (all if None)
+
+    minhash : bool
+        Add the MinHash signature of the text, see :func:`pipeline.pdf2txt.extract_clean`
+
+    Returns
+    -------
+    record : dict
+        See :func:`pipeline.pdf2txt.extract_clean`
+    """
+    record = extract_clean(pdffile, timelimit=timelimit, cache_path=cache_path, cache_size=cache_size, extractor_chain=extractor_chain, max_pages=max_pages, minhash=minhash)
+    if remove_pdf:
+        try:
+            os.remove(pdffile)
+        except OSError:
+            pass
+    return record
+
+
+def extraction_failed(pdffile, error, remove_pdf=True):
+    """ Record for a PDF whose worker timed out or crashed. The PDF is deleted like in :func:`extract_and_remove`. """
+    record = failed_record(pdffile, error)
+    if remove_pdf:
+        try:
+            os.remove(pdffile)
+        except OSError:
+            pass
+    return record
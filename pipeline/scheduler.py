@@ -0,0 +1,290 @@
+###############################################################################################################################
+#
+# Worker pool for the PDF conversion of all datasources.
+#
+# INFO: Unlike multiprocessing.Pool, every worker process has its own pipe to the parent, so a single task can be killed
+#       when it exceeds its wall-clock limit and a worker that crashes (e.g. a segfault in an extractor) only loses the
+#       task it was working on. Dead and killed workers are replaced automatically, and every worker is recycled after
+#       maxtasksperchild tasks to limit memory creep. Results are yielded in the order they finish.
+#
+###############################################################################################################################
+
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+# Number of cores that are left to the parent process and the downloads
+WORKER_RESERVE = 2
+# Hard wall-clock limit per task in seconds
+TASK_TIMEOUT = 10 * 60
+MAXTASKSPERCHILD = 200
+# Interval in seconds in which the parent checks for new tasks while the task source is not exhausted
+POLL_INTERVAL = 0.05
+# Number of timed out / failed tasks that are listed in the report
+REPORT_LIMIT = 20
+# The parent runs threads (task feeder, downloads) while it starts workers, which a plain fork would copy mid-state
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+_EXHAUSTED = object()
+
+
+def default_workers() -> int:
+    """ All cores but WORKER_RESERVE, and at least one """
+    return max(1, (os.cpu_count() or 1) - WORKER_RESERVE)
+
+
+def _work(function, conn):
+    """ Worker loop: receive a chunk of tasks, send back one (ok, result) message per task """
+    if hasattr(os, "setpgid"):
+        # Own process group, so that a kill also reaches the extractor subprocesses
+        os.setpgid(0, 0)
+    # Interrupts are handled by the parent, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        while True:
+            try:
+                tasks = conn.recv()
+            except EOFError:
+                break
+            if tasks is None:
+                break
+            for task in tasks:
+                try:
+                    message = (True, function(task))
+                except Exception as e:
+                    message = (False, "{}: {}".format(type(e).__name__, e))
+                try:
+                    conn.send(message)
+                except (TypeError, AttributeError, ValueError) as e:  # result cannot be pickled
+                    conn.send((False, "Result cannot be sent: {}".format(e)))
+    finally:
+        conn.close()
+
+
+class _Worker:
+    """ A worker process, the tasks it was sent and when it started the current one """
+
+    def __init__(self, function, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_work, args=(function, child_conn), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = deque()
+        self.started = None
+        self.done = 0
+
+    def send(self, tasks: list):
+        self.tasks.extend(tasks)
+        self.started = time.monotonic()
+        self.conn.send(tasks)
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (AttributeError, OSError):
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self, timeout: float = 5):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class Scheduler:
+    """
+    Run a function over tasks in worker processes with a hard per-task timeout and crash isolation.
+
+    Parameters
+    ----------
+    function : callable
+        Picklable function of a single task, e.g. a module-level function or a functools.partial of one. The workers
+        are started with START_METHOD and import it afresh, so they do not see state that was only set in the parent.
+
+    workers : int
+        Number of worker processes. None means all cores but WORKER_RESERVE.
+
+    chunksize : int
+        Number of tasks that are sent to a worker at once. The timeout still applies to every single task.
+
+    task_timeout : float
+        Wall-clock limit in seconds per task. The worker is killed and replaced when a task exceeds it. None means no
+        limit.
+
+    maxtasksperchild : int
+        Number of tasks after which a worker is replaced by a fresh process. None means never.
+
+    on_failure : callable
+        Optional on_failure(task, error) that returns a substitute result for a task that raised, timed out or crashed
+        its worker. Without it, such tasks yield nothing.
+    """
+
+    def __init__(self, function, workers: int = None, chunksize: int = 1, task_timeout: float = TASK_TIMEOUT,
+                 maxtasksperchild: int = MAXTASKSPERCHILD, on_failure=None):
+        self.function = function
+        self.workers = workers or default_workers()
+        self.chunksize = max(1, chunksize)
+        self.task_timeout = task_timeout
+        self.maxtasksperchild = maxtasksperchild
+        self.on_failure = on_failure
+        self.summary = {"done": 0, "failed": [], "timed_out": [], "crashed": [], "replaced": 0, "seconds": 0.0}
+        self._context = multiprocessing.get_context(START_METHOD)
+
+    def _fail(self, kind: str, task, error: str):
+        self.summary[kind].append(task)
+        if self.on_failure is not None:
+            return [self.on_failure(task, error)]
+        return []
+
+    def imap_unordered(self, tasks):
+        """
+        Yield the results of function(task) for all tasks as they finish.
+
+        Parameters
+        ----------
+        tasks : iterable
+            The tasks. They are consumed by a separate thread, so the iterable may block (e.g. iter(queue.get, None))
+            without holding up the results of running tasks.
+        """
+        start = time.time()
+        pending = queue.Queue()
+
+        def feed():
+            try:
+                for task in tasks:
+                    pending.put(task)
+            finally:
+                pending.put(_EXHAUSTED)
+
+        threading.Thread(target=feed, daemon=True).start()
+
+        workers = []
+        idle = deque()
+        backlog = deque()
+        exhausted = False
+
+        def take(block: bool = False):
+            """ The next chunk of tasks, requeued tasks first """
+            nonlocal exhausted
+            chunk = []
+            while backlog and len(chunk) < self.chunksize:
+                chunk.append(backlog.popleft())
+            while not exhausted and len(chunk) < self.chunksize:
+                try:
+                    task = pending.get(block=block and not chunk, timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    break
+                if task is _EXHAUSTED:
+                    exhausted = True
+                else:
+                    chunk.append(task)
+            return chunk
+
+        def retire(worker, kill: bool):
+            workers.remove(worker)
+            if kill:
+                worker.kill()
+                self.summary["replaced"] += 1
+            else:
+                worker.stop()
+
+        try:
+            while True:
+                # Hand out work to idle workers and start new ones up to the pool size
+                while idle or len(workers) < self.workers:
+                    busy = any(worker.tasks for worker in workers)
+                    chunk = take(block=not busy)
+                    if not chunk:
+                        break
+                    worker = idle.popleft() if idle else _Worker(self.function, self._context)
+                    if worker not in workers:
+                        workers.append(worker)
+                    try:
+                        worker.send(chunk)
+                    except OSError:
+                        # Died while idle, the tasks go to the next worker
+                        worker.tasks.clear()
+                        backlog.extendleft(reversed(chunk))
+                        retire(worker, kill=True)
+
+                busy = [worker for worker in workers if worker.tasks]
+                if not busy:
+                    if exhausted and not backlog:
+                        break
+                    continue
+
+                now = time.monotonic()
+                timeout = None
+                if self.task_timeout:
+                    timeout = max(0.0, min(worker.started for worker in busy) + self.task_timeout - now)
+                if not exhausted:
+                    timeout = POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL)
+                wait([worker.conn for worker in busy] + [worker.process.sentinel for worker in busy], timeout)
+
+                for worker in busy:
+                    results = []
+                    try:
+                        while worker.tasks and worker.conn.poll():
+                            ok, value = worker.conn.recv()
+                            task = worker.tasks.popleft()
+                            worker.done += 1
+                            worker.started = time.monotonic()
+                            if ok:
+                                self.summary["done"] += 1
+                                results.append(value)
+                            else:
+                                results += self._fail("failed", task, value)
+                    except (EOFError, OSError):
+                        pass
+
+                    if worker.tasks and not worker.process.is_alive():
+                        # The worker died on its current task, the rest of its chunk is requeued
+                        task = worker.tasks.popleft()
+                        results += self._fail("crashed", task, "Worker crashed (exit code {})".format(worker.process.exitcode))
+                        backlog.extendleft(reversed(worker.tasks))
+                        worker.tasks.clear()
+                        retire(worker, kill=True)
+                    elif worker.tasks and self.task_timeout and time.monotonic() - worker.started > self.task_timeout:
+                        task = worker.tasks.popleft()
+                        results += self._fail("timed_out", task, "Timed out after {} seconds".format(self.task_timeout))
+                        backlog.extendleft(reversed(worker.tasks))
+                        worker.tasks.clear()
+                        retire(worker, kill=True)
+                    elif not worker.tasks:
+                        if self.maxtasksperchild and worker.done >= self.maxtasksperchild:
+                            retire(worker, kill=False)
+                        else:
+                            idle.append(worker)
+
+                    yield from results
+        finally:
+            for worker in workers:
+                if worker.tasks:
+                    worker.kill()
+                else:
+                    worker.stop()
+            self.summary["seconds"] = time.time() - start
+
+    def report(self):
+        """ Print the number of finished tasks and the timed out, crashed and failed ones """
+        summary = self.summary
+        print("Processed {} files with {} workers in {:.1f} s ({} timed out, {} crashed a worker, {} failed, {} workers replaced).".format(
+            summary["done"], self.workers, summary["seconds"], len(summary["timed_out"]), len(summary["crashed"]),
+            len(summary["failed"]), summary["replaced"]))
+        for kind, label in (("timed_out", "Timed out"), ("crashed", "Crashed"), ("failed", "Failed")):
+            for task in summary[kind][:REPORT_LIMIT]:
+                print("  {}: {}".format(label, task))
+            if len(summary[kind]) > REPORT_LIMIT:
+                print("  ... and {} more.".format(len(summary[kind]) - REPORT_LIMIT))
@@ -0,0 +1,262 @@
+###############################################################################################################################
+#
+# Work queue of sharded crawls on several machines.
+#
+# INFO: The coordinator splits the metadata into shards and enqueues them in a SQLite file on storage that all machines
+#       share (see datasources.arxiv.coordinate()). Workers claim one shard at a time with a lease, which they renew
+#       while they work on it (see Heartbeat), and write a shard-local output (see datasources.arxiv.work()). The lease
+#       of a dead worker expires and its shard is claimed again by another worker, up to MAX_ATTEMPTS times. Claims are
+#       made in exclusive transactions, so a shard is only ever leased to one worker at a time.
+#
+#       The queue uses the rollback journal instead of WAL, which needs shared memory and so only works on one machine.
+#       The shared file system has to support POSIX locks (e.g. NFSv4).
+#
+###############################################################################################################################
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+QUEUE_FILE = "queue.sqlite"
+SHARDS_DIR = "shards"
+OUTPUT_DIR = "output"
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+# Number of shards of a crawl
+SHARDS = 64
+# Seconds after which the shard of a worker that stopped renewing its lease is claimed again
+LEASE = 10 * 60
+MAX_ATTEMPTS = 3
+# Seconds between two looks at the queue of a waiting worker or coordinator
+POLL_INTERVAL = 10
+
+# Condition of the shards that failed for good: they failed max_attempts times or their last lease expired. Parameters:
+# FAILED, LEASED, max_attempts, now.
+_GAVE_UP = "(status = ? OR (status = ? AND attempts >= ? AND lease_until < ?))"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    shard INTEGER PRIMARY KEY,
+    rows INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    output TEXT,
+    started REAL,
+    finished REAL
+);
+"""
+
+
+def worker_name() -> str:
+    """ Name of this process in the queue: host and process id """
+    return "{}-{}".format(socket.gethostname(), os.getpid())
+
+
+def shard_file(crawl_dir: str, shard: int) -> str:
+    """ Metadata of a shard, as line-delimited JSON """
+    return os.path.join(crawl_dir, SHARDS_DIR, "shard-{:05d}.json".format(shard))
+
+
+def output_file(crawl_dir: str, shard: int) -> str:
+    """ Output of a shard (without the compression suffix) """
+    return os.path.join(crawl_dir, OUTPUT_DIR, "shard-{:05d}.json".format(shard))
+
+
+class ShardQueue:
+    """
+    SQLite backed queue of the shards of a crawl with expiring leases. The object can be shared by the threads of a
+    process (e.g. the worker and its Heartbeat).
+
+    Parameters
+    ----------
+    path : str
+        SQLite file of the queue on shared storage. It is created if it does not exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Transactions are started explicitly, see _transaction()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=DELETE")
+        self._db.executescript(SCHEMA)
+
+    def _transaction(self, statement: str, parameters=()):
+        """ Run one statement in an exclusive transaction and return its cursor """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = self._db.execute(statement, parameters)
+            self._db.execute("COMMIT")
+            return cursor
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def add(self, rows: list):
+        """
+        Enqueue the shards of a crawl.
+
+        Parameters
+        ----------
+        rows : list of int
+            Number of metadata rows of every shard, the shards are numbered in this order
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany("INSERT INTO shards (shard, rows) VALUES (?, ?)", list(enumerate(rows)))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def claim(self, worker: str, lease: float = LEASE, max_attempts: int = MAX_ATTEMPTS):
+        """
+        Lease the next shard that is pending or whose lease expired.
+
+        Returns
+        -------
+        shard : int
+            Number of the shard, None if there is no shard to claim right now
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT shard FROM shards WHERE attempts < ? AND (status = ? OR (status = ? AND lease_until < ?)) "
+                    "ORDER BY shard LIMIT 1", (max_attempts, PENDING, LEASED, now)).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE shards SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1, started = ? WHERE shard = ?",
+                        (LEASED, worker, now + lease, now, row[0]))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return None if row is None else row[0]
+
+    def renew(self, shard: int, worker: str, lease: float = LEASE) -> bool:
+        """ Extend the lease of a shard. False if the worker does not hold it anymore. """
+        with self._lock:
+            cursor = self._transaction(
+                "UPDATE shards SET lease_until = ? WHERE shard = ? AND worker = ? AND status = ?",
+                (time.time() + lease, shard, worker, LEASED))
+            return cursor.rowcount == 1
+
+    def complete(self, shard: int, worker: str, output: str) -> bool:
+        """
+        Record the output of a finished shard, as its file name in the OUTPUT_DIR of the crawl (the machines may mount
+        the shared storage in different places). False if the worker does not hold the lease anymore, e.g. because it
+        expired and another worker claimed the shard, and the output must not be used.
+        """
+        with self._lock:
+            cursor = self._transaction(
+                "UPDATE shards SET status = ?, output = ?, error = NULL, finished = ? WHERE shard = ? AND worker = ? AND status = ?",
+                (DONE, output, time.time(), shard, worker, LEASED))
+            return cursor.rowcount == 1
+
+    def fail(self, shard: int, worker: str, error: str = None, max_attempts: int = MAX_ATTEMPTS):
+        """ Release a shard after a failed attempt. It is claimed again unless it failed max_attempts times. """
+        with self._lock:
+            self._transaction(
+                "UPDATE shards SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_until = NULL, error = ?, "
+                "finished = ? WHERE shard = ? AND worker = ? AND status = ?",
+                (max_attempts, FAILED, PENDING, error, time.time(), shard, worker, LEASED))
+
+    def counts(self) -> dict:
+        """ Number of shards per status. Shards whose lease expired max_attempts times count as failed. """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT CASE WHEN " + _GAVE_UP + " THEN ? ELSE status END, COUNT(*) FROM shards GROUP BY 1",
+                (FAILED, LEASED, MAX_ATTEMPTS, time.time(), FAILED)).fetchall()
+        return dict(rows)
+
+    def total(self) -> int:
+        return sum(self.counts().values())
+
+    def finished(self) -> bool:
+        """ Whether every shard is done or failed for good. False while the coordinator has not enqueued the shards. """
+        counts = self.counts()
+        return sum(counts.values()) > 0 and counts.get(DONE, 0) + counts.get(FAILED, 0) == sum(counts.values())
+
+    def outputs(self) -> list:
+        """ The paths of the outputs of the finished shards, in the order of the shards """
+        output_dir = os.path.join(os.path.dirname(self.path), OUTPUT_DIR)
+        with self._lock:
+            return [os.path.join(output_dir, row[0]) for row in self._db.execute("SELECT output FROM shards WHERE status = ? ORDER BY shard", (DONE,))]
+
+    def failed(self, max_attempts: int = MAX_ATTEMPTS) -> dict:
+        """ The last error of every shard that failed for good (None if its worker died) """
+        with self._lock:
+            return dict(self._db.execute(
+                "SELECT shard, error FROM shards WHERE " + _GAVE_UP + " ORDER BY shard", (FAILED, LEASED, max_attempts, time.time())))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Heartbeat:
+    """
+    Renew the lease of a shard in a background thread while the worker processes it, three times per lease.
+
+    Parameters
+    ----------
+    queue : ShardQueue
+
+    shard : int
+
+    worker : str
+
+    lease : float
+        Seconds of every renewal
+    """
+
+    def __init__(self, queue: ShardQueue, shard: int, worker: str, lease: float = LEASE):
+        self.queue = queue
+        self.shard = shard
+        self.worker = worker
+        self.lease = lease
+        # Set when the lease could not be renewed, e.g. because it expired and another worker claimed the shard
+        self.lost = False
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.lease / 3):
+            try:
+                if not self.queue.renew(self.shard, self.worker, self.lease):
+                    self.lost = True
+                    return
+            except sqlite3.Error as e:
+                # The shared storage may be unavailable for a moment, the next renewal tries again
+                print("Could not renew the lease of shard {}: {}".format(self.shard, e))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,158 @@
+###############################################################################################################################
+#
+# State of incremental crawls.
+#
+# INFO: A SQLite file records every paper (arXiv id and version) that went through the pipeline, the status it reached
+#       (downloaded, extracted, cleaned, written or failed) and when it reached each of them. A new run over a newer
+#       snapshot only processes the papers that are new or have a new version and appends them to the output, see
+#       datasources.arxiv.pending_papers(). Papers that failed are retried in later runs, up to MAX_ATTEMPTS times.
+#
+###############################################################################################################################
+
+import os
+import sqlite3
+import threading
+import time
+
+# The statuses of a paper in the order of the pipeline. Every status has a column with the time it was reached.
+STATUSES = ("downloaded", "extracted", "cleaned", "written")
+FAILED = "failed"
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    downloaded REAL,
+    extracted REAL,
+    cleaned REAL,
+    written REAL,
+    failed REAL,
+    PRIMARY KEY (id, version)
+);
+CREATE INDEX IF NOT EXISTS papers_status ON papers (status);
+"""
+
+# Position of a status in STATUSES, -1 for failed papers, so that a retry starts over
+_RANK = "CASE {} " + " ".join("WHEN '{}' THEN {}".format(status, rank) for rank, status in enumerate(STATUSES)) + " ELSE -1 END"
+
+
+class CrawlState:
+    """
+    SQLite backed record of the papers of incremental crawls. The object can be shared by the threads of the parent
+    process (e.g. the download thread and the thread that collects the texts).
+
+    Parameters
+    ----------
+    path : str
+        SQLite file of the state. It is created if it does not exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def mark(self, papers, status: str, when: float = None):
+        """
+        Record that papers reached a status. A paper never goes back to an earlier status, e.g. when it is downloaded
+        again after it was written, but the time of the status is still recorded.
+
+        Parameters
+        ----------
+        papers : iterable of (str, int)
+            Pairs of (id, version)
+
+        status : str
+            One of STATUSES
+
+        when : float
+            Time stamp of the status, now if None
+        """
+        if status not in STATUSES:
+            raise ValueError("Unknown status '{}'. Choose one of {}.".format(status, ", ".join(STATUSES)))
+        when = time.time() if when is None else when
+        rows = [(pdf_id, version, status, when) for pdf_id, version in papers]
+        if not rows:
+            return
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO papers (id, version, status, {0}) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (id, version) DO UPDATE SET status = CASE WHEN {1} >= {2} THEN excluded.status ELSE status END, "
+                "{0} = excluded.{0}".format(status, _RANK.format("excluded.status"), _RANK.format("papers.status")),
+                rows)
+
+    def fail(self, paper, error: str = None):
+        """ Record a failed attempt to process a paper, given as (id, version) """
+        pdf_id, version = paper
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO papers (id, version, status, attempts, error, failed) VALUES (?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT (id, version) DO UPDATE SET status = excluded.status, attempts = attempts + 1, "
+                "error = excluded.error, failed = excluded.failed",
+                (pdf_id, version, FAILED, error, time.time()))
+
+    def reached(self, status: str) -> dict:
+        """
+        The highest version of every id that reached status or a later one.
+
+        Returns
+        -------
+        versions : dict
+            Maps ids to versions
+        """
+        statuses = STATUSES[STATUSES.index(status):]
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, MAX(version) FROM papers WHERE status IN ({}) GROUP BY id".format(", ".join("?" * len(statuses))),
+                statuses).fetchall()
+        return dict(rows)
+
+    def given_up(self, max_attempts: int = MAX_ATTEMPTS) -> set:
+        """ The (id, version) pairs that failed max_attempts times and are not retried anymore """
+        with self._lock:
+            rows = self._db.execute("SELECT id, version FROM papers WHERE status = ? AND attempts >= ?", (FAILED, max_attempts)).fetchall()
+        return set(rows)
+
+    def pending(self, papers, status: str = "written", max_attempts: int = MAX_ATTEMPTS) -> list:
+        """
+        Which papers still have to be processed up to status: the ones whose id has not reached it with the same or a
+        higher version and that did not fail max_attempts times.
+
+        Parameters
+        ----------
+        papers : iterable of (str, int)
+            Pairs of (id, version)
+
+        Returns
+        -------
+        pending : list of bool
+        """
+        reached = self.reached(status)
+        given_up = self.given_up(max_attempts)
+        return [version > reached.get(pdf_id, -1) and (pdf_id, version) not in given_up for pdf_id, version in papers]
+
+    def counts(self) -> dict:
+        """ Number of papers per status """
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM papers GROUP BY status").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
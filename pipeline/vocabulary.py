@@ -0,0 +1,170 @@
+###############################################################################################################################
+#
+# English vocabulary of the text cleaning, see pipeline.pdf2txt.cleaned_text().
+#
+# INFO: The word list of the NLTK words corpus is compiled once into a frozen hash table on disk: the words as
+#       fixed-width byte strings, ordered by their 64-bit hash, and the sorted hashes. The workers memory-map both
+#       arrays, which takes milliseconds, and share their pages through the page cache instead of every worker building
+#       a Python set of the whole list. Words are looked up in batches (hash, binary search, compare) and the answers
+#       are memoized per process, since the same words come up in every paper. Only the parent process may download the
+#       corpus (see ensure()), the workers never touch the network.
+#
+###############################################################################################################################
+
+import os
+
+import numpy as np
+
+VOCABULARY_DIR = os.environ.get("PUBCRAWL_VOCABULARY", os.path.join(os.path.expanduser("~"), ".cache", "pubcrawl", "english_words"))
+CORPUS = "words"
+WORDS_FILE = "words.npy"
+HASHES_FILE = "hashes.npy"
+
+# Number of memoized lookups per process, the memo is cleared when it is full
+MEMO_SIZE = 1 << 18
+
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+_HASH_SHIFT = np.uint64(29)
+
+# The vocabulary of this process, see load()
+_vocabulary = None
+_memo = {}
+
+
+def _hashes(words: np.ndarray) -> np.ndarray:
+    """ 64-bit hashes of fixed-width byte strings whose width is a multiple of 8, over all columns at once """
+    columns = words.view(np.uint64).reshape(len(words), -1)
+    hashes = np.full(len(words), columns.shape[1], dtype=np.uint64)
+    for column in columns.T:
+        hashes ^= column
+        hashes *= _HASH_MULTIPLIER
+        hashes ^= hashes >> _HASH_SHIFT
+    return hashes
+
+
+def build(directory: str = VOCABULARY_DIR, download: bool = False, words: list = None):
+    """
+    Compile the NLTK words corpus (or another word list) into the vocabulary files.
+
+    Only the lowercase entries are kept: the words are looked up in lowercase, so the other entries can never match.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the vocabulary. Every file is replaced atomically, the hashes last, so that concurrent builds and
+        readers do not interfere.
+
+    download : bool
+        Download the corpus with nltk.download() if it is not installed
+
+    words : list of str
+        Optional word list that is compiled instead of the corpus
+
+    Returns
+    -------
+    words, hashes : np.ndarray
+        UTF-8 encoded words and their hashes, ordered by hash
+    """
+    if words is None:
+        import nltk
+
+        if download:
+            try:
+                nltk.data.find("corpora/" + CORPUS)
+            except LookupError:
+                nltk.download(CORPUS, quiet=True)
+        words = nltk.corpus.words.words()
+
+    encoded = {word.encode("utf-8") for word in words if word == word.lower()}
+    # Padded to whole 8-byte columns for the hash
+    width = max(8, -(-max(map(len, encoded), default=1) // 8) * 8)
+    words = np.array(sorted(encoded), dtype="S{}".format(width))
+    hashes = _hashes(words)
+    order = np.argsort(hashes, kind="stable")
+    words, hashes = words[order], hashes[order]
+    if len(hashes) > 1 and not (hashes[1:] != hashes[:-1]).all():
+        raise RuntimeError("Hash collision in the vocabulary.")
+
+    os.makedirs(directory, exist_ok=True)
+    for name, array in ((WORDS_FILE, words), (HASHES_FILE, hashes)):
+        path = os.path.join(directory, name)
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    return words, hashes
+
+
+def load(directory: str = VOCABULARY_DIR):
+    """
+    The memory-mapped vocabulary of this process, as (words, hashes). It is built from the installed corpus if the
+    files do not exist, but never downloaded.
+    """
+    global _vocabulary
+    if _vocabulary is None:
+        if not os.path.exists(os.path.join(directory, HASHES_FILE)):
+            build(directory)
+        _vocabulary = (np.load(os.path.join(directory, WORDS_FILE), mmap_mode="r"),
+                       np.load(os.path.join(directory, HASHES_FILE), mmap_mode="r"))
+    return _vocabulary
+
+
+def ensure(directory: str = VOCABULARY_DIR):
+    """ Build the vocabulary, downloading the corpus if needed, and load it. Call this before starting workers. """
+    if not os.path.exists(os.path.join(directory, HASHES_FILE)):
+        print("Building the English vocabulary in " + directory + ". This is only done once.")
+        build(directory, download=True)
+    return load(directory)
+
+
+def contains(words: list) -> np.ndarray:
+    """
+    Look up a batch of (lowercase) words in the vocabulary.
+
+    Parameters
+    ----------
+    words : list of str
+
+    Returns
+    -------
+    known : np.ndarray of bool
+        Whether each word is in the vocabulary
+    """
+    vocabulary, hashes = load()
+    known = np.zeros(len(words), dtype=bool)
+    if not words or not len(vocabulary):
+        return known
+
+    # Words that are wider than the entries cannot be in the vocabulary and would be truncated by the conversion
+    width = vocabulary.dtype.itemsize
+    encoded = [word.encode("utf-8") for word in words]
+    candidates = [i for i, word in enumerate(encoded) if len(word) <= width]
+    if not candidates:
+        return known
+    if len(candidates) < len(encoded):
+        encoded = [encoded[i] for i in candidates]
+    else:
+        candidates = slice(None)
+
+    queries = np.array(encoded, dtype=vocabulary.dtype)
+    positions = np.minimum(np.searchsorted(hashes, _hashes(queries)), len(hashes) - 1)
+    known[candidates] = vocabulary[positions] == queries
+    return known
+
+
+def unknown(words) -> set:
+    """
+    The words whose lowercase form is not in the vocabulary. Words that were not looked up in this process before are
+    looked up in one batch.
+
+    Parameters
+    ----------
+    words : list of str
+        Distinct words in any case
+    """
+    if len(_memo) > MEMO_SIZE:
+        _memo.clear()
+    misses = [word for word in words if word not in _memo]
+    if misses:
+        _memo.update(zip(misses, contains([word.lower() for word in misses]).tolist()))
+    return {word for word in words if not _memo[word]}
@@ -0,0 +1,330 @@
+###############################################################################################################################
+#
+# Streaming output writers. Records are written one by one as soon as they are ready, so the memory use of a run does
+# not grow with the number of documents.
+#
+# INFO: The default output is line-delimited JSON (JSONLWriter). With the Parquet format (ParquetWriter) the records are
+#       buffered and written in row groups of typed, compressed columns, so readers can load only the columns they need
+#       (e.g. the metadata without the texts) and memory map the file. The pyarrow import is deferred to the
+#       ParquetWriter, so that the workers and the command line do not pay for it.
+#
+###############################################################################################################################
+
+import gzip
+import json
+import os
+import time
+
+from pipeline import metrics
+
+# Number of records after which the output is flushed and synced to disk
+FSYNC_EVERY = 256
+
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+FORMATS = ("jsonl", "parquet")
+PARQUET_SUFFIX = ".parquet"
+# Codec of the Parquet columns when no compression is chosen
+PARQUET_COMPRESSION = "zstd"
+
+# A Parquet row group is written once it has ROW_GROUP_SIZE records or its texts reach ROW_GROUP_BYTES
+ROW_GROUP_SIZE = 1000
+ROW_GROUP_BYTES = 64 * 1024**2
+
+TEXT_COLUMN = "text"
+# Optional column of the Parquet outputs with the number of whitespace separated tokens of the text
+TOKENS_COLUMN = "tokens"
+
+
+def output_path(path: str, compression: str = None, output_format: str = "jsonl") -> str:
+    """
+    Append the file suffix of the compression to path. Parquet files compress their columns, so their path gets the
+    suffix .parquet instead of the extension of path (arxiv_fulltext.json -> arxiv_fulltext.parquet).
+    """
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError("Unknown compression '{}'. Choose one of gzip, zstd.".format(compression))
+    if output_format == "parquet":
+        return os.path.splitext(path)[0] + PARQUET_SUFFIX
+    if output_format != "jsonl":
+        raise ValueError("Unknown output format '{}'. Choose one of {}.".format(output_format, ", ".join(FORMATS)))
+    return path + COMPRESSION_SUFFIXES[compression]
+
+
+def format_of(path: str) -> str:
+    """ The format of an output file by its suffix """
+    return "parquet" if path.endswith(PARQUET_SUFFIX) else "jsonl"
+
+
+def compression_of(path: str) -> str:
+    """ The compression of an output file by its suffix, the inverse of :func:`output_path` """
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if compression is not None and path.endswith(suffix):
+            return compression
+    return None
+
+
+def _to_builtin(value):
+    """ json.dumps fallback for numpy arrays and scalars coming from pandas / pyarrow """
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+
+class JSONLWriter:
+    """
+    Append records to a line-delimited JSON file, optionally gzip or zstd compressed. The file is flushed and synced
+    every fsync_every records and on close.
+
+    Parameters
+    ----------
+    path : str
+        Output file (without the compression suffix, see :func:`output_path`)
+
+    compression : str
+        None, "gzip" or "zstd". zstd needs the zstandard package.
+
+    fsync_every : int
+        Number of records between two syncs
+
+    append : bool
+        Append to an existing file instead of replacing it. Compressed output is appended as a new gzip member or zstd
+        frame, which the decompressors read as one stream.
+    """
+
+    def __init__(self, path: str, compression: str = None, fsync_every: int = FSYNC_EVERY, append: bool = False):
+        self.path = output_path(path, compression)
+        self.fsync_every = fsync_every
+        self.count = 0
+
+        self._raw = open(self.path, "ab" if append else "wb")
+        if compression == "gzip":
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        elif compression == "zstd":
+            try:
+                import zstandard
+            except ImportError as e:
+                self._raw.close()
+                raise RuntimeError("zstd compression needs the zstandard package: pip install zstandard") from e
+            self._stream = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False)
+        else:
+            self._stream = self._raw
+
+    def write(self, record: dict):
+        start = time.perf_counter()
+        line = json.dumps(record, default=_to_builtin).encode("utf-8") + b"\n"
+        self._stream.write(line)
+        metrics.observe("write", time.perf_counter() - start, bytes_out=len(line))
+        self.count += 1
+        if self.count % self.fsync_every == 0:
+            self.sync()
+
+    def write_line(self, line: bytes):
+        """ Write a record that is already serialized, as one line of UTF-8 encoded JSON ending with a newline """
+        start = time.perf_counter()
+        self._stream.write(line)
+        metrics.observe("write", time.perf_counter() - start, bytes_out=len(line))
+        self.count += 1
+        if self.count % self.fsync_every == 0:
+            self.sync()
+
+    def sync(self):
+        if self._stream is not self._raw:
+            # Ends the current compressed block, so that everything written so far can be decompressed
+            self._stream.flush()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+
+    def close(self):
+        if self._raw.closed:
+            return
+        if self._stream is not self._raw:
+            # Writes the trailer of the compressed stream, the underlying file stays open
+            self._stream.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParquetWriter:
+    """
+    Write records to a Parquet file in row groups. The records are buffered until a row group is full (see
+    ROW_GROUP_SIZE and ROW_GROUP_BYTES), so at most one row group of texts is held in memory. The file can only be read
+    once it is closed, which writes its footer.
+
+    Parameters
+    ----------
+    path : str
+        Output file, its extension is replaced by .parquet (see :func:`output_path`)
+
+    schema : pyarrow.Schema
+        Typed columns of the records. Missing fields are written as null. Dates and numbers may be given as strings,
+        they are parsed by Arrow (e.g. "2021-03-04" for a date32 column), values that do not parse are written as null.
+
+    compression : str
+        Codec of the columns: "zstd" (None, the default) or "gzip"
+
+    token_counts : bool
+        Add the column TOKENS_COLUMN with the number of tokens of the text of every record
+
+    row_group_size : int
+        Maximum number of records of a row group
+
+    row_group_bytes : int
+        Maximum size of the texts of a row group
+
+    observe : bool
+        Record every row group as a pass through the "write" stage of pipeline.metrics. Off when the caller times the
+        whole write as one pass.
+    """
+
+    def __init__(self, path: str, schema, compression: str = None, token_counts: bool = False, row_group_size: int = ROW_GROUP_SIZE, row_group_bytes: int = ROW_GROUP_BYTES, observe: bool = True):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+
+        self.path = output_path(path, compression, "parquet")
+        self.row_group_size = row_group_size
+        self.row_group_bytes = row_group_bytes
+        self.observe = observe
+        self.count = 0
+
+        self.token_counts = token_counts and TEXT_COLUMN in schema.names
+        self._fields = list(schema)
+        if self.token_counts:
+            schema = schema.append(pa.field(TOKENS_COLUMN, pa.int32()))
+        self.schema = schema
+
+        self._batch = []
+        self._batch_bytes = 0
+        self._raw = open(self.path, "wb")
+        # Dictionaries only pay off for the short, repeated values of the metadata
+        self._writer = pq.ParquetWriter(
+            self._raw, schema, compression=compression or PARQUET_COMPRESSION,
+            use_dictionary=[name for name in schema.names if name != TEXT_COLUMN])
+
+    def write(self, record: dict):
+        self._batch.append(record)
+        self._batch_bytes += len(record.get(TEXT_COLUMN) or "")
+        self.count += 1
+        if len(self._batch) >= self.row_group_size or self._batch_bytes >= self.row_group_bytes:
+            self._write_row_group()
+
+    def write_line(self, line: bytes):
+        """ Write a record that is already serialized as a line of JSON, see :meth:`JSONLWriter.write_line` """
+        self.write(json.loads(line))
+
+    def _column(self, values: list, field):
+        pa = self._pa
+        try:
+            return pa.array(values, type=field.type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+        # Dates and numbers of the metadata come as strings
+        strings = pa.array(values, type=pa.string())
+        try:
+            return strings.cast(field.type)
+        except pa.ArrowInvalid:
+            # A single malformed value does not fail the output, it is written as null
+            return pa.array([_cast_or_null(value, field.type, pa) for value in strings], type=field.type)
+
+    def _write_row_group(self):
+        if not self._batch:
+            return
+        start = time.perf_counter()
+        columns = [self._column([record.get(field.name) for record in self._batch], field) for field in self._fields]
+        if self.token_counts:
+            # The tokens of the text cleaning, str.split() is faster than the Arrow kernels here
+            texts = (record.get(TEXT_COLUMN) for record in self._batch)
+            columns.append(self._pa.array([None if text is None else len(text.split()) for text in texts], type=self._pa.int32()))
+
+        offset = self._raw.tell()
+        self._writer.write_table(self._pa.Table.from_arrays(columns, schema=self.schema), row_group_size=len(self._batch))
+        if self.observe:
+            metrics.observe("write", time.perf_counter() - start, bytes_out=self._raw.tell() - offset)
+        self._batch = []
+        self._batch_bytes = 0
+
+    def sync(self):
+        """ Write the buffered records as a row group and sync the file. It is only readable after :meth:`close`. """
+        self._write_row_group()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+
+    def close(self):
+        if self._raw.closed:
+            return
+        self._write_row_group()
+        offset = self._raw.tell()
+        # Writes the footer with the schema and the row group offsets
+        self._writer.close()
+        if self.observe:
+            metrics.observe("write", 0, bytes_out=self._raw.tell() - offset)
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _cast_or_null(value, type, pa):
+    try:
+        return value.cast(type).as_py()
+    except pa.ArrowInvalid:
+        return None
+
+
+def open_output(path: str, output_format: str = "jsonl", compression: str = None, append: bool = False, schema=None, token_counts: bool = False):
+    """
+    The writer of an output: a :class:`JSONLWriter` or, for the Parquet format, a :class:`ParquetWriter` with the
+    schema. Parquet files cannot be appended to.
+    """
+    if output_format == "parquet":
+        if append:
+            raise ValueError("Parquet outputs cannot be appended to.")
+        return ParquetWriter(path, schema, compression=compression, token_counts=token_counts)
+    if output_format != "jsonl":
+        raise ValueError("Unknown output format '{}'. Choose one of {}.".format(output_format, ", ".join(FORMATS)))
+    return JSONLWriter(path, compression=compression, append=append)
+
+
+def merge_parquet(paths: list, path: str) -> str:
+    """
+    Copy the row groups of Parquet files with the same schema into one file, in the order of paths, one row group at a
+    time. The columns keep the codec of the first file.
+
+    Returns
+    -------
+    path : str
+        The merged file (with the .parquet suffix)
+
+    Raises
+    ------
+    ValueError
+        If paths is empty: the schema of the merged file is taken from the first file
+    """
+    if not paths:
+        raise ValueError("There are no Parquet files to merge.")
+
+    import pyarrow.parquet as pq
+
+    path = output_path(path, output_format="parquet")
+    first = pq.ParquetFile(paths[0])
+    compression = first.metadata.row_group(0).column(0).compression.lower() if first.metadata.num_row_groups else PARQUET_COMPRESSION
+    schema = first.schema_arrow
+    with pq.ParquetWriter(path, schema, compression=compression, use_dictionary=[name for name in schema.names if name != TEXT_COLUMN]) as merged:
+        for source in paths:
+            parquet_file = pq.ParquetFile(source)
+            for i in range(parquet_file.metadata.num_row_groups):
+                merged.write_table(parquet_file.read_row_group(i))
+    return path
+
@@ -0,0 +1,37 @@
+###############################################################################################################################
+#
+# Shared fixtures of the tests.
+#
+# INFO: The tests run from the repository root (python -m pytest) and never touch the network. The text cleaning looks
+#       words up in the vocabulary, which the tests compile from the small word list in fixtures/words.txt instead of
+#       the NLTK corpus, so that the expected outputs do not depend on the installed corpus.
+#
+###############################################################################################################################
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+@pytest.fixture
+def words(tmp_path, monkeypatch):
+    """ Use the word list of the fixtures as the vocabulary of this process """
+    from pipeline import vocabulary
+
+    with open(os.path.join(FIXTURES_DIR, "words.txt")) as f:
+        word_list = f.read().split()
+    monkeypatch.setattr(vocabulary, "_vocabulary", vocabulary.build(str(tmp_path / "vocabulary"), words=word_list))
+    monkeypatch.setattr(vocabulary, "_memo", {})
+    return word_list
+
+
+@pytest.fixture
+def fixtures_dir():
+    return FIXTURES_DIR
@@ -0,0 +1,79 @@
+###############################################################################################################################
+#
+# Tests of the extraction cache in a temp SQLite file.
+#
+# The clock of the cache is replaced by a counter that advances one second per call, so the entries have distinct and
+# ordered times. The texts are random letters of the same length, so their compressed sizes are about equal.
+#
+###############################################################################################################################
+
+import itertools
+import random
+
+import pytest
+
+from pipeline import cache
+
+DIGESTS = ["a" * 64, "b" * 64, "c" * 64, "d" * 64]
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    ticks = itertools.count(1000.0)
+    monkeypatch.setattr(cache.time, "time", lambda: next(ticks))
+
+
+def text(seed, n_chars=4000):
+    rng = random.Random(seed)
+    return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(n_chars))
+
+
+def keys(store):
+    return {row[0].split(":")[0] for row in store._db.execute("SELECT key FROM entries")}
+
+
+def last_used(store, digest):
+    return store._db.execute("SELECT last_used FROM entries WHERE key = ?", (store.key(digest, "pdfminer", "raw"),)).fetchone()[0]
+
+
+def test_hit_and_miss(tmp_path):
+    store = cache.ExtractionCache(str(tmp_path / "cache.sqlite"))
+    store.put(DIGESTS[0], "pdfminer", "raw", text(0))
+    assert store.get(DIGESTS[0], "pdfminer", "raw") == text(0)
+    assert store.get(DIGESTS[0], "pdfminer", "cleaned") is None
+    assert store.get(DIGESTS[1], "pdfminer", "raw") is None
+
+
+def test_eviction_drops_the_least_recently_used(tmp_path):
+    store = cache.ExtractionCache(str(tmp_path / "cache.sqlite"), touch_interval=0)
+    store.put(DIGESTS[0], "pdfminer", "raw", text(0))
+    # Room for three and a half entries: the fourth one evicts one entry to get below EVICT_TO of the limit
+    store.max_size = int(store.size() * 3.5)
+    store.put(DIGESTS[1], "pdfminer", "raw", text(1))
+    store.put(DIGESTS[2], "pdfminer", "raw", text(2))
+    assert store.get(DIGESTS[0], "pdfminer", "raw") == text(0)
+    store.put(DIGESTS[3], "pdfminer", "raw", text(3))
+    assert keys(store) == {DIGESTS[0], DIGESTS[2], DIGESTS[3]}
+    assert store.size() <= store.max_size * cache.EVICT_TO
+
+
+def test_eviction_of_several_entries(tmp_path):
+    store = cache.ExtractionCache(str(tmp_path / "cache.sqlite"), touch_interval=0)
+    store.put(DIGESTS[0], "pdfminer", "raw", text(0))
+    store.max_size = int(store.size() * 3.5)
+    store.put(DIGESTS[1], "pdfminer", "raw", text(1))
+    store.put(DIGESTS[2], "pdfminer", "raw", text(2))
+    store.put(DIGESTS[3], "pdfminer", "raw", text(3, n_chars=8000))
+    assert keys(store) == {DIGESTS[2], DIGESTS[3]}
+
+
+def test_hits_only_touch_entries_after_the_interval(tmp_path):
+    store = cache.ExtractionCache(str(tmp_path / "cache.sqlite"), touch_interval=10)
+    store.put(DIGESTS[0], "pdfminer", "raw", text(0))
+    put = last_used(store, DIGESTS[0])
+    for _ in range(5):
+        store.get(DIGESTS[0], "pdfminer", "raw")
+    assert last_used(store, DIGESTS[0]) == put
+    for _ in range(10):
+        store.get(DIGESTS[0], "pdfminer", "raw")
+    assert last_used(store, DIGESTS[0]) > put
@@ -0,0 +1,99 @@
+###############################################################################################################################
+#
+# Tests of the category queries of the --category flag, on records (matches) and on an inverted index (mask_index).
+#
+# ROWS are the "categories" fields of a few arXiv papers. The index tests build the postings of ROWS, as the metadata
+# index does, and check that both ways of evaluating a query select the same rows.
+#
+###############################################################################################################################
+
+import numpy as np
+import pytest
+
+from helpers.category_query import CategoryQuery
+
+ROWS = [
+    "cs.AI",
+    "cs.AIx",
+    "cs.AI cs.LG",
+    "cs.CL cs.LG",
+    "math.ST stat.ML",
+    "cs.AI math.OC",
+    "",
+    "stat.ML cs.LG",
+]
+
+QUERIES = [
+    "cs.AI",
+    "cs.AI AND cs.LG",
+    "cs.AI OR cs.CL AND cs.LG",
+    "(cs.AI OR cs.CL) AND cs.LG",
+    "NOT cs.AI",
+    "cs.* AND NOT cs.LG",
+    "math.* | stat.ML & !cs.LG",
+    "cs.A*",
+]
+
+
+def selected(expression):
+    query = CategoryQuery(expression)
+    return [row for row in ROWS if query.matches(row)]
+
+
+def postings_of(rows):
+    postings = {}
+    for row_id, row in enumerate(rows):
+        for category in row.split():
+            postings.setdefault(category, []).append(row_id)
+    return {category: np.array(row_ids) for category, row_ids in postings.items()}
+
+
+def test_category_is_matched_exactly():
+    assert selected("cs.AI") == ["cs.AI", "cs.AI cs.LG", "cs.AI math.OC"]
+    assert selected("cs.AIx") == ["cs.AIx"]
+    assert selected("cs") == []
+
+
+def test_and_requires_every_category():
+    assert selected("cs.AI AND cs.LG") == ["cs.AI cs.LG"]
+    assert selected("cs.AI & cs.LG") == ["cs.AI cs.LG"]
+
+
+def test_and_binds_tighter_than_or():
+    assert selected("cs.AI OR cs.CL AND cs.LG") == ["cs.AI", "cs.AI cs.LG", "cs.CL cs.LG", "cs.AI math.OC"]
+    assert selected("(cs.AI OR cs.CL) AND cs.LG") == ["cs.AI cs.LG", "cs.CL cs.LG"]
+
+
+def test_not_binds_tightest():
+    assert selected("NOT cs.LG AND cs.AI") == ["cs.AI", "cs.AI math.OC"]
+    assert selected("NOT (cs.LG OR cs.AI)") == ["cs.AIx", "math.ST stat.ML", ""]
+    assert selected("! ! cs.AIx") == ["cs.AIx"]
+
+
+def test_wildcard_is_a_prefix_match():
+    assert selected("math.*") == ["math.ST stat.ML", "cs.AI math.OC"]
+    assert selected("cs.*") == [row for row in ROWS if "cs." in row]
+    assert selected("cs.A*") == ["cs.AI", "cs.AIx", "cs.AI cs.LG", "cs.AI math.OC"]
+
+
+def test_matches_a_set_of_categories():
+    assert CategoryQuery("cs.AI AND NOT cs.LG").matches({"cs.AI", "math.OC"})
+
+
+@pytest.mark.parametrize("expression", ["", "   ", "cs.AI AND", "AND cs.AI", "cs.AI OR OR cs.LG", "(cs.AI", "cs.AI)",
+                                        "cs.AI cs.LG", "NOT", "c*s.AI", "()"])
+def test_bad_queries_are_rejected(expression):
+    with pytest.raises(ValueError):
+        CategoryQuery(expression)
+
+
+@pytest.mark.parametrize("expression", QUERIES)
+def test_index_agrees_with_matches(expression):
+    query = CategoryQuery(expression)
+    mask = query.mask_index(postings_of(ROWS), len(ROWS))
+    assert mask.dtype == bool and len(mask) == len(ROWS)
+    assert mask.tolist() == [query.matches(row) for row in ROWS]
+
+
+def test_index_of_an_unknown_category():
+    assert not CategoryQuery("hep-th").mask_index(postings_of(ROWS), len(ROWS)).any()
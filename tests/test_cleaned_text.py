@@ -0,0 +1,45 @@
+###############################################################################################################################
+#
+# Golden-output tests of pdf2txt.cleaned_text().
+#
+# The expected outputs in fixtures/cleaned_text.json are those of the original 25-pass implementation (kept as
+# reference_cleaned_text() in benchmarks/bench_cleaned_text.py) with the word list of fixtures/words.txt: short
+# generated papers, random strings over an alphabet that exercises every cleaning step and hand-written edge cases.
+#
+###############################################################################################################################
+
+import json
+import os
+
+import pytest
+
+from pipeline import pdf2txt
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "cleaned_text.json")) as f:
+    GOLDEN = json.load(f)
+
+
+@pytest.mark.parametrize("case", GOLDEN, ids=[str(i) for i in range(len(GOLDEN))])
+def test_golden_output(words, case):
+    assert pdf2txt.cleaned_text(case["text"]) == case["expected"]
+
+
+def test_empty_text(words):
+    assert pdf2txt.cleaned_text("") == ""
+
+
+def test_first_line_up_to_introduction_is_dropped(words):
+    assert pdf2txt.cleaned_text("Some Title by the Author 1 Introduction\nThe model learns.") == "The model ."
+    assert pdf2txt.cleaned_text("Some Title\n1 Introduction\nThe model.") == "Title Introduction The model ."
+
+
+def test_numbers_brackets_and_hyperlinks_are_removed(words):
+    assert pdf2txt.cleaned_text("the model [12] (see https://example.org/x) use 42 data") == "the model see use data"
+
+
+def test_unknown_words_are_removed(words):
+    assert pdf2txt.cleaned_text("the zyxwv model qwerty data") == "the model data"
+
+
+def test_words_are_looked_up_in_lowercase(words):
+    assert pdf2txt.cleaned_text("The Model DATA Zyxwv") == "The Model DATA"
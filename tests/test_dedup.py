@@ -0,0 +1,81 @@
+###############################################################################################################################
+#
+# Tests of the near-duplicate detection with MinHash signatures and the LSH index.
+#
+# The texts are random sequences of made-up words, so two different texts share no shingles. A near-duplicate is a text
+# with one of its 300 words replaced, which changes 5 of its 296 shingles.
+#
+###############################################################################################################################
+
+import json
+import random
+
+import numpy as np
+import pytest
+
+from pipeline import dedup
+
+
+def text(seed, n_words=300):
+    rng = random.Random(seed)
+    return " ".join("".join(rng.choice("abcdefghij") for _ in range(rng.randint(3, 9))) for _ in range(n_words))
+
+
+def edited(text, position=150):
+    words = text.split()
+    words[position] = "edited"
+    return " ".join(words)
+
+
+def test_signature_of_the_same_text():
+    assert np.array_equal(dedup.signature(text(0)), dedup.signature(text(0)))
+    assert dedup.signature(text(0)).dtype == np.uint32 and len(dedup.signature(text(0))) == dedup.NUM_PERM
+    assert dedup.signature("") is None
+
+
+def test_similarity_estimates_the_jaccard_similarity():
+    assert dedup.similarity(dedup.signature(text(0)), dedup.signature(edited(text(0)))) > 0.9
+    assert dedup.similarity(dedup.signature(text(0)), dedup.signature(text(1))) < 0.1
+
+
+def test_near_duplicates_are_clustered(tmp_path):
+    with dedup.Deduplicator() as deduplicator:
+        assert deduplicator.check("a", dedup.signature(text(0))) is None
+        assert deduplicator.check("b", dedup.signature(text(1))) is None
+        assert deduplicator.check("a2", dedup.signature(edited(text(0)))) == "a"
+        assert deduplicator.check("c", dedup.signature(text(2))) is None
+        # Documents without a signature are always kept
+        assert deduplicator.check("empty", None) is None
+
+        report = deduplicator.report(str(tmp_path / "duplicates.json"))
+    assert (report["documents"], report["kept"], report["duplicates"]) == (5, 4, 1)
+    assert [cluster["id"] for cluster in report["clusters"]] == ["a"]
+    assert [duplicate["id"] for duplicate in report["clusters"][0]["duplicates"]] == ["a2"]
+    with open(tmp_path / "duplicates.json") as f:
+        assert json.load(f) == report
+
+
+@pytest.mark.parametrize("merge_every", [1, 3, 1000])
+def test_index_finds_the_documents_of_every_segment(monkeypatch, merge_every):
+    monkeypatch.setattr(dedup, "MERGE_EVERY", merge_every)
+    signatures = [dedup.signature(text(seed)) for seed in range(40)]
+    with dedup.Deduplicator() as deduplicator:
+        for seed, signature in enumerate(signatures):
+            assert deduplicator.check(str(seed), signature) is None
+        for seed in range(40):
+            assert deduplicator.check("copy of {}".format(seed), signatures[seed]) == str(seed)
+
+        # Every segment is sorted and more than SEGMENT_GROWTH times as large as the next one
+        sizes = [len(keys) for keys, docs in deduplicator._segments]
+        assert all(np.all(keys[:-1] <= keys[1:]) for keys, docs in deduplicator._segments)
+        assert all(larger > dedup.SEGMENT_GROWTH * smaller for larger, smaller in zip(sizes, sizes[1:]))
+
+
+def test_merge_sorted():
+    rng = np.random.default_rng(0)
+    first = np.sort(rng.integers(0, 50, size=100, dtype=np.uint64))
+    second = np.sort(rng.integers(0, 50, size=30, dtype=np.uint64))
+    keys, docs = dedup._merge_sorted((first, np.arange(100, dtype=np.uint32)), (second, np.arange(100, 130, dtype=np.uint32)))
+    assert np.array_equal(keys, np.sort(np.concatenate([first, second])))
+    # The documents stay with their keys
+    assert np.array_equal(np.concatenate([first, second])[docs], keys)
@@ -0,0 +1,146 @@
+###############################################################################################################################
+#
+# Tests of the resumable downloader with the "local" backend, which copies the objects from a mirror directory.
+#
+# The mirror in tmp_path holds KEYS, one small file per id. CountingBackend counts the fetches of every key and fails the
+# first fetches of the keys in flaky, to simulate transient errors. Retries run with backoff=0.
+#
+###############################################################################################################################
+
+import json
+import os
+import threading
+from collections import Counter
+
+import pytest
+
+from pipeline import downloader
+
+KEYS = {"0704.0001": "pdf/0704/0704.0001v1.pdf", "0704.0002": "pdf/0704/0704.0002v1.pdf", "0704.0003": "pdf/0704/0704.0003v2.pdf"}
+SIZE = 1000
+
+
+class CountingBackend(downloader.LocalBackend):
+
+    def __init__(self, root, flaky=None, on_fetch=None):
+        super().__init__(root)
+        self.flaky = dict(flaky or {})
+        self.on_fetch = on_fetch
+        self.fetches = Counter()
+
+    def fetch(self, key, outfile):
+        self.fetches[key] += 1
+        if self.on_fetch is not None:
+            self.on_fetch(key, outfile)
+        if self.flaky.get(key, 0) > 0:
+            self.flaky[key] -= 1
+            raise OSError("connection reset")
+        return super().fetch(key, outfile)
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    for key in KEYS.values():
+        path = tmp_path / "mirror" / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"%PDF" + b"x" * (SIZE - 4))
+    return str(tmp_path / "mirror")
+
+
+def download(tmp_path, backend, **kwargs):
+    kwargs.setdefault("workers", 1)
+    kwargs.setdefault("backoff", 0)
+    return downloader.download_all(KEYS.items(), str(tmp_path / "pdfs"), backend, str(tmp_path / "manifest.jsonl"), **kwargs)
+
+
+def test_downloads_every_object(tmp_path, mirror):
+    done = []
+    summary = download(tmp_path, CountingBackend(mirror), on_done=lambda pdf_id, path: done.append((pdf_id, path)))
+    assert summary["done"] == 3 and summary["bytes"] == 3 * SIZE
+    assert sorted(done) == [(pdf_id, str(tmp_path / "pdfs" / os.path.basename(key))) for pdf_id, key in sorted(KEYS.items())]
+    assert [entry for entry in os.listdir(tmp_path / "pdfs") if entry.endswith(".part")] == []
+
+
+def test_resume_skips_the_done_entries(tmp_path, mirror):
+    download(tmp_path, CountingBackend(mirror))
+    # The file of the second id was deleted by its consumer, so it is fetched again
+    os.remove(tmp_path / "pdfs" / os.path.basename(KEYS["0704.0002"]))
+    backend = CountingBackend(mirror)
+    summary = download(tmp_path, backend)
+    assert summary["skipped"] == 2 and summary["done"] == 1
+    assert backend.fetches == {KEYS["0704.0002"]: 1}
+
+
+def test_transient_errors_are_retried(tmp_path, mirror):
+    backend = CountingBackend(mirror, flaky={KEYS["0704.0001"]: 2})
+    summary = download(tmp_path, backend, retries=2)
+    assert summary["done"] == 3 and summary["failed"] == 0
+    assert backend.fetches[KEYS["0704.0001"]] == 3
+
+
+def test_retries_are_limited(tmp_path, mirror):
+    backend = CountingBackend(mirror, flaky={KEYS["0704.0001"]: 5})
+    summary = download(tmp_path, backend, retries=2)
+    assert summary["failed_ids"] == ["0704.0001"]
+    assert backend.fetches[KEYS["0704.0001"]] == 3
+
+
+def test_permanent_errors_are_not_retried(tmp_path, mirror):
+    os.remove(os.path.join(mirror, KEYS["0704.0003"]))
+    backend = CountingBackend(mirror)
+    summary = download(tmp_path, backend, retries=3)
+    assert summary["done"] == 2 and summary["failed_ids"] == ["0704.0003"]
+    assert backend.fetches[KEYS["0704.0003"]] == 1
+    manifest = downloader.load_manifest(str(tmp_path / "manifest.jsonl"))
+    assert manifest["0704.0003"]["status"] == "failed"
+
+
+def test_cancel_removes_the_part_files(tmp_path, mirror):
+    cancel = threading.Event()
+
+    def interrupted(key, outfile):
+        # A crashed copy leaves its .part file behind, and the consumer fails meanwhile
+        with open(outfile + ".stale.part", "w") as f:
+            f.write("partial")
+        cancel.set()
+
+    backend = CountingBackend(mirror, on_fetch=interrupted)
+    summary = download(tmp_path, backend, cancel=cancel)
+    assert summary["cancelled"]
+    # The download in flight is finished, the last one is not started anymore
+    assert backend.fetches[KEYS["0704.0003"]] == 0
+    assert [entry for entry in os.listdir(tmp_path / "pdfs") if entry.endswith(".part")] == []
+
+
+def test_disk_budget_pauses_the_downloads(tmp_path, mirror, monkeypatch):
+    monkeypatch.setattr(downloader, "CANCEL_POLL", 0.01)
+    cancel = threading.Event()
+    budget = downloader.DiskBudget(limit=SIZE)
+    # The consumer never frees the space of the first file, so the run stops until it is cancelled
+    timer = threading.Timer(0.2, cancel.set)
+    timer.start()
+    try:
+        summary = download(tmp_path, CountingBackend(mirror), budget=budget, cancel=cancel)
+    finally:
+        timer.cancel()
+    assert summary["cancelled"] and summary["done"] == 1
+    assert budget.used == SIZE
+
+
+def test_disk_budget_resumes_when_space_is_released(tmp_path, mirror):
+    budget = downloader.DiskBudget(limit=SIZE)
+
+    def consume(pdf_id, path):
+        os.remove(path)
+        budget.release(SIZE)
+
+    summary = download(tmp_path, CountingBackend(mirror), budget=budget, on_done=consume)
+    assert summary["done"] == 3
+    # Only the first download reserves more than a file, before the size of the files is known
+    assert budget.peak == downloader.ESTIMATED_PDF_SIZE and budget.used == 0
+
+
+def test_manifest_ignores_a_torn_line(tmp_path):
+    path = tmp_path / "manifest.jsonl"
+    path.write_text(json.dumps({"id": "a", "status": "failed"}) + "\n" + json.dumps({"id": "a", "status": "done"}) + "\n{\"id\": ")
+    assert downloader.load_manifest(str(path)) == {"a": {"id": "a", "status": "done"}}
@@ -0,0 +1,69 @@
+###############################################################################################################################
+#
+# Tests of the single-pass fixunicode.fix_unicode().
+#
+# The expected outputs in fixtures/fix_unicode.json are those of the original implementation with one regex pass per
+# entry of unicode_mapping followed by NFKC of the whole text (kept as reference_fix_unicode() in
+# benchmarks/bench_fixunicode.py): random strings of the replaced characters, random code points and generated papers
+# with ligatures and typographic quotes.
+#
+###############################################################################################################################
+
+import json
+import os
+import unicodedata
+
+import pytest
+
+from helpers import fixunicode
+from helpers.fixunicode import fix_unicode
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "fix_unicode.json")) as f:
+    GOLDEN = json.load(f)
+
+
+@pytest.mark.parametrize("case", GOLDEN, ids=[str(i) for i in range(len(GOLDEN))])
+def test_golden_output(case):
+    assert fix_unicode(case["text"]) == case["expected"]
+
+
+@pytest.mark.parametrize("text", ["", "plain ASCII text", "tabs\tand\nlines\x0c", "~!@#$%^&*()_+{}|:<>?"])
+def test_ascii_is_returned_as_is(text):
+    assert fix_unicode(text) is text
+
+
+def test_ligatures_and_typography():
+    assert fix_unicode("ﬁnd the eﬃcient ﬂow") == "find the efficient flow"
+    assert fix_unicode("‘single’ “double”") == "'single' \"double\""
+    assert fix_unicode("a\xa0b—c\xadd·e") == "a b-c-d*e"
+
+
+def test_sharp_s_inside_a_word():
+    assert fix_unicode("Straße") == "Strasse"
+    assert fix_unicode("aßb") == "assb"
+
+
+def test_sharp_s_at_the_start_of_a_word_is_kept():
+    # Some papers use it for a beta
+    assert fix_unicode("ß = 0.5") == "ß = 0.5"
+    assert fix_unicode("the ß coefficient") == "the ß coefficient"
+
+
+def test_context_rules_are_skipped_without_their_characters():
+    assert all(triggers for _, _, triggers in fixunicode.context_rules)
+    assert fix_unicode("naïve") == "naïve"
+
+
+@pytest.mark.parametrize("text", [
+    "½ and ①\nplain line\nｆｕｌｌ width",
+    # Combining accents after a letter and at the start of a line
+    "e\u0301\n\u0301a",
+    "\n\n²\n",
+    "ℌ\r\nx\u0308",
+])
+def test_nfkc_per_line_equals_nfkc_of_the_text(text):
+    assert fix_unicode(text) == unicodedata.normalize("NFKC", text)
+
+
+def test_nfkc_only_changes_the_lines_that_are_not_ascii():
+    assert fixunicode._nfkc("ascii line\n½") == "ascii line\n1⁄2"
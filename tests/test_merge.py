@@ -0,0 +1,56 @@
+###############################################################################################################################
+#
+# Tests of the merge of the shard outputs of a sharded arXiv crawl, for line-delimited JSON and Parquet outputs.
+#
+# The shard outputs are written to tmp_path with the writers of pipeline.writer, two records per shard.
+#
+###############################################################################################################################
+
+import json
+import os
+
+import pytest
+
+from datasources import arxiv
+from pipeline import writer
+
+
+def parquet_schema():
+    import pyarrow as pa
+    return pa.schema([pa.field("id", pa.string()), pa.field(writer.TEXT_COLUMN, pa.string())])
+
+
+def write_shards(tmp_path, output_format, n_shards=2):
+    outputs = []
+    for shard in range(n_shards):
+        path = writer.output_path(str(tmp_path / "shard-{}.json".format(shard)), output_format=output_format)
+        with writer.open_output(path, output_format=output_format, schema=parquet_schema()) as output:
+            for i in range(2):
+                output.write({"id": "{}.{}".format(shard, i), writer.TEXT_COLUMN: "text"})
+        outputs.append(output.path)
+    return outputs
+
+
+def test_merge_jsonl_keeps_the_order(tmp_path):
+    path = arxiv.merge_shards(write_shards(tmp_path, "jsonl"), str(tmp_path / "merged.json"))
+    with open(path) as f:
+        assert [json.loads(line)["id"] for line in f] == ["0.0", "0.1", "1.0", "1.1"]
+
+
+def test_merge_parquet_keeps_the_order(tmp_path):
+    import pyarrow.parquet as pq
+    path = arxiv.merge_shards(write_shards(tmp_path, "parquet"), str(tmp_path / "merged.json"))
+    assert path.endswith(writer.PARQUET_SUFFIX)
+    assert pq.read_table(path).column("id").to_pylist() == ["0.0", "0.1", "1.0", "1.1"]
+
+
+def test_merge_without_outputs(tmp_path, capsys):
+    # Every shard failed: nothing is written, not even an empty .json for a Parquet crawl
+    assert arxiv.merge_shards([], str(tmp_path / "merged.json")) is None
+    assert "no shard output" in capsys.readouterr().out
+    assert os.listdir(tmp_path) == []
+
+
+def test_merge_parquet_without_files(tmp_path):
+    with pytest.raises(ValueError):
+        writer.merge_parquet([], str(tmp_path / "merged.parquet"))
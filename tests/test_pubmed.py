@@ -0,0 +1,170 @@
+###############################################################################################################################
+#
+# Tests of the PubMed and PMC Open Access datasource on the small files in fixtures/pubmed and fixtures/pmc.
+#
+# pubmed24n0001.xml is a baseline file with PMIDs 1 to 3 and a book article, pubmed24n0002.xml an update file that
+# revises PMID 2, adds PMID 4 and deletes PMID 3. PMC101.nxml is a JATS article, which the tests pack into a bundle.
+#
+###############################################################################################################################
+
+import json
+import os
+import re
+import tarfile
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from datasources import pubmed
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BASELINE = os.path.join(FIXTURES_DIR, "pubmed", "pubmed24n0001.xml")
+UPDATE = os.path.join(FIXTURES_DIR, "pubmed", "pubmed24n0002.xml")
+ARTICLE = os.path.join(FIXTURES_DIR, "pmc", "PMC101.nxml")
+
+
+def records_of(path):
+    with open(path, "rb") as f:
+        return list(pubmed.iter_pubmed(f))
+
+
+def make_bundle(path, members):
+    """ A PMC bundle with the fixture article under each member name """
+    with tarfile.open(path, "w:gz") as bundle:
+        for name in members:
+            bundle.add(ARTICLE, arcname=name)
+
+
+def test_pubmed_record_fields():
+    kind, key, record = records_of(BASELINE)[0]
+    assert (kind, key) == (pubmed.WRITTEN, 1)
+    assert record == {
+        "id": "1",
+        "pmid": "1",
+        "pmcid": "PMC101",
+        "doi": "10.1000/1",
+        "title": "Tumour growth in mice & men",
+        "authors": "Jane Doe, Roe",
+        "journal": "Journal of Oncology",
+        "year": "2019",
+        "mesh": ["Neoplasms", "Humans"],
+        "categories": "D009369 D006801",
+        "abstract": "Tumours grow. They grow lot faster.",
+        "text": None,
+    }
+
+
+def test_pubmed_record_fallbacks():
+    records = {key: record for _, key, record in records_of(BASELINE)}
+    # The year of a MedlineDate, a collective author and no abstract
+    assert records[2]["year"] == "1998"
+    assert records[2]["authors"] == "The Diabetes Study Group"
+    assert records[2]["abstract"] is None
+    # No publication date and no authors
+    assert records[3]["year"] is None
+    assert records[3]["authors"] == ""
+
+
+def test_book_articles_are_skipped_and_deletions_reported():
+    assert [(kind, key) for kind, key, _ in records_of(BASELINE)] == [(pubmed.WRITTEN, 1), (pubmed.WRITTEN, 2), (pubmed.WRITTEN, 3)]
+    assert [(kind, key) for kind, key, _ in records_of(UPDATE)] == [(pubmed.WRITTEN, 2), (pubmed.WRITTEN, 4), (pubmed.DELETED, 3)]
+
+
+def test_streaming_matches_a_full_parse(tmp_path):
+    # Many articles, so that clearing the tree after every record is exercised
+    with open(BASELINE) as f:
+        xml = f.read()
+    articles = re.findall(r"<PubmedArticle>.*?</PubmedArticle>", xml, flags=re.S)
+    path = tmp_path / "many.xml"
+    body = "".join(article.replace('<PMID Version="1">{}</PMID>'.format(n + 1), '<PMID Version="1">{}</PMID>'.format(i * 3 + n + 1))
+                   for i in range(200) for n, article in enumerate(articles))
+    path.write_text("<PubmedArticleSet>" + body + "</PubmedArticleSet>")
+
+    streamed = [record for _, _, record in records_of(str(path))]
+    parsed = [pubmed.pubmed_record(article) for article in ET.parse(str(path)).getroot().iter("PubmedArticle")]
+    assert len(streamed) == 600
+    assert streamed == parsed
+    assert [record["pmid"] for record in streamed] == [str(pmid) for pmid in range(1, 601)]
+
+
+def test_jats_record_fields():
+    with open(ARTICLE, "rb") as f:
+        record = pubmed.jats_record(f)
+    text = record.pop("text")
+    assert record == {
+        "id": "PMC101",
+        "pmid": "1",
+        "pmcid": "PMC101",
+        "doi": "10.1371/101",
+        "title": "Open access tumour growth",
+        "authors": "Jane Doe",
+        "journal": "PLoS Biology",
+        "year": "2020",
+        "mesh": [],
+        "categories": "Research_Article Cell_Biology",
+        "abstract": "The abstract of paper.",
+    }
+    # Section titles and paragraphs, without figures, tables and references
+    assert text == "Introduction\nTumours grow in mice.\nSee [1] for details."
+
+
+def test_pmc_bundle(tmp_path):
+    path = str(tmp_path / "bundle.tar.gz")
+    make_bundle(path, ["PLoS_Biol/PMC101.nxml", "PLoS_Biol/readme.txt"])
+    with open(path, "rb") as f:
+        entries = list(pubmed.iter_pmc(f))
+    assert [(kind, key, record["id"]) for kind, key, record in entries] == [(pubmed.WRITTEN, 101, "PMC101")]
+
+
+def parse(path, part_dir, category=None):
+    return pubmed.parse_file(path, str(part_dir), category=category, clean_texts=False)
+
+
+def test_latest_records_drop_revised_and_deleted_records(tmp_path):
+    summaries = [parse(BASELINE, tmp_path), parse(UPDATE, tmp_path)]
+    masks = pubmed.latest_records(summaries)
+    # Baseline: 1 is kept, 2 is revised and 3 deleted by the update. Update: the revised 2 and the new 4.
+    assert [mask.tolist() for mask in masks] == [[True, False, False], [True, True]]
+
+
+def test_latest_records_filtered_revision_removes_the_earlier_record(tmp_path):
+    # The revised PMID 2 is also a "Humans" article, the original is not: it only matches in the baseline
+    summaries = [parse(BASELINE, tmp_path, "D003920 AND NOT D006801"), parse(UPDATE, tmp_path, "D003920 AND NOT D006801")]
+    assert [summary["status"].tolist() for summary in summaries] == [
+        [pubmed.FILTERED, pubmed.WRITTEN, pubmed.FILTERED], [pubmed.FILTERED, pubmed.FILTERED, pubmed.DELETED]]
+    assert [mask.tolist() for mask in pubmed.latest_records(summaries)] == [[False], []]
+
+
+def test_pubmed_end_to_end(tmp_path):
+    data_dir = tmp_path / "data"
+    (data_dir / "pubmed").mkdir(parents=True)
+    (data_dir / "pmc").mkdir()
+    for path in (BASELINE, UPDATE):
+        (data_dir / "pubmed" / os.path.basename(path)).write_bytes(open(path, "rb").read())
+    make_bundle(str(data_dir / "pmc" / "oa_comm_xml.PMC000xxxxxx.baseline.tar.gz"), ["PLoS_Biol/PMC101.nxml"])
+    output_path = str(tmp_path / "pubmed_fulltext.json")
+
+    assert pubmed.pubmed(str(data_dir), clean_texts=False, workers=1, output_path=output_path, tmp_dir=str(tmp_path / "tmp"))
+    with open(output_path) as f:
+        records = [json.loads(line) for line in f]
+    # In the order of the files: the PMC bundle, then the baseline without the revised and deleted records
+    assert [record["id"] for record in records] == ["PMC101", "1", "2", "4"]
+    assert records[2]["title"] == "Revised title of article 2"
+    assert not os.path.exists(str(tmp_path / "tmp"))
+
+
+
+def test_files_with_the_same_name_in_different_directories(tmp_path):
+    data_dir = tmp_path / "data"
+    for directory, path in (("2023", BASELINE), ("2024", UPDATE)):
+        (data_dir / directory).mkdir(parents=True)
+        (data_dir / directory / "pubmed.xml").write_bytes(open(path, "rb").read())
+    output_path = str(tmp_path / "pubmed_fulltext.json")
+
+    assert pubmed.pubmed(str(data_dir), clean_texts=False, workers=1, output_path=output_path, tmp_dir=str(tmp_path / "tmp"))
+    with open(output_path) as f:
+        assert [json.loads(line)["id"] for line in f] == ["1", "2", "4"]
+
+@pytest.mark.parametrize("path, kind", [("a/pubmed24n0001.xml.gz", "pubmed"), ("a/x.xml", "pubmed"), ("b/oa.tar.gz", "pmc"), ("b/oa.tgz", "pmc")])
+def test_kind_of(path, kind):
+    assert pubmed.kind_of(path) == kind
@@ -0,0 +1,103 @@
+###############################################################################################################################
+#
+# Tests of the worker pool of the PDF conversion.
+#
+# The workers are separate processes that import this module, so the tasks are run by the module-level function task():
+# numbers are doubled, and the strings SLEEP, CRASH and RAISE make a worker hang past the timeout, exit at once or raise.
+#
+###############################################################################################################################
+
+import os
+import time
+
+import pytest
+
+from pipeline import scheduler
+
+SLEEP = "sleep"
+CRASH = "crash"
+RAISE = "raise"
+PID = "pid"
+
+
+def task(value):
+    if value == SLEEP:
+        time.sleep(60)
+    if value == CRASH:
+        os._exit(3)
+    if value == RAISE:
+        raise ValueError("bad task")
+    if value == PID:
+        return os.getpid()
+    return 2 * value
+
+
+def lost(value, error):
+    return ("lost", value)
+
+
+def run(tasks, **kwargs):
+    kwargs.setdefault("workers", 2)
+    pool = scheduler.Scheduler(task, **kwargs)
+    return pool, list(pool.imap_unordered(tasks))
+
+
+def test_results_of_every_task():
+    pool, results = run(range(10))
+    assert sorted(results) == [2 * value for value in range(10)]
+    assert pool.summary["done"] == 10
+
+
+@pytest.mark.parametrize("chunksize", [1, 3])
+def test_failed_tasks(chunksize):
+    pool, results = run([1, RAISE, 2, 3], chunksize=chunksize, on_failure=lost)
+    assert sorted(results, key=str) == [("lost", RAISE), 2, 4, 6]
+    assert pool.summary["failed"] == [RAISE]
+    assert pool.summary["replaced"] == 0
+
+
+def test_failed_tasks_without_on_failure():
+    pool, results = run([1, RAISE, 2])
+    assert sorted(results) == [2, 4]
+    assert pool.summary["failed"] == [RAISE]
+
+
+@pytest.mark.parametrize("chunksize", [1, 3])
+def test_crashed_worker_is_replaced(chunksize):
+    # With chunks, the tasks after the crash are requeued to another worker
+    pool, results = run([1, CRASH, 2, 3, 4], chunksize=chunksize, on_failure=lost)
+    assert sorted(results, key=str) == [("lost", CRASH), 2, 4, 6, 8]
+    assert pool.summary["crashed"] == [CRASH]
+    assert pool.summary["done"] == 4
+    assert pool.summary["replaced"] == 1
+
+
+def test_timed_out_task_is_killed():
+    start = time.monotonic()
+    pool, results = run([1, SLEEP, 2, 3], chunksize=2, task_timeout=1, on_failure=lost)
+    assert time.monotonic() - start < 30
+    assert sorted(results, key=str) == [("lost", SLEEP), 2, 4, 6]
+    assert pool.summary["timed_out"] == [SLEEP]
+    assert pool.summary["replaced"] == 1
+
+
+def test_every_lost_task_is_reported():
+    pool, results = run([CRASH, RAISE, SLEEP, 1], task_timeout=1, on_failure=lost)
+    assert sorted(results, key=str) == [("lost", CRASH), ("lost", RAISE), ("lost", SLEEP), 2]
+    assert (pool.summary["crashed"], pool.summary["failed"], pool.summary["timed_out"]) == ([CRASH], [RAISE], [SLEEP])
+
+
+def test_workers_are_recycled():
+    pool, pids = run([PID] * 6, workers=1, maxtasksperchild=2)
+    assert len(set(pids)) == 3
+    assert pool.summary["replaced"] == 0
+
+
+def test_tasks_from_a_blocking_iterator():
+    def tasks():
+        for value in range(3):
+            time.sleep(0.1)
+            yield value
+
+    pool, results = run(tasks())
+    assert sorted(results) == [0, 2, 4]
@@ -0,0 +1,110 @@
+###############################################################################################################################
+#
+# Tests of the work queue of sharded crawls and of the arXiv worker on top of it, with the queue in a temp directory.
+#
+# Leases expire at once when a shard is claimed with a negative lease, so the tests do not wait for them. The worker
+# tests replace the download of a shard with a function that only writes the output file.
+#
+###############################################################################################################################
+
+import os
+
+import pytest
+
+from datasources import arxiv
+from pipeline import shards
+
+
+@pytest.fixture
+def queue(tmp_path):
+    with shards.ShardQueue(str(tmp_path / shards.QUEUE_FILE)) as queue:
+        queue.add([10, 10])
+        yield queue
+
+
+def test_claims_every_shard_once(queue):
+    assert queue.claim("a") == 0
+    assert queue.claim("b") == 1
+    assert queue.claim("c") is None
+    assert queue.counts() == {shards.LEASED: 2}
+
+
+def test_expired_lease_is_claimed_again(queue):
+    assert queue.claim("a", lease=-1) == 0
+    assert queue.claim("b") == 0
+    # The first worker lost the shard: it can neither renew it nor complete it
+    assert not queue.renew(0, "a")
+    assert not queue.complete(0, "a", "a.json")
+    assert queue.complete(0, "b", "b.json")
+    assert queue.outputs() == [os.path.join(os.path.dirname(queue.path), shards.OUTPUT_DIR, "b.json")]
+
+
+def test_complete_only_once(queue):
+    assert queue.claim("a") == 0
+    assert queue.complete(0, "a", "a.json")
+    assert not queue.complete(0, "a", "a.json")
+
+
+def test_failed_attempts_are_retried(queue):
+    assert queue.claim("a") == 0
+    queue.fail(0, "a", "broken")
+    assert queue.counts() == {shards.PENDING: 2}
+    assert queue.claim("b") == 0
+
+
+def test_gives_up_after_max_attempts(queue):
+    for attempt in range(shards.MAX_ATTEMPTS - 1):
+        assert queue.claim("a", lease=-1) == 0
+    assert queue.claim("a") == 0
+    queue.fail(0, "a", "broken")
+    assert queue.claim("b") == 1
+    assert queue.claim("c") is None
+    assert queue.failed() == {0: "broken"}
+
+
+def test_gives_up_when_the_last_lease_expires(queue):
+    for attempt in range(shards.MAX_ATTEMPTS):
+        assert queue.claim("a", lease=-1) == 0
+    assert queue.claim("b") == 1
+    assert queue.complete(1, "b", "b.json")
+    assert queue.failed() == {0: None}
+    assert queue.finished()
+
+
+def fake_download(steal_from=None):
+    """ A download of a shard that writes its output. With the path of a queue, it loses the shard to another worker. """
+    def download(arxiv_metadata_df, output_path=None, **kwargs):
+        with open(output_path, "w") as f:
+            f.write("{}\n")
+        if steal_from is not None:
+            other = shards.ShardQueue(steal_from)
+            other._db.execute("UPDATE shards SET lease_until = 0")
+            assert other.claim("other") == 0
+            assert other.complete(0, "other", "other.json")
+            other.close()
+        return True
+    return download
+
+
+def run_worker(tmp_path, monkeypatch, download):
+    with shards.ShardQueue(str(tmp_path / shards.QUEUE_FILE)) as queue:
+        queue.add([10])
+    monkeypatch.setattr(arxiv, "download", download)
+    monkeypatch.setattr(arxiv, "read_shard", lambda crawl_dir, shard: None)
+    is_done = arxiv.work(str(tmp_path), lease=0.3, poll_interval=0.01)
+    with shards.ShardQueue(str(tmp_path / shards.QUEUE_FILE)) as queue:
+        return is_done, queue.outputs()
+
+
+def test_worker_completes_its_shard(tmp_path, monkeypatch):
+    is_done, outputs = run_worker(tmp_path, monkeypatch, fake_download())
+    assert is_done
+    assert len(outputs) == 1 and os.path.isfile(outputs[0])
+
+
+def test_worker_discards_the_output_of_a_lost_shard(tmp_path, monkeypatch):
+    is_done, outputs = run_worker(tmp_path, monkeypatch, fake_download(steal_from=str(tmp_path / shards.QUEUE_FILE)))
+    assert is_done
+    # The shard keeps the output of the worker that claimed it last, the attempt of the first worker is removed
+    assert [os.path.basename(output) for output in outputs] == ["other.json"]
+    assert os.listdir(tmp_path / shards.OUTPUT_DIR) == []
@@ -0,0 +1,103 @@
+###############################################################################################################################
+#
+# Tests of the state of incremental crawls: which papers of a new snapshot a run skips and which ones it processes.
+#
+# Every test works on a fresh SQLite state file in tmp_path. Papers are (id, version) pairs as in the file names of the
+# arXiv PDFs.
+#
+###############################################################################################################################
+
+import pytest
+
+from pipeline import state
+
+
+@pytest.fixture
+def crawl_state(tmp_path):
+    with state.CrawlState(str(tmp_path / "state.sqlite")) as crawl_state:
+        yield crawl_state
+
+
+def test_new_papers_are_pending(crawl_state):
+    assert crawl_state.pending([("0704.0001", 1), ("0704.0002", 3)]) == [True, True]
+
+
+def test_written_papers_are_skipped(crawl_state):
+    crawl_state.mark([("0704.0001", 1)], "written")
+    assert crawl_state.pending([("0704.0001", 1), ("0704.0002", 1)]) == [False, True]
+
+
+def test_new_versions_are_pending(crawl_state):
+    crawl_state.mark([("0704.0001", 2)], "written")
+    assert crawl_state.pending([("0704.0001", 1), ("0704.0001", 2), ("0704.0001", 3)]) == [False, False, True]
+
+
+def test_papers_that_stopped_early_are_pending(crawl_state):
+    crawl_state.mark([("0704.0001", 1)], "downloaded")
+    crawl_state.mark([("0704.0002", 1)], "cleaned")
+    papers = [("0704.0001", 1), ("0704.0002", 1)]
+    assert crawl_state.pending(papers) == [True, True]
+    assert crawl_state.pending(papers, status="extracted") == [True, False]
+    assert crawl_state.pending(papers, status="downloaded") == [False, False]
+
+
+def test_reached_counts_the_later_statuses(crawl_state):
+    crawl_state.mark([("a", 1)], "downloaded")
+    crawl_state.mark([("b", 2)], "extracted")
+    crawl_state.mark([("b", 1), ("c", 1)], "written")
+    assert crawl_state.reached("downloaded") == {"a": 1, "b": 2, "c": 1}
+    assert crawl_state.reached("cleaned") == {"b": 1, "c": 1}
+    assert crawl_state.reached("written") == {"b": 1, "c": 1}
+
+
+def test_status_never_goes_back(crawl_state):
+    crawl_state.mark([("a", 1)], "written")
+    crawl_state.mark([("a", 1)], "downloaded")
+    assert crawl_state.counts() == {"written": 1}
+    assert crawl_state.pending([("a", 1)]) == [False]
+
+
+def test_failed_papers_are_retried_up_to_max_attempts(crawl_state):
+    paper = ("0704.0001", 1)
+    for attempt in range(state.MAX_ATTEMPTS - 1):
+        crawl_state.fail(paper, "broken")
+        assert crawl_state.pending([paper]) == [True]
+    crawl_state.fail(paper, "broken")
+    assert crawl_state.pending([paper]) == [False]
+    assert crawl_state.given_up() == {paper}
+    # A new version of the paper is tried again
+    assert crawl_state.pending([("0704.0001", 2)]) == [True]
+
+
+def test_retry_after_a_failure(crawl_state):
+    paper = ("0704.0001", 1)
+    crawl_state.fail(paper, "timeout")
+    crawl_state.mark([paper], "downloaded")
+    crawl_state.fail(paper, "timeout")
+    crawl_state.mark([paper], "written")
+    assert crawl_state.pending([paper]) == [False]
+    assert crawl_state.given_up() == set()
+    assert crawl_state.counts() == {"written": 1}
+
+
+def test_failure_of_a_new_version_keeps_the_old_one(crawl_state):
+    crawl_state.mark([("a", 1)], "written")
+    for attempt in range(state.MAX_ATTEMPTS):
+        crawl_state.fail(("a", 2), "broken")
+    assert crawl_state.reached("written") == {"a": 1}
+    assert crawl_state.pending([("a", 1), ("a", 2)]) == [False, False]
+
+
+def test_unknown_status(crawl_state):
+    with pytest.raises(ValueError):
+        crawl_state.mark([("a", 1)], "failed")
+
+
+def test_state_is_kept_across_runs(tmp_path):
+    path = str(tmp_path / "state.sqlite")
+    with state.CrawlState(path) as crawl_state:
+        crawl_state.mark([("a", 1)], "written")
+        crawl_state.fail(("b", 1), "broken")
+    with state.CrawlState(path) as crawl_state:
+        assert crawl_state.pending([("a", 1), ("b", 1), ("c", 1)]) == [False, True, True]
+        assert crawl_state.counts() == {"written": 1, state.FAILED: 1}